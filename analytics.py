@@ -0,0 +1,176 @@
+from flask import current_app
+from sqlalchemy import Integer, cast, func, select, union_all
+
+from models import (
+    db,
+    casting_month,
+    rollup_watermark,
+    Actor,
+    Casting,
+    CastingRollup,
+    Movie,
+    StatusType,
+)
+
+
+"""
+Casting counts
+Rows of (month, movie_id, status, castings) over all castings: closed
+months come from CastingRollup, the rest is counted from Casting.
+With STATS_ROLLUP = False everything is counted from Casting
+"""
+
+
+def casting_counts():
+    month = casting_month()
+    live = (
+        select(
+            month.label("month"),
+            Casting.movie_id,
+            Casting.status,
+            func.count().label("castings"),
+        )
+        .where(Casting.movie_id.isnot(None), Casting.casting_date.isnot(None))
+        .group_by(month, Casting.movie_id, Casting.status)
+    )
+
+    watermark = None
+    if current_app.config.get("STATS_ROLLUP", True):
+        watermark = rollup_watermark()
+    if watermark is None:
+        return live.subquery()
+
+    rolled_up = select(
+        CastingRollup.month,
+        CastingRollup.movie_id,
+        CastingRollup.status,
+        CastingRollup.castings,
+    )
+    live = live.where(Casting.casting_date >= watermark)
+    return union_all(rolled_up, live).subquery()
+
+
+def counters(counts):
+    """Casting totals per status of a group of counts rows"""
+
+    def total(*criteria):
+        # sum() of counts is numeric in postgres
+        return cast(
+            func.coalesce(func.sum(counts.c.castings).filter(*criteria), 0), Integer
+        )
+
+    return (
+        total().label("casting_total"),
+        total(counts.c.status == StatusType.accept).label("accepted"),
+        total(counts.c.status == StatusType.reject).label("rejected"),
+        total(counts.c.status == StatusType.in_process).label("in_process"),
+    )
+
+
+def format_counters(row):
+    return {
+        "casting_total": row.casting_total,
+        "accepted": row.accepted,
+        "rejected": row.rejected,
+        "in_process": row.in_process,
+        # Share of all castings which were accepted
+        "acceptance_rate": (
+            round(row.accepted / row.casting_total, 4) if row.casting_total else None
+        ),
+    }
+
+
+def month_range(query, month, start=None, end=None):
+    if start is not None:
+        query = query.where(month >= func.date_trunc("month", start))
+    if end is not None:
+        query = query.where(month < end)
+    return query
+
+
+"""
+Reports
+"""
+
+
+def stats_by_movie(start=None, end=None):
+    counts = casting_counts()
+    # Filtered before the outer join, so movies without castings in range
+    # are still listed
+    counts = month_range(select(counts), counts.c.month, start, end).subquery()
+    query = (
+        select(Movie.id, Movie.title, *counters(counts))
+        .outerjoin(counts, counts.c.movie_id == Movie.id)
+        .group_by(Movie.id)
+        .order_by(Movie.id)
+    )
+
+    return [
+        {"movie_id": row.id, "title": row.title, **format_counters(row)}
+        for row in db.session.execute(query)
+    ]
+
+
+def stats_by_genre(start=None, end=None):
+    counts = casting_counts()
+    genres = select(Movie.id, func.unnest(Movie.genres).label("genre")).subquery()
+    query = (
+        select(genres.c.genre, *counters(counts))
+        .select_from(genres)
+        .join(counts, counts.c.movie_id == genres.c.id)
+        .group_by(genres.c.genre)
+        .order_by(genres.c.genre)
+    )
+    query = month_range(query, counts.c.month, start, end)
+
+    return [
+        {"genre": row.genre, **format_counters(row)}
+        for row in db.session.execute(query)
+    ]
+
+
+def stats_by_month(start=None, end=None):
+    counts = casting_counts()
+    query = (
+        select(counts.c.month, *counters(counts))
+        .group_by(counts.c.month)
+        .order_by(counts.c.month)
+    )
+    query = month_range(query, counts.c.month, start, end)
+
+    return [
+        {"month": row.month.strftime("%Y-%m"), **format_counters(row)}
+        for row in db.session.execute(query)
+    ]
+
+
+def accepted_actor_distribution(start=None, end=None):
+    """Actors with at least one accepted casting, counted once each,
+    by gender and by age group (20-29, 30-39, ...)
+    """
+    age_group = (func.floor(Actor.age / 10) * 10).label("age_group")
+    accepted = select(Casting.actor_id).where(Casting.status == StatusType.accept)
+    accepted = month_range(accepted, casting_month(), start, end)
+
+    query = (
+        select(
+            Actor.gender,
+            age_group,
+            func.grouping(Actor.gender).label("by_age"),
+            func.count().label("actors"),
+        )
+        .where(Actor.id.in_(accepted))
+        .group_by(func.grouping_sets(Actor.gender, age_group))
+        .order_by(Actor.gender, age_group)
+    )
+
+    by_gender = []
+    by_age = []
+    for row in db.session.execute(query):
+        if row.by_age:
+            group = int(row.age_group)
+            by_age.append({"age_group": f"{group}-{group + 9}", "actors": row.actors})
+        else:
+            by_gender.append({"gender": row.gender.value, "actors": row.actors})
+
+    return {"by_gender": by_gender, "by_age_group": by_age}
@@ -15,20 +15,82 @@ collections.MutableMapping = collections.abc.MutableMapping
 collections.MutableSet = collections.abc.MutableSet
 collections.Callable = collections.abc.Callable
 
+import io
+import json
 import os
+import enum
+from datetime import datetime, timedelta
+import click
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, abort, redirect
-from flask_cors import CORS
+from flask import (
+    Flask,
+    current_app,
+    request,
+    jsonify,
+    abort,
+    redirect,
+    stream_with_context,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import lazyload
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import HTTPException
 
+from config import load_config, validate_config
 from models import (
+    db,
     setup_db,
     db_drop_and_create_all,
     setup_migrations,
+    refresh_due_stats,
+    refresh_rollup,
+    available_actors,
+    lock_rows,
+    delete_rows,
+    retryable,
+    UnitOfWork,
     Actor,
     Movie,
     Casting,
+    Change,
+)
+from analytics import (
+    stats_by_movie,
+    stats_by_genre,
+    stats_by_month,
+    accepted_actor_distribution,
+)
+from schemas import (
+    ValidationError,
+    ACTOR_SCHEMA,
+    MOVIE_SCHEMA,
+    AVAILABILITY_SCHEMA,
+    CHANGES_SCHEMA,
+    ID_LIST_SCHEMA,
+    LIST_SCHEMA,
+    STATS_SCHEMA,
 )
-from auth.auth import AuthError, requires_auth
+from auth.auth import AuthError, check_permissions, requires_auth
+from changes import changes_since, stream_changes
+from importer import KINDS, import_rows
+from queries import (
+    actor_by_id,
+    movie_by_id,
+    all_actors,
+    all_movies,
+    actors_by_ids,
+    movies_by_ids,
+    execute_all,
+    setup_prepared_statements,
+)
+from sync import read_delta
+from graph import parse_query, run_query
+from entity_cache import get_entity_cache, setup_entity_cache
+from ratelimit import setup_rate_limits
+from compression import setup_compression
+from metrics import record_auth_failure, setup_metrics
+from profiling import setup_profiling
+from cors import setup_cors
 
 
 load_dotenv()
@@ -39,16 +101,88 @@ CLIENT_ID = os.getenv("CLIENT_ID")
 CALLBACK_URI = os.getenv("CALLBACK_URI")
 
 
-def create_app(test_config=None):
-    # Create and configure the app
+def check_if_match(entity):
+    """Abort with 412 when the client's If-Match header names another version"""
+    if request.if_match and not request.if_match.contains(str(entity.version)):
+        abort(412)
+
+
+def versioned(response, entity):
+    """Tag the response with the entity version, for clients to send as If-Match"""
+    response.set_etag(str(entity.version))
+    return response
+
+
+def cached_response(key, load):
+    """The JSON response of an entity, from the entity cache when it has
+    it. load() returns the version and the body, or None for a 404
+    """
+    cache = get_entity_cache()
+    if cache is None:
+        entry = load()
+    else:
+        # A lagging replica could put back what the last write replaced
+        db.session.info["primary"] = True
+        entry = cache.get(key, load)
+
+    if entry is None:
+        abort(404)
+    version, body = entry
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(str(version))
+    return response
+
+
+def modified_json(entity, changed):
+    """The whole entity, or with ?changes_only=true just the fields that changed"""
+    if request.args.get("changes_only", "false").lower() != "true":
+        return entity.format_json()
+
+    data = {"id": entity.id, "version": entity.version}
+    for field, value in changed.items():
+        if isinstance(value, enum.Enum):
+            value = value.value
+        elif isinstance(value, datetime):
+            value = str(value)
+        data[field] = value
+    return data
+
+
+# Content types of the bulk import
+IMPORT_FORMATS = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+}
+
+
+def create_app(test_config=None, env=None):
+    # Create and configure the app, from the configuration of env (APP_ENV
+    # by default) and test_config on top
+    env = env or os.getenv("APP_ENV", "default")
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_object(load_config(env))
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    validate_config(app.config, env)
+    app.json.compact = app.config["JSON_COMPACT"]
+    setup_db(app, app.config["DATABASE_URL"], app.config["DATABASE_URL_REPLICA"])
     setup_migrations(app)
+    setup_prepared_statements(app)
+    setup_entity_cache(app)
+    # Registered first, so their after_request hooks run last: profiles
+    # cover the whole request, metrics and the access log see the
+    # response as sent
+    setup_profiling(app)
+    setup_metrics(app)
+    setup_compression(app)
 
     """
-    CORS. Allow '*' for origins.
+    CORS. Allow CORS_ORIGINS, '*' by default. Set up before rate limiting,
+    so preflight requests are answered first
     """
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    setup_cors(app)
+    setup_rate_limits(app)
 
     """
     @TODO uncomment the following line to initialize the database
@@ -56,27 +190,54 @@ def create_app(test_config=None):
     !! NOTE THIS MUST BE UNCOMMENTED ON FIRST RUN
     !! Running this function will add data
     """
-    with app.app_context():
-        db_drop_and_create_all()
+    if app.config["SEED_DB"]:
+        with app.app_context():
+            db_drop_and_create_all()
 
     """
-    Use the after_request decorator to set Access-Control-Allow
+    Commands
     """
 
-    @app.after_request
-    def after_request(response):
-        """
-        CORS Headers
-        """
-        response.headers.add(
-            "Access-Control-Allow-Headers", "Content-Type,Authorization,true"
-        )
-        response.headers.add(
-            "Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS"
+    @app.cli.command("refresh-stats")
+    def refresh_stats_command():
+        """Recompute casting stats whose next casting date has passed"""
+        with UnitOfWork():
+            refresh_due_stats()
+
+    @app.cli.command("refresh-rollup")
+    def refresh_rollup_command():
+        """Roll up the castings of the months which have ended"""
+        with UnitOfWork():
+            refresh_rollup()
+
+    @app.cli.command("prune-changes")
+    @click.option("--days", type=int, default=30)
+    def prune_changes_command(days):
+        """Delete the change feed entries older than --days days"""
+        with UnitOfWork():
+            Change.query.filter(
+                Change.created_at < datetime.now() - timedelta(days=days)
+            ).delete()
+
+    @app.cli.command("import")
+    @click.argument("kind", type=click.Choice(sorted(KINDS)))
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", type=click.Choice(["csv", "ndjson"]))
+    @click.option("--chunk-size", type=int, default=5000)
+    def import_command(kind, path, format, chunk_size):
+        """Import actors, movies or castings from a CSV or NDJSON file"""
+        format = format or ("csv" if path.endswith(".csv") else "ndjson")
+        with open(path, encoding="utf-8", newline="") as stream:
+            report = import_rows(kind, stream, format, chunk_size).format_json()
+
+        for error in report["errors"]:
+            click.echo(f"line {error['line']}: {json.dumps(error['errors'])}")
+        click.echo(
+            f"{report['rows']} rows in {report['seconds']}s "
+            f"({report['rows_per_second']} rows/s): {report['inserted']} inserted, "
+            f"{report['updated']} updated, {report['failed']} failed"
         )
 
-        return response
-
     """
     Routes
     """
@@ -98,8 +259,40 @@ def create_app(test_config=None):
     @app.route("/actors", methods=["GET"])
     @requires_auth("get:actors")
     def retrieve_actors(payload):
-        actors = Actor.query.order_by(Actor.fullname).all()
+        args = LIST_SCHEMA.load(request.args.to_dict())
+
+        if "ids" in args:
+            if "updated_since" in args:
+                raise ValidationError({"ids": "Not allowed with updated_since."})
+            found = actors_by_ids(args["ids"])
+            if not found:
+                abort(404)
+
+            return jsonify(
+                {
+                    "success": True,
+                    # In the order of the ids
+                    "actors": [
+                        found[id].format_json() for id in args["ids"] if id in found
+                    ],
+                    "missing": [id for id in args["ids"] if id not in found],
+                }
+            )
 
+        query = all_actors()
+        if "updated_since" in args:
+            actors, deleted, watermark = read_delta(query, Actor, args["updated_since"])
+            return jsonify(
+                {
+                    "success": True,
+                    "actors": [actor.format_json() for actor in actors],
+                    "deleted": deleted,
+                    # Pass as updated_since to get the next changes
+                    "watermark": str(watermark),
+                }
+            )
+
+        actors = execute_all(query)
         if len(actors) == 0:
             abort(404)
 
@@ -110,8 +303,40 @@ def create_app(test_config=None):
     @app.route("/movies", methods=["GET"])
     @requires_auth("get:movies")
     def retrieve_movies(payload):
-        movies = Movie.query.order_by(Movie.release_date, Movie.title).all()
+        args = LIST_SCHEMA.load(request.args.to_dict())
+
+        if "ids" in args:
+            if "updated_since" in args:
+                raise ValidationError({"ids": "Not allowed with updated_since."})
+            found = movies_by_ids(args["ids"])
+            if not found:
+                abort(404)
+
+            return jsonify(
+                {
+                    "success": True,
+                    # In the order of the ids
+                    "movies": [
+                        found[id].format_json() for id in args["ids"] if id in found
+                    ],
+                    "missing": [id for id in args["ids"] if id not in found],
+                }
+            )
+
+        query = all_movies()
+        if "updated_since" in args:
+            movies, deleted, watermark = read_delta(query, Movie, args["updated_since"])
+            return jsonify(
+                {
+                    "success": True,
+                    "movies": [movie.format_json() for movie in movies],
+                    "deleted": deleted,
+                    # Pass as updated_since to get the next changes
+                    "watermark": str(watermark),
+                }
+            )
 
+        movies = execute_all(query)
         if len(movies) == 0:
             abort(404)
 
@@ -119,66 +344,73 @@ def create_app(test_config=None):
             {"success": True, "movies": [movie.format_json() for movie in movies]}
         )
 
+    @app.route("/actors/available", methods=["GET"])
+    @requires_auth("get:actors")
+    def retrieve_available_actors(payload):
+        args = AVAILABILITY_SCHEMA.load(request.args.to_dict())
+        if args["end"] <= args["start"]:
+            raise ValidationError({"end": "Must be after start."})
+
+        actors = (
+            available_actors(**args)
+            .options(lazyload(Actor.stats))
+            .order_by(Actor.fullname)
+            .all()
+        )
+
+        return jsonify(
+            {
+                "success": True,
+                "start": str(args["start"]),
+                "end": str(args["end"]),
+                "actors": [actor.format_summary_json() for actor in actors],
+            }
+        )
+
     @app.route("/actors/<int:actor_id>", methods=["GET"])
     @requires_auth("get:actors")
     def retrieve_actor(payload, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-
-        if actor is None:
-            abort(404)
+        def load():
+            actor = actor_by_id(actor_id)
+            if actor is None:
+                return None
+            body = jsonify({"success": True, "actor": actor.format_json()}).get_data()
+            return actor.version, body
 
-        return jsonify({"success": True, "actor": actor.format_json()})
+        return cached_response(("actor", actor_id), load)
 
     @app.route("/movies/<int:movie_id>", methods=["GET"])
     @requires_auth("get:movies")
     def retrieve_movie(payload, movie_id):
-        movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+        def load():
+            movie = movie_by_id(movie_id)
+            if movie is None:
+                return None
+            body = jsonify({"success": True, "movie": movie.format_json()}).get_data()
+            return movie.version, body
 
-        if movie is None:
-            abort(404)
+        return cached_response(("movie", movie_id), load)
 
-        return jsonify({"success": True, "movie": movie.format_json()})
+    @app.route("/query", methods=["POST"])
+    @requires_auth("get:movies")
+    def graph_query(payload):
+        # Any query can reach actors through castings
+        check_permissions("get:actors", payload)
+        roots, cost = parse_query(
+            request.get_json(),
+            app.config.get("QUERY_MAX_COST", 2000),
+            app.config.get("QUERY_MAX_DEPTH", 4),
+        )
+        return jsonify({"success": True, "data": run_query(roots), "cost": cost})
 
     @app.route("/actors/create", methods=["POST"])
     @requires_auth("post:actor")
+    @UnitOfWork()
     def add_actor(payload):
+        body = ACTOR_SCHEMA.load(request.get_json())
+
         try:
-            body = request.get_json()
-
-            if (
-                "first_name" not in body
-                or "last_name" not in body
-                or "fullname" not in body
-                or "age" not in body
-                or "gender" not in body
-                or "email" not in body
-                or "phone" not in body
-                or "photo_link" not in body
-                or "seeking_movie" not in body
-            ):
-                abort(422)
-
-            first_name = body.get("first_name", None)
-            last_name = body.get("last_name", None)
-            fullname = body.get("fullname", None)
-            age = body.get("age", None)
-            gender = body.get("gender", None)
-            email = body.get("email", None)
-            phone = body.get("phone", None)
-            photo_link = body.get("photo_link", None)
-            seeking_movie = body.get("seeking_movie", None)
-
-            actor = Actor(
-                first_name=first_name,
-                last_name=last_name,
-                fullname=fullname,
-                age=age,
-                gender=gender,
-                email=email,
-                phone=phone,
-                photo_link=photo_link,
-                seeking_movie=seeking_movie,
-            )
+            actor = Actor(fullname=f"{body['first_name']} {body['last_name']}", **body)
             actor.insert()
 
             return jsonify(
@@ -190,34 +422,19 @@ def create_app(test_config=None):
                 }
             )
 
-        except Exception:
+        except DBAPIError as e:
+            if retryable(e):
+                raise
             abort(422)
 
     @app.route("/movies/create", methods=["POST"])
     @requires_auth("post:movie")
+    @UnitOfWork()
     def add_movie(payload):
-        body = request.get_json()
-
-        if not (
-            "title" in body
-            or "genres" in body
-            or "release_date" in body
-            or "seeking_actor" in body
-        ):
-            abort(400)
-
-        title = body.get("title", None)
-        genres = body.get("genres", None)
-        release_date = body.get("release_date", None)
-        seeking_actor = body.get("seeking_actor", None)
+        body = MOVIE_SCHEMA.load(request.get_json())
 
         try:
-            movie = Movie(
-                title=title,
-                genres=genres,
-                release_date=release_date,
-                seeking_actor=seeking_actor,
-            )
+            movie = Movie(**body)
             movie.insert()
 
             return jsonify(
@@ -229,105 +446,104 @@ def create_app(test_config=None):
                 }
             )
 
-        except Exception:
+        except DBAPIError as e:
+            if retryable(e):
+                raise
             abort(422)
 
+    @app.route("/<any(actors, movies, castings):kind>/import", methods=["POST"])
+    @requires_auth("post:import")
+    def import_rows_route(payload, kind):
+        format = IMPORT_FORMATS.get(request.mimetype)
+        if format is None:
+            abort(415)
+
+        # Read as it arrives, never the whole body at once
+        stream = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        try:
+            report = import_rows(
+                kind,
+                stream,
+                format,
+                app.config.get("IMPORT_CHUNK_SIZE", 5000),
+                app.config.get("IMPORT_MAX_ERRORS", 1000),
+            )
+        except UnicodeDecodeError:
+            abort(400)
+
+        return jsonify({"success": True, **report.format_json()})
+
     @app.route("/actors/<int:actor_id>", methods=["PATCH"])
     @requires_auth("patch:actors")
+    @UnitOfWork()
     def modify_actor(payload, actor_id):
-        try:
-            body = request.get_json()
-
-            if (
-                "first_name" not in body
-                or "last_name" not in body
-                or "fullname" not in body
-                or "age" not in body
-                or "gender" not in body
-                or "email" not in body
-                or "phone" not in body
-                or "photo_link" not in body
-                or "seeking_movie" not in body
-            ):
-                abort(422)
-
-            first_name = body.get("first_name", None)
-            last_name = body.get("last_name", None)
-            fullname = body.get("fullname", None)
-            age = body.get("age", None)
-            gender = body.get("gender", None)
-            email = body.get("email", None)
-            phone = body.get("phone", None)
-            photo_link = body.get("photo_link", None)
-            seeking_movie = body.get("seeking_movie", None)
-
-            actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+        changes = ACTOR_SCHEMA.load(request.get_json(), partial=True)
 
-            if actor is None:
-                abort(404)
+        actor = actor_by_id(actor_id)
 
-            actor.first_name = first_name
-            actor.last_name = last_name
-            actor.fullname = fullname
-            actor.age = age
-            actor.gender = gender
-            actor.email = email
-            actor.phone = phone
-            actor.photo_link = photo_link
-            actor.seeking_movie = seeking_movie
+        if actor is None:
+            abort(404)
+
+        check_if_match(actor)
 
+        try:
+            changed = actor.apply_changes(changes)
             actor.update()
+        except StaleDataError:
+            abort(412)
+        except DBAPIError as e:
+            if retryable(e):
+                raise
+            abort(422)
 
-            return jsonify({"success": True, "modified_actor": actor.format_json()})
+        if "first_name" in changed or "last_name" in changed:
+            db.session.expire(actor, ["fullname"])
 
-        except Exception:
-            abort(404)
+        return versioned(
+            jsonify({"success": True, "modified_actor": modified_json(actor, changed)}),
+            actor,
+        )
 
     @app.route("/movies/<int:movie_id>", methods=["PATCH"])
     @requires_auth("patch:movies")
+    @UnitOfWork()
     def modify_movie(payload, movie_id):
-        try:
-            body = request.get_json()
-
-            if (
-                "title" not in body
-                or "genres" not in body
-                or "release_date" not in body
-                or "seeking_actor" not in body
-            ):
-                abort(422)
+        changes = MOVIE_SCHEMA.load(request.get_json(), partial=True)
 
-            title = body.get("title", None)
-            genres = body.get("genres", None)
-            release_date = body.get("release_date", None)
-            seeking_actor = body.get("seeking_actor", None)
+        movie = movie_by_id(movie_id)
 
-            movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
-
-            if movie is None:
-                abort(404)
+        if movie is None:
+            abort(404)
 
-            movie.title = title
-            movie.genres = genres
-            movie.release_date = release_date
-            movie.seeking_actor = seeking_actor
+        check_if_match(movie)
 
+        try:
+            changed = movie.apply_changes(changes)
             movie.update()
+        except StaleDataError:
+            abort(412)
+        except DBAPIError as e:
+            if retryable(e):
+                raise
+            abort(422)
 
-            return jsonify({"success": True, "modified_movie": movie.format_json()})
-
-        except Exception:
-            abort(404)
+        return versioned(
+            jsonify({"success": True, "modified_movie": modified_json(movie, changed)}),
+            movie,
+        )
 
     @app.route("/actors/<int:actor_id>", methods=["DELETE"])
     @requires_auth("delete:actors")
+    @UnitOfWork()
     def delete_actor(payload, actor_id):
         try:
-            actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
+            locked = lock_rows(Actor, [actor_id])
 
-            if actor is None:
+            if not locked:
                 abort(404)
 
+            check_if_match(locked[0])
+
             # if len(actor.castings) > 0:
             #     return (
             #         jsonify(
@@ -340,22 +556,57 @@ def create_app(test_config=None):
             #         422,
             #     )
 
-            actor.delete()
+            deleted, castings = delete_rows(Actor, locked)
 
-            return jsonify({"success": True, "deleted_actor": actor.format_json()})
+            return jsonify(
+                {
+                    "success": True,
+                    "deleted_actor": deleted[0],
+                    "deleted_castings": castings,
+                }
+            )
 
-        except Exception:
+        except HTTPException:
+            raise
+        except Exception as e:
+            if retryable(e):
+                raise
             abort(404)
 
+    @app.route("/actors", methods=["DELETE"])
+    @requires_auth("delete:actors")
+    @UnitOfWork()
+    def delete_actors(payload):
+        ids = ID_LIST_SCHEMA.load(request.args.to_dict())["ids"]
+        actors = lock_rows(Actor, ids)
+
+        if not actors:
+            abort(404)
+
+        deleted, castings = delete_rows(Actor, actors)
+        found = {row.id for row in actors}
+
+        return jsonify(
+            {
+                "success": True,
+                "deleted_actors": deleted,
+                "deleted_castings": castings,
+                "missing": [id for id in ids if id not in found],
+            }
+        )
+
     @app.route("/movies/<int:movie_id>", methods=["DELETE"])
     @requires_auth("delete:movies")
+    @UnitOfWork()
     def delete_movie(payload, movie_id):
         try:
-            movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
+            locked = lock_rows(Movie, [movie_id])
 
-            if movie is None:
+            if not locked:
                 abort(404)
 
+            check_if_match(locked[0])
+
             # if len(movie.castings) > 0:
             #     return (
             #         jsonify(
@@ -368,15 +619,113 @@ def create_app(test_config=None):
             #         422,
             #     )
 
-            movie.delete()
+            deleted, castings = delete_rows(Movie, locked)
 
-            return jsonify({"success": True, "deleted_movie": movie.format_json()})
+            return jsonify(
+                {
+                    "success": True,
+                    "deleted_movie": deleted[0],
+                    "deleted_castings": castings,
+                }
+            )
 
-        except Exception:
+        except HTTPException:
+            raise
+        except Exception as e:
+            if retryable(e):
+                raise
             abort(404)
 
+    @app.route("/movies", methods=["DELETE"])
+    @requires_auth("delete:movies")
+    @UnitOfWork()
+    def delete_movies(payload):
+        ids = ID_LIST_SCHEMA.load(request.args.to_dict())["ids"]
+        movies = lock_rows(Movie, ids)
+
+        if not movies:
+            abort(404)
+
+        deleted, castings = delete_rows(Movie, movies)
+        found = {row.id for row in movies}
+
+        return jsonify(
+            {
+                "success": True,
+                "deleted_movies": deleted,
+                "deleted_castings": castings,
+                "missing": [id for id in ids if id not in found],
+            }
+        )
+
     """
-    Error handler for 400, 404, 405, 422, 500
+    Analytics
+    Aggregated in SQL, optionally limited to the castings from the month
+    of ?start= to before ?end=
+    """
+
+    @app.route("/stats/movies", methods=["GET"])
+    @requires_auth("get:stats")
+    def retrieve_movie_stats(payload):
+        args = STATS_SCHEMA.load(request.args.to_dict())
+        return jsonify({"success": True, "movies": stats_by_movie(**args)})
+
+    @app.route("/stats/genres", methods=["GET"])
+    @requires_auth("get:stats")
+    def retrieve_genre_stats(payload):
+        args = STATS_SCHEMA.load(request.args.to_dict())
+        return jsonify({"success": True, "genres": stats_by_genre(**args)})
+
+    @app.route("/stats/months", methods=["GET"])
+    @requires_auth("get:stats")
+    def retrieve_month_stats(payload):
+        args = STATS_SCHEMA.load(request.args.to_dict())
+        return jsonify({"success": True, "months": stats_by_month(**args)})
+
+    @app.route("/stats/actors", methods=["GET"])
+    @requires_auth("get:stats")
+    def retrieve_accepted_actor_stats(payload):
+        args = STATS_SCHEMA.load(request.args.to_dict())
+        return jsonify({"success": True, **accepted_actor_distribution(**args)})
+
+    @app.route("/changes", methods=["GET"])
+    @requires_auth("get:changes")
+    def retrieve_changes(payload):
+        args = CHANGES_SCHEMA.load(request.args.to_dict())
+        changes = changes_since(args.get("since"), args.get("limit", 100))
+
+        return jsonify(
+            {
+                "success": True,
+                "changes": [change.format_json() for change in changes],
+                # Pass as since to get the next changes
+                "cursor": changes[-1].cursor if changes else request.args.get("since"),
+            }
+        )
+
+    @app.route("/changes/stream", methods=["GET"])
+    @requires_auth("get:changes")
+    def stream_changes_route(payload):
+        args = request.args.to_dict()
+        # Sent by browsers when they reconnect
+        if "Last-Event-ID" in request.headers:
+            args["since"] = request.headers["Last-Event-ID"]
+        args = CHANGES_SCHEMA.load(args)
+
+        # Ends before the 30 second timeout of gunicorn's sync workers
+        events = stream_changes(
+            args.get("since"),
+            app.config.get("CHANGES_POLL_SECONDS", 1),
+            app.config.get("CHANGES_STREAM_SECONDS", 25),
+        )
+        return app.response_class(
+            stream_with_context(events),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    """
+    Error handler for 400, 404, 405, 412, 415, 422, 500
     """
 
     @app.errorhandler(400)
@@ -397,6 +746,28 @@ def create_app(test_config=None):
             405,
         )
 
+    @app.errorhandler(412)
+    def precondition_failed(error):
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "error": 412,
+                    "message": "Resource was modified by another request",
+                }
+            ),
+            412,
+        )
+
+    @app.errorhandler(415)
+    def unsupported_media_type(error):
+        return (
+            jsonify(
+                {"success": False, "error": 415, "message": "Unsupported Media Type"}
+            ),
+            415,
+        )
+
     @app.errorhandler(422)
     def unprocessable(error):
         return (
@@ -415,12 +786,31 @@ def create_app(test_config=None):
             500,
         )
 
+    """
+    Error handler for ValidationError
+    """
+
+    @app.errorhandler(ValidationError)
+    def handle_validation_error(error):
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "error": error.status_code,
+                    "message": "Unprocessable resource",
+                    "errors": error.errors,
+                }
+            ),
+            error.status_code,
+        )
+
     """
     Error handler for AuthError
     """
 
     @app.errorhandler(AuthError)
     def handle_auth_error(error):
+        record_auth_failure(error.error["code"])
         return (
             jsonify(
                 {
@@ -435,8 +825,7 @@ def create_app(test_config=None):
     return app
 
 
-# Initializing the app for gunicorn
-app = create_app()
-
+# No app is created on import, which would seed the database. gunicorn
+# and the flask command call create_app themselves
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080, debug=True)
+    create_app().run(host="0.0.0.0", port=8080)
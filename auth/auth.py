@@ -1,12 +1,16 @@
 from dotenv import load_dotenv
 import os
 import json
-from flask import request
+import threading
+import time
+from flask import Response, request
 from functools import wraps
 import jwt
 from jose import jwt
 from urllib.request import urlopen
 
+from ratelimit import get_limiter
+
 
 # Take environment variables from ".env"
 # (file should be in the root directory of your project)
@@ -15,6 +19,9 @@ load_dotenv()
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "fs2022nd.us.auth0.com")
 API_AUDIENCE = os.getenv("API_AUDIENCE", "Casting_Agency_FSND")
 ALGORITHMS = os.getenv("ALGORITHMS", ["RS256"])
+JWKS_URL = os.getenv("JWKS_URL", f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
+# How long fetched signing keys are trusted before they are fetched again
+JWKS_CACHE_SECONDS = int(os.getenv("JWKS_CACHE_SECONDS", "3600"))
 
 
 # AuthError Exception
@@ -92,21 +99,84 @@ def check_permissions(permission, payload):
     return True
 
 
+# JSON Web Key Set
+
+
+class KeyStore:
+    """Caches the JWKS, so the signing keys are not downloaded on every request.
+    Keys can also be installed directly, e.g. by the offline test provider
+    """
+
+    def __init__(self, url, max_age):
+        self.url = url
+        self.max_age = max_age
+        self.jwks = None
+        self.fetched_at = 0.0
+        self.refresh = True
+        self.lock = threading.Lock()
+
+    def fetch(self):
+        with urlopen(self.url) as response:
+            self.install(json.loads(response.read()))
+
+    def use_url(self, url):
+        """Fetch the keys from url from now on"""
+        with self.lock:
+            self.url = url
+            self.jwks = None
+            self.refresh = True
+
+    def install(self, jwks, refresh=True):
+        """Use jwks as the signing keys. With refresh=False they are never
+        replaced by keys fetched from the identity provider
+        """
+        self.jwks = jwks
+        self.fetched_at = time.monotonic()
+        self.refresh = refresh
+
+    def get_keys(self, kid):
+        """Return the keys, fetching them again when they are stale
+        or don't contain kid (the signing key was rotated)
+        """
+        with self.lock:
+            if self.jwks is None:
+                self.fetch()
+            elif self.refresh:
+                age = time.monotonic() - self.fetched_at
+                if age >= self.max_age:
+                    self.fetch()
+                elif age >= 60 and all(key["kid"] != kid for key in self.jwks["keys"]):
+                    # Throttled, so tokens with made up kids can't make us
+                    # hammer the identity provider
+                    self.fetch()
+            return self.jwks["keys"]
+
+
+key_store = KeyStore(JWKS_URL, JWKS_CACHE_SECONDS)
+
+
 def verify_decode_jwt(token):
     """
     Use https://stackoverflow.com/questions/62640016/decoding-jwt-autherror
     -code-invalid-header-description-unable-to-pa
     """
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except jwt.JWTError:
+        raise AuthError(
+            {
+                "code": "invalid_header",
+                "description": "Unable to parse authentication token.",
+            },
+            400,
+        )
     rsa_key = {}
     if "kid" not in unverified_header:
         raise AuthError(
             {"code": "invalid_header", "description": "Authorization malformed."}, 401
         )
 
-    for key in jwks["keys"]:
+    for key in key_store.get_keys(unverified_header["kid"]):
         if key["kid"] == unverified_header["kid"]:
             rsa_key = {
                 "kty": key["kty"],
@@ -163,11 +233,37 @@ def requires_auth(permission=""):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
+            limiter = get_limiter()
+            try:
+                token = get_token_auth_header()
+                payload = verify_decode_jwt(token)
+            except AuthError:
+                # Without a valid token the caller is limited by address
+                if limiter is not None and "Authorization" in request.headers:
+                    limiter.check_anonymous()
+                raise
+
+            if limiter is None:
+                check_permissions(permission, payload)
+                return f(payload, *args, **kwargs)
+
+            limiter.check_authenticated(payload)
             check_permissions(permission, payload)
-            return f(payload, *args, **kwargs)
+            key = limiter.acquire(payload)
+            try:
+                response = f(payload, *args, **kwargs)
+            except BaseException:
+                limiter.release(key)
+                raise
+            if isinstance(response, Response) and response.is_streamed:
+                # A stream runs after the view returns, until it is closed
+                response.call_on_close(lambda: limiter.release(key))
+            else:
+                limiter.release(key)
+            return response
 
+        # Tells the anonymous rate limit that this route checks the token
+        wrapper.verifies_token = True
         return wrapper
 
     return requires_auth_decorator
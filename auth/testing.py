@@ -0,0 +1,139 @@
+import base64
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+
+from auth.auth import API_AUDIENCE, AUTH0_DOMAIN, key_store
+
+
+# Permissions of each role, as configured in Auth0
+ROLE_PERMISSIONS = {
+    "casting_assistant": ["get:actors", "get:movies"],
+    "casting_director": [
+        "get:actors",
+        "get:movies",
+        "post:actor",
+        "delete:actors",
+        "patch:actors",
+        "patch:movies",
+        "get:stats",
+    ],
+    "executive_producer": [
+        "get:actors",
+        "get:movies",
+        "post:actor",
+        "post:movie",
+        "delete:actors",
+        "delete:movies",
+        "patch:actors",
+        "patch:movies",
+        "get:stats",
+        "post:import",
+        "get:changes",
+        "get:profiles",
+    ],
+}
+
+
+def b64_uint(value):
+    """Encode an RSA number the way JWKS does (base64url, no padding)"""
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+"""
+LocalAuthProvider
+Stands in for Auth0: owns an RSA key pair, publishes its public half
+as a JWKS and mints RS256 tokens for any permissions, so the real
+verify_decode_jwt path runs without network access
+"""
+
+
+class LocalAuthProvider:
+    def __init__(self, kid=None):
+        self.kid = kid or uuid.uuid4().hex
+        self.private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+        self.private_pem = self.private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        numbers = self.private_key.public_key().public_numbers()
+        self.jwks = {
+            "keys": [
+                {
+                    "kty": "RSA",
+                    "kid": self.kid,
+                    "use": "sig",
+                    "alg": "RS256",
+                    "n": b64_uint(numbers.n),
+                    "e": b64_uint(numbers.e),
+                }
+            ]
+        }
+
+    def install(self):
+        """Make the API trust this provider's key instead of Auth0's"""
+        key_store.install(self.jwks, refresh=False)
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Serve the JWKS over HTTP like Auth0 does and point the API at it,
+        so fetching the keys is exercised too. Returns the JWKS url
+        """
+        body = json.dumps(self.jwks).encode()
+
+        class JWKSHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), JWKSHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        url = f"http://{host}:{self.server.server_port}/.well-known/jwks.json"
+        key_store.use_url(url)
+        return url
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def token(self, permissions, sub="local|test-user", expires_in=3600, **claims):
+        now = int(time.time())
+        payload = {
+            "iss": f"https://{AUTH0_DOMAIN}/",
+            "aud": API_AUDIENCE,
+            "sub": sub,
+            "iat": now,
+            "exp": now + expires_in,
+            "permissions": list(permissions),
+        }
+        payload.update(claims)
+        return jwt.encode(
+            payload, self.private_pem, algorithm="RS256", headers={"kid": self.kid}
+        )
+
+    def role_token(self, role, **kwargs):
+        kwargs.setdefault("sub", f"local|{role}")
+        return self.token(ROLE_PERMISSIONS[role], **kwargs)
+
+    def expired_token(self, role="executive_producer"):
+        return self.role_token(role, expires_in=-60)
+
+    def forged_token(self, role="executive_producer"):
+        """A token naming our key id but signed with another key"""
+        return LocalAuthProvider(kid=self.kid).role_token(role)
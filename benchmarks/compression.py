@@ -0,0 +1,125 @@
+"""
+Response compression benchmark
+Builds GET /actors and GET /movies bodies of a chosen size and reports,
+for each encoding and level, the bytes on the wire and the CPU time to
+compress them, and the cost of a hit in the compressed cache.
+
+    python -m benchmarks.compression [--actors 500] [--movies 100]
+"""
+
+import argparse
+import json
+import random
+import timeit
+
+from compression import ENCODERS, CompressedCache
+
+
+PHOTO_LINK = "https://images.unsplash.com/photo-1631084655463-e671365ec05f?ixlib=rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=774&q=80"
+
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 11)}
+
+
+def actors_body(n, rng):
+    actors = [
+        {
+            "id": i,
+            "first_name": f"First{i}",
+            "last_name": f"Last{i}",
+            "full_name": f"First{i} Last{i}",
+            "age": rng.randint(18, 80),
+            "gender": rng.choice(["male", "female"]),
+            "email": f"actor{i}@example.com",
+            "phone": f"{rng.randrange(10**9, 10**10)}",
+            "photo_link": PHOTO_LINK,
+            "seeking_movie": rng.random() < 0.5,
+            "casting_total": 10,
+            "castings_upcoming": 4,
+            "castings_past": 6,
+            "casting_reject": 2,
+            "movies_success": [
+                {"movie": f"Movie {rng.randrange(200)}", "role": "Lead"}
+                for j in range(rng.randrange(4))
+            ],
+            "version": 1,
+        }
+        for i in range(1, n + 1)
+    ]
+    return {"success": True, "actors": actors}
+
+
+def movies_body(n, rng):
+    movies = [
+        {
+            "id": i,
+            "title": f"Movie {i}",
+            "genres": rng.sample(["Drama", "Comedy", "Thriller", "TV show"], 2),
+            "release_date": "2023-08-01 00:00:00",
+            "seeking_actor": rng.random() < 0.5,
+            "accepted_actors": [
+                {"actor": f"First{j} Last{j}", "role": "Lead"}
+                for j in rng.sample(range(2000), rng.randrange(6))
+            ],
+            "casting_total": 10,
+            "castings_upcoming": 4,
+            "castings_past": 6,
+            "casting_reject": 2,
+            "version": 1,
+        }
+        for i in range(1, n + 1)
+    ]
+    return {"success": True, "movies": movies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--actors", type=int, default=500)
+    parser.add_argument("--movies", type=int, default=100)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    bodies = {
+        "GET /actors": actors_body(args.actors, rng),
+        "GET /movies": movies_body(args.movies, rng),
+    }
+
+    print(f"{'body':<24} {'encoding':<10} {'bytes':>9} {'ratio':>7} {'us/request':>11}")
+    for name, body in bodies.items():
+        # Pretty printed as in debug mode, and compact
+        for layout, indent in (("pretty", 2), ("compact", None)):
+            data = json.dumps(body, indent=indent).encode()
+            label = f"{name} ({layout})"
+            print(f"{label:<24} {'identity':<10} {len(data):>9} {1:>7.2f}")
+
+            for encoding, encode in ENCODERS.items():
+                for level in LEVELS[encoding]:
+                    size = len(encode(data, level))
+                    seconds = min(
+                        timeit.repeat(
+                            lambda: encode(data, level), number=args.number, repeat=3
+                        )
+                    )
+                    print(
+                        f"{'':<24} {f'{encoding}-{level}':<10} {size:>9} "
+                        f"{size / len(data):>7.2f} "
+                        f"{seconds / args.number * 1e6:>11.0f}"
+                    )
+
+            cache = CompressedCache()
+            cache.compress("gzip", 6, data)
+            seconds = min(
+                timeit.repeat(
+                    lambda: cache.compress("gzip", 6, data),
+                    number=args.number,
+                    repeat=3,
+                )
+            )
+            print(
+                f"{'':<24} {'cache hit':<10} {'':>9} {'':>7} "
+                f"{seconds / args.number * 1e6:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
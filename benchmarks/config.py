@@ -0,0 +1,89 @@
+"""
+Configuration benchmark
+Drives the same requests through the app built with the development
+(debug) configuration and with the production one, and prints the
+requests per second and the response size of each. Both run in this
+process, without the access log, the rate limits or the network in
+the way.
+
+    DATABASE_URL_BENCH=postgresql://... python -m benchmarks.config \
+        [--number 500]
+
+The database is seeded when it has no actor 1 yet.
+"""
+
+import argparse
+import os
+import time
+
+from app import create_app
+from auth.testing import LocalAuthProvider
+from models import db, seed_db, UnitOfWork, Actor, Movie
+
+REQUESTS = {
+    "GET /actors": ("get", "/actors", None),
+    "GET /movies/1": ("get", "/movies/1", None),
+    "GET /movies/999": ("get", "/movies/999", None),
+    "POST /actors/create (422)": ("post", "/actors/create", {"age": "x"}),
+}
+
+
+def measure(app, token, method, path, body, number):
+    """Requests per second and bytes per response"""
+    client = app.test_client()
+    headers = {"Authorization": f"Bearer {token}"}
+    send = getattr(client, method)
+    # Warm up the connection pool and the statement caches
+    size = len(send(path, json=body, headers=headers).data)
+    start = time.perf_counter()
+    for _ in range(number):
+        send(path, json=body, headers=headers)
+    return number / (time.perf_counter() - start), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL_BENCH"))
+    parser.add_argument("--number", type=int, default=500)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL_BENCH or pass --database-url")
+
+    provider = LocalAuthProvider()
+    provider.install()
+    token = provider.role_token("executive_producer")
+
+    overrides = {
+        "DATABASE_URL": args.database_url,
+        "DATABASE_URL_REPLICA": None,
+        "SEED_DB": False,
+        "RATELIMIT_ENABLED": False,
+        "ACCESS_LOG": False,
+    }
+    apps = {
+        env: create_app(overrides, env=env) for env in ("development", "production")
+    }
+
+    with apps["production"].app_context():
+        if db.session.get(Actor, 1) is None or db.session.get(Movie, 1) is None:
+            with UnitOfWork():
+                seed_db()
+
+    print(f"{'':<28} {'requests/s':^27} {'bytes':^15}")
+    print(
+        f"{'request':<28} {'devel.':>9} {'production':>10} {'ratio':>6}"
+        f" {'devel.':>7} {'prod.':>7}"
+    )
+    for name, (method, path, body) in REQUESTS.items():
+        (debug_rate, debug_size), (rate, size) = (
+            measure(app, token, method, path, body, args.number)
+            for app in apps.values()
+        )
+        print(
+            f"{name:<28} {debug_rate:>9.0f} {rate:>10.0f} {rate / debug_rate:>5.2f}x"
+            f" {debug_size:>7} {size:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+"""
+Load test and latency benchmark
+Seeds a database with a chosen number of rows, signs local tokens for
+every role and drives each route of create_app from concurrent clients.
+Reports p50/p95/p99 latency, throughput and SQL queries per request,
+and saves the results as JSON to compare runs across commits.
+
+    DATABASE_URL_BENCH=postgresql://... python -m benchmarks.load \
+        --actors 4000 --movies 2000 --castings 20000 --concurrency 8
+
+The benchmark database is dropped and recreated.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import count
+
+from sqlalchemy import event, insert, text
+from sqlalchemy.engine import Engine
+
+from app import create_app
+from auth.testing import LocalAuthProvider
+from models import (
+    db,
+    refresh_stats,
+    Actor,
+    Movie,
+    Casting,
+    GenderType,
+    StatusType,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+PHOTO_LINK = "https://images.unsplash.com/photo-1631084655463-e671365ec05f?ixlib=rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=774&q=80"
+
+
+"""
+Query counting
+Every statement sent by any engine is counted against the request
+running in the same thread
+"""
+
+_local = threading.local()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    _local.queries = getattr(_local, "queries", 0) + 1
+
+
+def seed(actors, movies, castings, rng):
+    """Bulk insert the benchmark data set"""
+    db.drop_all()
+    db.create_all()
+
+    now = datetime.now()
+    db.session.execute(
+        insert(Movie.__table__),
+        [
+            {
+                "title": f"Movie {i}",
+                "genres": [rng.choice(["Drama", "Comedy", "TV show", "Action"])],
+                "release_date": now + timedelta(days=rng.randint(-700, 700)),
+                "seeking_actor": rng.random() < 0.5,
+                "version": 1,
+            }
+            for i in range(movies)
+        ],
+    )
+    db.session.execute(
+        insert(Actor.__table__),
+        [
+            {
+                "first_name": f"First{i}",
+                "last_name": f"Last{i}",
+                "age": rng.randint(18, 80),
+                "gender": rng.choice(list(GenderType)),
+                "email": f"actor{i}@bench.local",
+                "phone": f"{i:010d}",
+                "photo_link": PHOTO_LINK,
+                "seeking_movie": rng.random() < 0.5,
+                "version": 1,
+            }
+            for i in range(actors)
+        ],
+    )
+    db.session.execute(
+        insert(Casting.__table__),
+        [
+            {
+                "actor_id": rng.randint(1, actors),
+                "movie_id": rng.randint(1, movies),
+                "role": rng.choice(["main", "second", "extra"]),
+                "casting_date": now + timedelta(hours=rng.randint(-8760, 8760)),
+                "casting_address": "123 Bench street, New York, NY, 12345",
+                "status": rng.choice(list(StatusType)),
+            }
+            for i in range(castings)
+        ],
+    )
+    # Bulk inserts skip the ORM, so the stats are computed once at the end
+    refresh_stats()
+    db.session.commit()
+
+
+"""
+Scenarios
+One per route of create_app and per way of calling it, except /login,
+/logout, /changes/stream, /metrics and /profiles. Each returns the
+request to send for the n-th call: a JSON body, or a (content type,
+text) pair for the imports. Ids are picked so writes never collide with
+each other
+"""
+
+# Rows per request of the bulk routes
+DELETE_BATCH = 4
+IMPORT_ROWS = 50
+IDS_BATCH = 20
+
+
+def scenarios(args, tokens, since):
+    emails = count()
+    # Deletes consume the highest ids, the other routes use the lowest half
+    actor_deletes = count(args.actors, -1)
+    movie_deletes = count(args.movies, -1)
+
+    def batch(deletes):
+        return ",".join(str(next(deletes)) for _ in range(DELETE_BATCH))
+
+    def actor_body(n):
+        i = next(emails)
+        return {
+            "first_name": "Bench",
+            "last_name": f"Actor{i}",
+            "age": 30,
+            "gender": "female",
+            "email": f"new{i}@bench.local",
+            "phone": f"new{i:010d}",
+            "photo_link": PHOTO_LINK,
+            "seeking_movie": True,
+        }
+
+    movie_body = {
+        "title": "Bench movie",
+        "genres": ["Drama"],
+        "release_date": "2030.01.01",
+        "seeking_actor": True,
+    }
+
+    reader = tokens["casting_assistant"]
+    director = tokens["casting_director"]
+    producer = tokens["executive_producer"]
+
+    def pick(n, total):
+        return n % (total // 2) + 1
+
+    def picks(n, total):
+        return ",".join(str(pick(n * IDS_BATCH + i, total)) for i in range(IDS_BATCH))
+
+    def window(n, hours=0):
+        start = datetime(2026, 1, 1) + timedelta(days=n % 365, hours=10 + hours)
+        return start.isoformat()
+
+    def actors_csv(n):
+        lines = ["first_name,last_name,age,gender,email,phone,photo_link,seeking_movie"]
+        for _ in range(IMPORT_ROWS):
+            i = next(emails)
+            lines.append(
+                f"Bench,Import{i},30,male,new{i}@bench.local,new{i:010d},"
+                f"{PHOTO_LINK},false"
+            )
+        return "text/csv", "\n".join(lines) + "\n"
+
+    def ndjson(rows):
+        return "application/x-ndjson", "".join(json.dumps(row) + "\n" for row in rows)
+
+    def castings_ndjson(n):
+        return ndjson(
+            {
+                "actor_id": pick(n * IMPORT_ROWS + i, args.actors),
+                "movie_id": pick(n + i, args.movies),
+                "role": "extra",
+                "casting_date": window(n + i),
+                "casting_address": "123 Bench street, New York, NY, 12345",
+                "status": "in process",
+            }
+            for i in range(IMPORT_ROWS)
+        )
+
+    def graph_query(n):
+        return {
+            "movies": {
+                "ids": [pick(n * 5 + i, args.movies) for i in range(5)],
+                "fields": [
+                    "title",
+                    {
+                        "castings": {
+                            "limit": 10,
+                            "fields": [
+                                "role",
+                                {"actor": {"fields": ["full_name", "photo_link"]}},
+                            ],
+                        }
+                    },
+                ],
+            }
+        }
+
+    stats_range = "start=2025-06-01&end=2026-06-01"
+
+    return {
+        "GET /": lambda n: ("GET", "/", None, None),
+        "GET /actors": lambda n: ("GET", "/actors", None, reader),
+        "GET /movies": lambda n: ("GET", "/movies", None, reader),
+        "GET /actors/<id>": lambda n: (
+            "GET",
+            f"/actors/{pick(n, args.actors)}",
+            None,
+            reader,
+        ),
+        "GET /movies/<id>": lambda n: (
+            "GET",
+            f"/movies/{pick(n, args.movies)}",
+            None,
+            reader,
+        ),
+        "GET /actors?ids=": lambda n: (
+            "GET",
+            f"/actors?ids={picks(n, args.actors)}",
+            None,
+            reader,
+        ),
+        "GET /movies?ids=": lambda n: (
+            "GET",
+            f"/movies?ids={picks(n, args.movies)}",
+            None,
+            reader,
+        ),
+        "GET /actors/available": lambda n: (
+            "GET",
+            f"/actors/available?start={window(n)}&end={window(n, hours=2)}",
+            None,
+            reader,
+        ),
+        "POST /query": lambda n: ("POST", "/query", graph_query(n), reader),
+        "GET /stats/movies": lambda n: (
+            "GET",
+            f"/stats/movies?{stats_range}",
+            None,
+            director,
+        ),
+        "GET /stats/genres": lambda n: (
+            "GET",
+            f"/stats/genres?{stats_range}",
+            None,
+            director,
+        ),
+        "GET /stats/months": lambda n: (
+            "GET",
+            f"/stats/months?{stats_range}",
+            None,
+            director,
+        ),
+        "GET /stats/actors": lambda n: (
+            "GET",
+            f"/stats/actors?{stats_range}",
+            None,
+            director,
+        ),
+        "POST /actors/create": lambda n: (
+            "POST",
+            "/actors/create",
+            actor_body(n),
+            producer,
+        ),
+        "POST /movies/create": lambda n: (
+            "POST",
+            "/movies/create",
+            movie_body,
+            producer,
+        ),
+        "PATCH /actors/<id>": lambda n: (
+            "PATCH",
+            f"/actors/{pick(n, args.actors)}",
+            {"age": 20 + n % 50},
+            producer,
+        ),
+        "PATCH /movies/<id>": lambda n: (
+            "PATCH",
+            f"/movies/{pick(n, args.movies)}",
+            {"seeking_actor": n % 2 == 0},
+            producer,
+        ),
+        "POST /actors/import": lambda n: (
+            "POST",
+            "/actors/import",
+            actors_csv(n),
+            producer,
+        ),
+        "POST /movies/import": lambda n: (
+            "POST",
+            "/movies/import",
+            ndjson(movie_body for _ in range(IMPORT_ROWS)),
+            producer,
+        ),
+        "POST /castings/import": lambda n: (
+            "POST",
+            "/castings/import",
+            castings_ndjson(n),
+            producer,
+        ),
+        # Everything written by the scenarios above
+        "GET /actors?updated_since=": lambda n: (
+            "GET",
+            f"/actors?updated_since={since.isoformat()}",
+            None,
+            reader,
+        ),
+        "GET /movies?updated_since=": lambda n: (
+            "GET",
+            f"/movies?updated_since={since.isoformat()}",
+            None,
+            reader,
+        ),
+        "GET /changes": lambda n: ("GET", "/changes?limit=100", None, producer),
+        "DELETE /actors/<id>": lambda n: (
+            "DELETE",
+            f"/actors/{next(actor_deletes)}",
+            None,
+            producer,
+        ),
+        "DELETE /movies/<id>": lambda n: (
+            "DELETE",
+            f"/movies/{next(movie_deletes)}",
+            None,
+            producer,
+        ),
+        "DELETE /actors?ids=": lambda n: (
+            "DELETE",
+            f"/actors?ids={batch(actor_deletes)}",
+            None,
+            producer,
+        ),
+        "DELETE /movies?ids=": lambda n: (
+            "DELETE",
+            f"/movies?ids={batch(movie_deletes)}",
+            None,
+            producer,
+        ),
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_route(app, scenario, requests, concurrency):
+    def call(n):
+        method, path, body, token = scenario(n)
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if isinstance(body, tuple):
+            content_type, data = body
+            send = {"data": data, "content_type": content_type}
+        else:
+            send = {"json": body}
+        _local.queries = 0
+        start = time.perf_counter()
+        res = app.test_client().open(path, method=method, headers=headers, **send)
+        elapsed = time.perf_counter() - start
+        return elapsed, res.status_code, _local.queries
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(call, range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    statuses = {}
+    for _, status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        "requests": requests,
+        "statuses": statuses,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies),
+        "throughput_rps": requests / wall,
+        "queries_per_request": sum(q for _, _, q in results) / requests,
+    }
+
+
+def git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report, baseline=None):
+    print(
+        f"{'route':<28} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>8} "
+        f"{'queries':>8}  statuses"
+    )
+    for route, result in report["routes"].items():
+        line = (
+            f"{route:<28} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+            f"{result['p99_ms']:8.2f} {result['throughput_rps']:8.1f} "
+            f"{result['queries_per_request']:8.1f}  {result['statuses']}"
+        )
+        if baseline and route in baseline["routes"]:
+            before = baseline["routes"][route]["p95_ms"]
+            line += f"  p95 {(result['p95_ms'] - before) / before * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL_BENCH"))
+    parser.add_argument("--actors", type=int, default=4000)
+    parser.add_argument("--movies", type=int, default=2000)
+    parser.add_argument("--castings", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--routes", nargs="*", help="only run these routes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", help="results of an earlier run to compare")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error("set --database-url or DATABASE_URL_BENCH")
+    # Half the ids for the deletes, one per request and DELETE_BATCH per
+    # bulk request
+    factor = 2 * (1 + DELETE_BATCH)
+    if args.requests * factor > min(args.actors, args.movies):
+        parser.error(
+            f"--actors and --movies must be at least {factor} times --requests"
+        )
+
+    app = create_app(
+        {
+            "DATABASE_URL": args.database_url,
+            "DATABASE_URL_REPLICA": None,
+            # Every request comes from the same few clients
+            "RATELIMIT_ENABLED": False,
+            "ACCESS_LOG": False,
+        },
+        env="production",
+    )
+
+    provider = LocalAuthProvider()
+    provider.install()
+    tokens = {
+        role: provider.role_token(role)
+        for role in ("casting_assistant", "casting_director", "executive_producer")
+    }
+
+    with app.app_context():
+        seed(args.actors, args.movies, args.castings, random.Random(args.seed))
+        since = db.session.execute(text("SELECT clock_timestamp()::timestamp")).scalar()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "parameters": {
+            "actors": args.actors,
+            "movies": args.movies,
+            "castings": args.castings,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "routes": {},
+    }
+
+    for route, scenario in scenarios(args, tokens, since).items():
+        if args.routes and route not in args.routes:
+            continue
+        report["routes"][route] = run_route(
+            app, scenario, args.requests, args.concurrency
+        )
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit']}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Query overhead benchmark
+Times the lookup of retrieve_actor and retrieve_movie built as a Query
+on every call, with and without the compiled statement cache, as the
+lambda statements of queries.py, and those run as server-side prepared
+statements. The first table is the Python side only (building the
+statement and compiling it or finding it in the cache), the second one
+the whole round trip to the database.
+
+    DATABASE_URL_BENCH=postgresql://... python -m benchmarks.queries \
+        [--number 2000]
+
+The database is seeded when it has no actor 1 yet.
+"""
+
+import argparse
+import os
+import timeit
+
+from sqlalchemy import event, lambda_stmt, select
+
+from app import create_app
+from models import db, seed_db, UnitOfWork, Actor, Movie
+from queries import actor_by_id, movie_by_id, prepare_statement
+
+
+def per_call(case, number):
+    """Microseconds per call, best of 3"""
+    return min(timeit.repeat(case, number=number, repeat=3)) / number * 1e6
+
+
+def compile_cases(dialect):
+    cache = {}
+
+    def cached(statement):
+        key = statement._generate_cache_key().key
+        if key not in cache:
+            cache[key] = statement.compile(dialect=dialect)
+        return cache[key]
+
+    id = 1
+    return {
+        "retrieve_actor": {
+            "query, no cache": lambda: Actor.query.filter(Actor.id == id)
+            ._statement_20()
+            .compile(dialect=dialect),
+            "query, cached": lambda: cached(
+                Actor.query.filter(Actor.id == id)._statement_20()
+            ),
+            "lambda, cached": lambda: cached(
+                lambda_stmt(lambda: select(Actor).where(Actor.id == id))
+            ),
+        },
+        "retrieve_movie": {
+            "query, no cache": lambda: Movie.query.filter(Movie.id == id)
+            ._statement_20()
+            .compile(dialect=dialect),
+            "query, cached": lambda: cached(
+                Movie.query.filter(Movie.id == id)._statement_20()
+            ),
+            "lambda, cached": lambda: cached(
+                lambda_stmt(lambda: select(Movie).where(Movie.id == id))
+            ),
+        },
+    }
+
+
+def execute_cases():
+    def lookup(query):
+        # Loaded again every time, as by a new request
+        db.session.expunge_all()
+        return query()
+
+    return {
+        "retrieve_actor": {
+            "query, no cache": lambda: lookup(
+                Actor.query.filter(Actor.id == 1)
+                .execution_options(compiled_cache=None)
+                .one_or_none
+            ),
+            "query, cached": lambda: lookup(
+                Actor.query.filter(Actor.id == 1).one_or_none
+            ),
+            "lambda, cached": lambda: lookup(lambda: actor_by_id(1)),
+        },
+        "retrieve_movie": {
+            "query, no cache": lambda: lookup(
+                Movie.query.filter(Movie.id == 1)
+                .execution_options(compiled_cache=None)
+                .one_or_none
+            ),
+            "query, cached": lambda: lookup(
+                Movie.query.filter(Movie.id == 1).one_or_none
+            ),
+            "lambda, cached": lambda: lookup(lambda: movie_by_id(1)),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL_BENCH"))
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set DATABASE_URL_BENCH or pass --database-url")
+
+    app = create_app(
+        {
+            "DATABASE_URL": args.database_url,
+            "DATABASE_URL_REPLICA": None,
+            "SEED_DB": False,
+            "RATELIMIT_ENABLED": False,
+        }
+    )
+    with app.app_context():
+        if db.session.get(Actor, 1) is None or db.session.get(Movie, 1) is None:
+            with UnitOfWork():
+                seed_db()
+
+        print("Python side")
+        print(f"{'route':<16} {'statement':<18} {'us/call':>9}")
+        for route, cases in compile_cases(db.engine.dialect).items():
+            for name, case in cases.items():
+                print(f"{route:<16} {name:<18} {per_call(case, args.number):>9.1f}")
+
+        print("\nRound trip")
+        print(f"{'route':<16} {'statement':<18} {'us/call':>9}")
+        for route, cases in execute_cases().items():
+            for name, case in cases.items():
+                print(f"{route:<16} {name:<18} {per_call(case, args.number):>9.1f}")
+
+            event.listen(
+                db.engine, "before_cursor_execute", prepare_statement, retval=True
+            )
+            try:
+                case = cases["lambda, cached"]
+                case()
+                seconds = per_call(case, args.number)
+            finally:
+                event.remove(db.engine, "before_cursor_execute", prepare_statement)
+                db.session.commit()
+            print(f"{route:<16} {'lambda, prepared':<18} {seconds:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
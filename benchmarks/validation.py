@@ -0,0 +1,64 @@
+"""
+Validation overhead benchmark
+Measures the per-request cost of validating actor and movie payloads
+with the compiled schemas.
+
+    python -m benchmarks.validation [--number 100000]
+"""
+
+import argparse
+import timeit
+
+from schemas import ACTOR_SCHEMA, MOVIE_SCHEMA, ValidationError
+
+
+ACTOR = {
+    "first_name": "Sandy",
+    "last_name": "Proom",
+    "fullname": "Sandy Proom",
+    "age": 20,
+    "gender": "female",
+    "email": "sandyproom@gnmail.com",
+    "phone": "1234567890",
+    "photo_link": "https://images.unsplash.com/photo-1631084655463-e671365ec05f?ixlib=rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=774&q=80",
+    "seeking_movie": True,
+}
+
+MOVIE = {
+    "title": "Big house",
+    "genres": ["TV show"],
+    "release_date": "2023.08.01",
+    "seeking_actor": True,
+}
+
+BAD_ACTOR = dict(ACTOR, age=-1, gender="unknown")
+
+
+def load(schema, body, partial=False):
+    try:
+        schema.load(body, partial)
+    except ValidationError:
+        pass
+
+
+CASES = {
+    "actor (valid)": lambda: load(ACTOR_SCHEMA, ACTOR),
+    "actor (invalid)": lambda: load(ACTOR_SCHEMA, BAD_ACTOR),
+    "actor patch (1 field)": lambda: load(ACTOR_SCHEMA, {"age": 21}, True),
+    "movie (valid)": lambda: load(MOVIE_SCHEMA, MOVIE),
+    "movie patch (1 field)": lambda: load(MOVIE_SCHEMA, {"title": "Smile"}, True),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, case in CASES.items():
+        seconds = min(timeit.repeat(case, number=args.number, repeat=3))
+        print(f"{name:<24} {seconds / args.number * 1e6:8.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
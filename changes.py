@@ -0,0 +1,70 @@
+import json
+import time
+
+from sqlalchemy import BigInteger, Text, cast, func, or_, select, tuple_
+
+from models import db, Change
+
+
+"""
+Change feed
+Changes are read in (xid, id) order after a cursor. Only transactions
+older than the oldest one still running are read: the rows of those
+can't be joined later by a row with a lower xid, so a consumer which
+saves the last cursor never misses a change
+"""
+
+
+def as_bigint(xid):
+    return cast(cast(xid, Text), BigInteger)
+
+
+def changes_since(cursor=None, limit=100):
+    """Up to limit changes after cursor, an (xid, id) pair, or from the
+    start without one
+    """
+    horizon = as_bigint(func.pg_snapshot_xmin(func.pg_current_snapshot()))
+    query = (
+        select(Change)
+        .where(
+            or_(
+                Change.xid < horizon,
+                # A transaction sees its own changes
+                Change.xid == as_bigint(func.pg_current_xact_id_if_assigned()),
+            )
+        )
+        .order_by(Change.xid, Change.id)
+        .limit(limit)
+    )
+    if cursor is not None:
+        query = query.where(tuple_(Change.xid, Change.id) > tuple_(*cursor))
+    return db.session.execute(query).scalars().all()
+
+
+def format_event(change):
+    """A change as a server-sent event, its cursor as the event id"""
+    data = json.dumps(change.format_json())
+    return f"id: {change.cursor}\nevent: change\ndata: {data}\n\n"
+
+
+def stream_changes(cursor=None, poll_seconds=1, duration=25, batch=100):
+    """Server-sent events of the changes after cursor, polled every
+    poll_seconds. Ends after duration seconds, clients reconnect with
+    the Last-Event-ID they got
+    """
+    deadline = time.monotonic() + duration
+    while True:
+        changes = changes_since(cursor, batch)
+        for change in changes:
+            cursor = (change.xid, change.id)
+            yield format_event(change)
+        # Don't hold a connection while waiting, and see new commits next
+        db.session.commit()
+
+        if len(changes) == batch:
+            continue
+        if time.monotonic() >= deadline:
+            return
+        # Keeps proxies from closing an idle connection
+        yield ": keep-alive\n\n"
+        time.sleep(poll_seconds)
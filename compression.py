@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import current_app, request
+
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+"""
+Encoders
+Each takes the body and a level and returns the compressed bytes. brotli
+is only offered when the brotli package is installed
+"""
+
+
+def gzip_encode(data, level):
+    # mtime=0 so the same body always compresses to the same bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def brotli_encode(data, level):
+    return brotli.compress(data, quality=level)
+
+
+ENCODERS = {"gzip": gzip_encode}
+if brotli is not None:
+    ENCODERS["br"] = brotli_encode
+
+
+class CompressedCache:
+    """Compressed bodies by encoding, level and digest of the body, least
+    recently used first out once they add up to more than max_bytes.
+    A digest costs a fraction of compressing, so a body sent again, e.g.
+    the same list to many clients, is only compressed once
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compress(self, encoding, level, data):
+        key = (encoding, level, hashlib.sha256(data).digest())
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compressed
+            self.misses += 1
+
+        compressed = ENCODERS[encoding](data, level)
+        if len(compressed) > self.max_bytes:
+            return compressed
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = compressed
+                self.size += len(compressed)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return compressed
+
+
+"""
+Compression
+Responses of COMPRESS_MIMETYPES of at least COMPRESS_MIN_SIZE bytes are
+compressed with the best encoding the client accepts
+"""
+
+
+def negotiate_encoding():
+    """The accepted encoding the client prefers, brotli on ties"""
+    offered = [encoding for encoding in ("br", "gzip") if encoding in ENCODERS]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress_response(response):
+    config = current_app.config
+    if (
+        response.mimetype not in config["COMPRESS_MIMETYPES"]
+        or response.direct_passthrough
+        or response.is_streamed
+    ):
+        return response
+
+    # Caches must key this response by the Accept-Encoding it was sent for
+    response.vary.add("Accept-Encoding")
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or "Content-Encoding" in response.headers
+        or request.method == "HEAD"
+    ):
+        return response
+
+    data = response.get_data()
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return response
+
+    level = config[f"COMPRESS_{'BROTLI' if encoding == 'br' else 'GZIP'}_LEVEL"]
+    cache = current_app.extensions.get("compressed_cache")
+    if cache is not None:
+        compressed = cache.compress(encoding, level, data)
+    else:
+        compressed = ENCODERS[encoding](data, level)
+
+    # The ETag names the entity version for If-Match, whatever the encoding
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def setup_compression(app):
+    """Compress responses unless COMPRESS_ENABLED is False"""
+    for key, value in {
+        "COMPRESS_ENABLED": True,
+        "COMPRESS_MIN_SIZE": 1024,
+        "COMPRESS_GZIP_LEVEL": 6,
+        # brotli's default of 11 is too slow to run on every request
+        "COMPRESS_BROTLI_LEVEL": 4,
+        "COMPRESS_MIMETYPES": ("application/json", "text/html", "text/plain"),
+        "COMPRESS_CACHE_SIZE": 16 * 1024 * 1024,
+    }.items():
+        app.config.setdefault(key, value)
+
+    if not app.config["COMPRESS_ENABLED"]:
+        return
+    if app.config["COMPRESS_CACHE_SIZE"]:
+        app.extensions["compressed_cache"] = CompressedCache(
+            app.config["COMPRESS_CACHE_SIZE"]
+        )
+    app.after_request(compress_response)
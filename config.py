@@ -0,0 +1,129 @@
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+
+def database_url(name):
+    """A database URL from the environment, with the postgres:// scheme
+    of Heroku renamed for SQLAlchemy
+    """
+    url = os.getenv(name)
+    return url.replace("postgres://", "postgresql://", 1) if url else url
+
+
+"""
+Configurations
+create_app loads one of these, chosen by the APP_ENV environment variable:
+development for local development, test for the test suite and production
+for deployments. The default one, used when APP_ENV is not set, neither
+debugs nor seeds, so a deployment which forgot APP_ENV keeps its tables.
+Keys missing here keep the defaults of the module which reads them (see
+README.md)
+"""
+
+
+class Config:
+    DEBUG = False
+    TESTING = False
+    JSON_COMPACT = True
+    DATABASE_URL = database_url("DATABASE_URL")
+    DATABASE_URL_REPLICA = database_url("DATABASE_URL_REPLICA")
+    # Drop, create and seed the tables when the app starts
+    SEED_DB = False
+    SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": 5, "max_overflow": 10}
+    ENTITY_CACHE_SIZE = 8 * 1024 * 1024
+    COMPRESS_CACHE_SIZE = 16 * 1024 * 1024
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    # Indented JSON responses, easier to read while developing
+    JSON_COMPACT = False
+    SEED_DB = True
+
+
+class TestConfig(Config):
+    TESTING = True
+    DATABASE_URL = database_url("DATABASE_URL_TEST")
+    SEED_DB = True
+    DATABASE_URL_REPLICA = None
+    # Every test runs as the same few clients
+    RATELIMIT_ENABLED = False
+    # Rolled back writes would stay in the cache
+    ENTITY_CACHE_SIZE = 0
+    ACCESS_LOG = False
+
+
+class ProductionConfig(Config):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": 10,
+        "max_overflow": 20,
+        # Replace connections dropped by the server or a proxy
+        "pool_pre_ping": True,
+        "pool_recycle": 1800,
+    }
+    ENTITY_CACHE_SIZE = 32 * 1024 * 1024
+
+
+CONFIGS = {
+    "default": Config,
+    "development": DevelopmentConfig,
+    "test": TestConfig,
+    "production": ProductionConfig,
+}
+
+
+class ConfigError(Exception):
+    """Raised by create_app for settings it can't run with"""
+
+    def __init__(self, errors):
+        super().__init__(
+            "Invalid configuration: "
+            + " ".join(f"{key}: {error}" for key, error in errors.items())
+        )
+        self.errors = errors
+
+
+def load_config(env=None):
+    """The configuration class of env, APP_ENV by default"""
+    env = env or os.getenv("APP_ENV", "default")
+    try:
+        return CONFIGS[env]
+    except KeyError:
+        raise ConfigError({"APP_ENV": f"Must be one of: {', '.join(CONFIGS)}."})
+
+
+def is_size(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def validate_config(config, env):
+    """Raise ConfigError for missing or inconsistent settings"""
+    errors = {}
+
+    if not config.get("DATABASE_URL"):
+        errors["DATABASE_URL"] = "Must be set."
+    elif not config["DATABASE_URL"].startswith("postgresql"):
+        errors["DATABASE_URL"] = "Must be a postgresql:// URL."
+
+    if env == "production":
+        if config["DEBUG"]:
+            errors["DEBUG"] = "Must be off in production."
+        if config["SEED_DB"]:
+            errors["SEED_DB"] = "Would drop the production tables."
+
+    for key in ("ENTITY_CACHE_SIZE", "COMPRESS_CACHE_SIZE"):
+        if not is_size(config.get(key, 0)):
+            errors[key] = "Must be a number of bytes, 0 to turn off."
+
+    options = config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if not (is_size(options.get("pool_size", 5)) and options.get("pool_size", 5) > 0):
+        errors["SQLALCHEMY_ENGINE_OPTIONS"] = "pool_size must be at least 1."
+    elif not is_size(options.get("max_overflow", 10)):
+        errors["SQLALCHEMY_ENGINE_OPTIONS"] = "max_overflow must be at least 0."
+
+    if errors:
+        raise ConfigError(errors)
@@ -0,0 +1,76 @@
+from flask import current_app, request
+
+
+"""
+CORS
+Browsers may call the API from CORS_ORIGINS, "*" for any origin or a list
+of origins. Preflight requests are answered here, before authentication,
+rate limiting or any route runs, and may be cached for CORS_MAX_AGE
+seconds. The headers are built once when the app is set up
+"""
+
+
+class CorsHeaders:
+    def __init__(self, origins, methods, allow_headers, expose_headers, max_age):
+        self.any_origin = origins == "*"
+        self.origins = frozenset(() if self.any_origin else origins)
+        self.response = [
+            ("Access-Control-Expose-Headers", ", ".join(expose_headers)),
+        ]
+        self.preflight = [
+            ("Access-Control-Allow-Methods", ", ".join(methods)),
+            ("Access-Control-Allow-Headers", ", ".join(allow_headers)),
+            ("Access-Control-Max-Age", str(max_age)),
+        ]
+        if self.any_origin:
+            self.response.insert(0, ("Access-Control-Allow-Origin", "*"))
+            self.preflight.insert(0, ("Access-Control-Allow-Origin", "*"))
+
+    def add(self, headers, origin, preflight=False):
+        """Add the CORS headers for a request from origin. Nothing is added
+        for origins which are not allowed, so browsers block the response
+        """
+        if self.any_origin:
+            headers.extend(self.preflight if preflight else self.response)
+        elif origin in self.origins:
+            headers["Access-Control-Allow-Origin"] = origin
+            headers.add("Vary", "Origin")
+            headers.extend(self.preflight if preflight else self.response)
+
+
+def handle_preflight():
+    if (
+        request.method != "OPTIONS"
+        or "Access-Control-Request-Method" not in request.headers
+    ):
+        return None
+    response = current_app.response_class(status=204)
+    current_app.extensions["cors"].add(
+        response.headers, request.headers.get("Origin"), preflight=True
+    )
+    return response
+
+
+def add_cors_headers(response):
+    origin = request.headers.get("Origin")
+    # Preflight responses have theirs already
+    if origin is not None and "Access-Control-Allow-Origin" not in response.headers:
+        current_app.extensions["cors"].add(response.headers, origin)
+    return response
+
+
+def setup_cors(app):
+    """Answer preflight requests and add CORS headers to responses. Must be
+    set up before other before_request hooks, so preflights skip them
+    """
+    app.extensions["cors"] = CorsHeaders(
+        app.config.get("CORS_ORIGINS", "*"),
+        methods=("GET", "POST", "PATCH", "DELETE", "OPTIONS"),
+        allow_headers=("Authorization", "Content-Type", "If-Match"),
+        # ETag for If-Match, Retry-After of 429 responses
+        expose_headers=("ETag", "Retry-After"),
+        # Browsers cap this, e.g. Chrome at 2 hours
+        max_age=app.config.get("CORS_MAX_AGE", 86400),
+    )
+    app.before_request(handle_preflight)
+    app.after_request(add_cors_headers)
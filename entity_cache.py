@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from replicas import RoutingSession
+
+
+"""
+Entity cache
+The responses of GET /actors/<id> and GET /movies/<id> by entity and id,
+kept by each process. A write drops the entities it touched once its
+transaction commits: the entity itself, and the actors and movies whose
+format_json shows it (see touch() in models.py). Other processes only
+see the write when their copy expires, ENTITY_CACHE_TTL seconds after it
+was loaded
+"""
+
+
+class EntityCache:
+    """Values by key, least recently used first out once they add up to
+    more than max_bytes, and dropped ttl seconds after they were loaded.
+    Values are (version, body) pairs, body being the serialized response
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, ttl=10.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key: (expires, value)
+        self._entries = OrderedDict()
+        # Loads in progress by key, for the other requests to wait for
+        self._loading = {}
+        # Moved by every invalidation, so a load which started before it
+        # doesn't store what it read
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """The value of key, loaded with load() when missing. Concurrent
+        misses of the same key wait for a single load. None, e.g. for an
+        unknown id, is returned but not kept
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                self._remove(key)
+            self.misses += 1
+
+            future = self._loading.get(key)
+            if future is not None:
+                loader = False
+            else:
+                loader = True
+                future = self._loading[key] = Future()
+                epoch = self._epoch
+
+        if not loader:
+            return future.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            if value is not None and epoch == self._epoch:
+                self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._epoch += 1
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def _store(self, key, value):
+        size = len(value[1])
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (expires, evicted) = self._entries.popitem(last=False)
+            self.size -= len(evicted[1])
+
+    def _remove(self, key):
+        expires, value = self._entries.pop(key)
+        self.size -= len(value[1])
+
+
+def get_entity_cache():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("entity_cache")
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def invalidate_written(session):
+    # Set by mark_written() in models.py. Entities of a rolled back
+    # transaction are dropped by the next commit, which is harmless
+    written = session.info.pop("written", None)
+    cache = get_entity_cache()
+    if written and cache is not None:
+        cache.invalidate(written)
+
+
+def setup_entity_cache(app):
+    """Cache single actors and movies unless ENTITY_CACHE_SIZE is 0"""
+    app.config.setdefault("ENTITY_CACHE_SIZE", 8 * 1024 * 1024)
+    app.config.setdefault("ENTITY_CACHE_TTL", 10.0)
+
+    if app.config["ENTITY_CACHE_SIZE"]:
+        app.extensions["entity_cache"] = EntityCache(
+            app.config["ENTITY_CACHE_SIZE"], app.config["ENTITY_CACHE_TTL"]
+        )
+    else:
+        app.extensions.pop("entity_cache", None)
@@ -0,0 +1,135 @@
+"""
+Test fixtures
+The app and the database schema are created once per test process.
+Each test then runs inside a transaction on a single connection which
+is rolled back when the test ends, so tests never pay for DDL or reseeding.
+
+Commits made by the app only release a SAVEPOINT, and a new one is
+started right away, so the code under test behaves as usual.
+
+With pytest-xdist (pytest -n 4) every worker gets its own database,
+DATABASE_URL_TEST with the worker id appended, created when missing.
+"""
+
+import os
+import unittest
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+
+from app import create_app
+from models import db, seed_db
+from replicas import RoutingSession
+
+load_dotenv()
+
+DB_PATH_TEST = os.getenv("DATABASE_URL_TEST")
+
+_app = None
+# Connection of the running test's transaction
+_connection = None
+
+
+def worker_database_url(url):
+    """Give each pytest-xdist worker its own database"""
+    worker = os.getenv("PYTEST_XDIST_WORKER")
+    if not worker:
+        return url
+    url = make_url(url)
+    return url.set(database=f"{url.database}_{worker}").render_as_string(
+        hide_password=False
+    )
+
+
+def ensure_database(url):
+    """Create the database when it doesn't exist yet"""
+    url = make_url(url)
+    engine = create_engine(url.set(database="postgres"), isolation_level="AUTOCOMMIT")
+    try:
+        with engine.connect() as connection:
+            exists = connection.execute(
+                text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                {"name": url.database},
+            ).scalar()
+            if not exists:
+                connection.execute(text(f'CREATE DATABASE "{url.database}"'))
+    finally:
+        engine.dispose()
+
+
+def get_test_app():
+    """Create the app, its schema and seed data once per process"""
+    global _app
+    if _app is None:
+        url = worker_database_url(DB_PATH_TEST)
+        ensure_database(url)
+        # Drops, creates and seeds the schema
+        _app = create_app({"DATABASE_URL": url}, env="test")
+    return _app
+
+
+def reset_data():
+    """Put the seed data back without touching the schema"""
+    db.session.execute(
+        text(
+            'TRUNCATE "Casting", "Actors", "Movies", "Changes", "Tombstones" '
+            "RESTART IDENTITY CASCADE"
+        )
+    )
+    db.session.commit()
+    seed_db()
+    db.session.commit()
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def restart_savepoint(session, transaction):
+    connection = _connection
+    if (
+        connection is not None
+        and session.bind is connection
+        and transaction._parent is None
+        and not connection.in_nested_transaction()
+    ):
+        connection.begin_nested()
+
+
+class TransactionalTestCase(unittest.TestCase):
+    """Base test case which rolls back everything a test writes.
+
+    Set transactional = False for tests which need real commits, e.g.
+    concurrent requests from several threads. Their data is reset with
+    TRUNCATE and reseeding instead, before and after the test
+    """
+
+    transactional = True
+
+    def setUp(self):
+        global _connection
+        self.app = get_test_app()
+        self.client = self.app.test_client
+
+        if not self.transactional:
+            with self.app.app_context():
+                reset_data()
+            return
+
+        with self.app.app_context():
+            self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.connection.begin_nested()
+        _connection = self.connection
+        db.session.session_factory.configure(bind=self.connection)
+
+    def tearDown(self):
+        global _connection
+        if not self.transactional:
+            # Later tests expect the seed data
+            with self.app.app_context():
+                reset_data()
+            return
+
+        db.session.session_factory.configure(bind=None)
+        _connection = None
+        self.transaction.rollback()
+        self.connection.close()
@@ -0,0 +1,343 @@
+import enum
+from datetime import datetime
+
+from sqlalchemy import any_, func, select
+
+from models import db, Actor, Movie, Casting, StatusType
+from schemas import ValidationError, Schema, Field, Choice, Integer, IdList
+
+
+"""
+Graph queries
+POST /query returns the actors and movies a client asks for with only
+the fields it selects, and their castings, actors and movies nested as
+deep as it needs, in the manner of GraphQL:
+
+    {"movies": {"ids": [1, 2], "fields": ["title", {"castings": {
+        "status": "accept", "fields": ["role", {"actor": {
+            "fields": ["full_name", "photo_link"]}}]}}]}}
+
+The query is checked and priced before anything is read. The rows of a
+relation are then loaded for all their parents at once, so each
+relation in the query is one SQL query whatever the number of parents
+"""
+
+
+class Relation:
+    """The rows of node whose child_key equals the parent_key of a parent
+    row: all of them (many), or the one with that id
+    """
+
+    def __init__(self, node, many, parent_key, child_key, args):
+        self.node = node
+        self.many = many
+        self.parent_key = parent_key
+        self.child_key = child_key
+        self.args = args
+
+
+class Node:
+    def __init__(self, fields, order_by, relations):
+        # Field name: column
+        self.fields = fields
+        self.order_by = order_by
+        self.relations = relations
+
+
+LIMIT = Integer(minimum=1, maximum=100, required=False)
+DEFAULT_LIMIT = 20
+
+ROOT_ARGS = Schema(
+    ids=IdList(max_items=100, required=False), limit=LIMIT, fields=Field()
+)
+CASTINGS_ARGS = Schema(
+    status=Choice(StatusType, required=False), limit=LIMIT, fields=Field()
+)
+ONE_ARGS = Schema(fields=Field())
+
+NODES = {
+    "actor": Node(
+        {
+            "id": Actor.id,
+            "first_name": Actor.first_name,
+            "last_name": Actor.last_name,
+            "full_name": Actor.fullname,
+            "age": Actor.age,
+            "gender": Actor.gender,
+            "email": Actor.email,
+            "phone": Actor.phone,
+            "photo_link": Actor.photo_link,
+            "seeking_movie": Actor.seeking_movie,
+            "version": Actor.version,
+        },
+        (Actor.fullname, Actor.id),
+        {"castings": Relation("casting", True, "id", "actor_id", CASTINGS_ARGS)},
+    ),
+    "movie": Node(
+        {
+            "id": Movie.id,
+            "title": Movie.title,
+            "genres": Movie.genres,
+            "release_date": Movie.release_date,
+            "seeking_actor": Movie.seeking_actor,
+            "version": Movie.version,
+        },
+        (Movie.release_date, Movie.title, Movie.id),
+        {"castings": Relation("casting", True, "id", "movie_id", CASTINGS_ARGS)},
+    ),
+    "casting": Node(
+        {
+            "id": Casting.id,
+            "actor_id": Casting.actor_id,
+            "movie_id": Casting.movie_id,
+            "role": Casting.role,
+            "casting_date": Casting.casting_date,
+            "casting_duration": Casting.casting_duration,
+            "casting_address": Casting.casting_address,
+            "status": Casting.status,
+        },
+        (Casting.casting_date, Casting.id),
+        {
+            "actor": Relation("actor", False, "actor_id", "id", ONE_ARGS),
+            "movie": Relation("movie", False, "movie_id", "id", ONE_ARGS),
+        },
+    ),
+}
+
+ROOTS = {"actors": "actor", "movies": "movie"}
+
+
+"""
+Parsing and cost
+A query becomes a tree of Selections. Its cost is the number of rows it
+can return at most: a root returns its ids or up to its limit, a list of
+castings up to its limit for each parent, and an actor or movie one row
+for each parent. Queries costing more than QUERY_MAX_COST or nested
+deeper than QUERY_MAX_DEPTH are rejected
+"""
+
+
+class Selection:
+    def __init__(self, node, args, rows):
+        self.node = NODES[node]
+        self.name = node
+        self.args = args
+        # At most this many rows
+        self.rows = rows
+        self.fields = []
+        # Name: (Relation, Selection)
+        self.relations = {}
+
+    @property
+    def cost(self):
+        return self.rows + sum(child.cost for _, child in self.relations.values())
+
+    @property
+    def depth(self):
+        return 1 + max((child.depth for _, child in self.relations.values()), default=0)
+
+    def columns(self, *keys):
+        """The selected fields, the keys of the relations and keys"""
+        names = dict.fromkeys(self.fields)
+        names.update(
+            dict.fromkeys(rel.parent_key for rel, _ in self.relations.values())
+        )
+        names.update(dict.fromkeys(keys))
+        return [self.node.fields[name].label(name) for name in names]
+
+
+def load_args(schema, body, path):
+    try:
+        return schema.load(body)
+    except ValidationError as e:
+        raise ValidationError(
+            {f"{path}.{key}": error for key, error in e.errors.items()}
+        )
+
+
+def parse_selection(node, args, rows, path):
+    selection = Selection(node, args, rows)
+    items = args["fields"]
+    if not isinstance(items, list) or not items:
+        raise ValidationError({f"{path}.fields": "Must be a non-empty list."})
+
+    for item in items:
+        if isinstance(item, str) and item in selection.node.fields:
+            selection.fields.append(item)
+        elif isinstance(item, dict) and len(item) == 1:
+            [(name, body)] = item.items()
+            relation = selection.node.relations.get(name)
+            if relation is None:
+                raise ValidationError({f"{path}.{name}": "Unknown relation."})
+            child_path = f"{path}.{name}"
+            child_args = load_args(relation.args, body, child_path)
+            child_rows = rows
+            if relation.many:
+                child_rows *= child_args.get("limit", DEFAULT_LIMIT)
+            selection.relations[name] = (
+                relation,
+                parse_selection(relation.node, child_args, child_rows, child_path),
+            )
+        else:
+            raise ValidationError({f"{path}.fields": f"Unknown field: {item!r}."})
+    return selection
+
+
+def parse_query(body, max_cost, max_depth):
+    """The Selection of each root of a query and its cost"""
+    if not isinstance(body, dict) or not body:
+        raise ValidationError({"body": "Must be a non-empty JSON object."})
+
+    roots = {}
+    for name, root_body in body.items():
+        if name not in ROOTS:
+            raise ValidationError({name: "Unknown root, must be actors or movies."})
+        args = load_args(ROOT_ARGS, root_body, name)
+        rows = len(args["ids"]) if "ids" in args else args.get("limit", DEFAULT_LIMIT)
+        roots[name] = parse_selection(ROOTS[name], args, rows, name)
+
+    depth = max(selection.depth for selection in roots.values())
+    if depth > max_depth:
+        raise ValidationError(
+            {"body": f"Nested {depth} levels deep, at most {max_depth} allowed."}
+        )
+    cost = sum(selection.cost for selection in roots.values())
+    if cost > max_cost:
+        raise ValidationError(
+            {"body": f"Could return {cost} rows, at most {max_cost} allowed."}
+        )
+    return roots, cost
+
+
+"""
+Loading
+A Loader lives for one request. It reads each relation of the query with
+one statement for all the parent keys (= ANY), and keeps the actors,
+movies and castings it reads by id, so a row reached along several paths
+of the query, e.g. the same actor in many movies, is read once
+"""
+
+
+class Loader:
+    def __init__(self):
+        # (node, id): {column: value}
+        self.rows = {}
+
+    def _keep(self, node, rows):
+        for row in rows:
+            kept = self.rows.setdefault((node, row["id"]), {})
+            kept.update(row)
+
+    def _execute(self, statement):
+        return [dict(row) for row in db.session.execute(statement).mappings()]
+
+    def by_id(self, selection, ids):
+        """The rows of selection with the given ids, by id"""
+        columns = selection.columns("id")
+        names = {column.name for column in columns}
+        missing = [
+            id
+            for id in ids
+            if not names <= self.rows.get((selection.name, id), {}).keys()
+        ]
+        if missing:
+            id_column = selection.node.fields["id"]
+            statement = select(*columns).where(id_column == any_(missing))
+            rows = self._execute(statement)
+            self._keep(selection.name, rows)
+        return {
+            id: self.rows[(selection.name, id)]
+            for id in ids
+            if (selection.name, id) in self.rows
+        }
+
+    def roots(self, selection):
+        args = selection.args
+        if "ids" in args:
+            found = self.by_id(selection, args["ids"])
+            # In the order asked for
+            return [found[id] for id in args["ids"] if id in found]
+
+        statement = (
+            select(*selection.columns("id"))
+            .order_by(*selection.node.order_by)
+            .limit(args.get("limit", DEFAULT_LIMIT))
+        )
+        rows = self._execute(statement)
+        self._keep(selection.name, rows)
+        return rows
+
+    def children(self, relation, selection, keys):
+        """The rows of a many relation by parent key, up to the limit of
+        selection for each parent
+        """
+        args = selection.args
+        node = selection.node
+        key = node.fields[relation.child_key]
+        rank = func.row_number().over(partition_by=key, order_by=node.order_by)
+
+        ranked = select(
+            *selection.columns("id", relation.child_key), rank.label("rank")
+        )
+        ranked = ranked.where(key == any_(list(keys)))
+        if "status" in args:
+            ranked = ranked.where(node.fields["status"] == args["status"])
+        ranked = ranked.subquery()
+
+        statement = (
+            select(*(column for column in ranked.c if column.name != "rank"))
+            .where(ranked.c.rank <= args.get("limit", DEFAULT_LIMIT))
+            .order_by(ranked.c.rank)
+        )
+        rows = self._execute(statement)
+        self._keep(selection.name, rows)
+
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[relation.child_key], []).append(row)
+        return groups
+
+
+def to_json(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return str(value)
+    return value
+
+
+def resolve(loader, selection, rows):
+    """The selected fields and relations of each row"""
+    results = [{name: to_json(row[name]) for name in selection.fields} for row in rows]
+
+    for name, (relation, child) in selection.relations.items():
+        keys = [row[relation.parent_key] for row in rows]
+        wanted = list(dict.fromkeys(key for key in keys if key is not None))
+
+        if relation.many:
+            groups = loader.children(relation, child, wanted) if wanted else {}
+            children = [groups.get(key, []) for key in keys]
+            resolved = iter(
+                resolve(loader, child, [row for group in children for row in group])
+            )
+            for result, group in zip(results, children):
+                result[name] = [next(resolved) for _ in group]
+        else:
+            found = loader.by_id(child, wanted) if wanted else {}
+            children = [found.get(key) for key in keys]
+            resolved = iter(
+                resolve(loader, child, [row for row in children if row is not None])
+            )
+            for result, row in zip(results, children):
+                result[name] = next(resolved) if row is not None else None
+
+    return results
+
+
+def run_query(roots):
+    """The results of parsed query, by root"""
+    loader = Loader()
+    return {
+        name: resolve(loader, selection, loader.roots(selection))
+        for name, selection in roots.items()
+    }
@@ -0,0 +1,35 @@
+import os
+import shutil
+import tempfile
+
+
+"""
+Gunicorn settings, read by gunicorn from the working directory.
+Workers share their metrics through files in PROMETHEUS_MULTIPROC_DIR,
+which must be set before the app is imported and emptied at start
+"""
+
+# Threads, so a client of GET /changes/stream holds a thread rather than
+# a whole worker. The timeout only checks that a worker is alive, it
+# doesn't end the streams
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = 30
+
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR",
+    os.path.join(tempfile.gettempdir(), "casting_agency_metrics"),
+)
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    # Drop the in-flight gauges of the worker
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
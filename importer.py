@@ -0,0 +1,428 @@
+import csv
+import enum
+import io
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    Table,
+    and_,
+    exists,
+    func,
+    insert,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import DBAPIError
+
+from models import (
+    db,
+    refresh_stats,
+    refresh_movie_rollup,
+    record_changes,
+    touch,
+    accepted_partners,
+    UnitOfWork,
+    Actor,
+    Movie,
+    Casting,
+)
+from schemas import (
+    ValidationError,
+    ACTOR_SCHEMA,
+    MOVIE_IMPORT_SCHEMA,
+    CASTING_IMPORT_SCHEMA,
+)
+
+
+"""
+Bulk import
+Rows are read from a CSV or NDJSON stream and validated one at a time.
+Every chunk of valid rows is copied into a temporary staging table with
+COPY and merged into the real table with a few set-based statements,
+in a transaction of its own. Only one chunk is held in memory, whatever
+the size of the file
+"""
+
+
+class ImportReport:
+    def __init__(self, max_errors=1000):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def error(self, line, errors):
+        self.failed += 1
+        # The count stays exact when the list is cut short
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+    def format_json(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.rows / seconds) if seconds else None,
+        }
+
+
+"""
+Readers
+Yield the line number and the validated values of each row, or the
+ValidationError of a rejected row
+"""
+
+
+def read_csv(stream, schema):
+    # The first line names the columns
+    reader = csv.DictReader(stream)
+    for row in reader:
+        if None in row:
+            yield reader.line_num, ValidationError({"row": "More values than columns."})
+            continue
+        try:
+            yield reader.line_num, schema.load_text(row)
+        except ValidationError as e:
+            yield reader.line_num, e
+
+
+def read_ndjson(stream, schema):
+    for line, raw in enumerate(stream, 1):
+        if not raw.strip():
+            continue
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            yield line, ValidationError({"row": "Invalid JSON."})
+            continue
+        try:
+            yield line, schema.load(body)
+        except ValidationError as e:
+            yield line, e
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+"""
+Staging
+A temporary table with the imported columns of the target table, the id
+of the row to update and the line of the row in the file
+"""
+
+
+def create_staging(connection, model, columns):
+    table = model.__table__
+    names = ", ".join(f'"{name}"' for name in ("id", *columns))
+    connection.execute(text("DROP TABLE IF EXISTS pg_temp.import_staging"))
+    # Dropped by the commit of the chunk
+    connection.execute(
+        text(
+            f"CREATE TEMPORARY TABLE import_staging ON COMMIT DROP AS "
+            f'SELECT 0 AS line, {names} FROM "{table.name}" WITH NO DATA'
+        )
+    )
+    return Table(
+        "import_staging",
+        MetaData(),
+        Column("line", Integer),
+        *(Column(name, table.c[name].type) for name in ("id", *columns)),
+    )
+
+
+def copy_value(value):
+    """A value as COPY reads it in CSV format, None for NULL"""
+    if isinstance(value, enum.Enum):
+        # Enum columns store the member names
+        return value.name
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, list):
+        items = (
+            '"' + item.replace("\\", "\\\\").replace('"', '\\"') + '"' for item in value
+        )
+        return "{" + ",".join(items) + "}"
+    return value
+
+
+def copy_rows(connection, staging, chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    names = [column.name for column in staging.columns][1:]
+    for line, data in chunk:
+        writer.writerow([line, *(copy_value(data.get(name)) for name in names)])
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY import_staging (line, {', '.join(names)}) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+    connection.execute(text("ANALYZE import_staging"))
+
+
+def reject(connection, staging, criterion, errors, message):
+    """Remove the staged rows matching criterion, as failed with message"""
+    lines = connection.execute(
+        staging.delete().where(criterion).returning(staging.c.line)
+    ).scalars()
+    errors.extend((line, message) for line in lines)
+
+
+def reject_superseded(connection, staging, errors, message, *keys):
+    """Remove the rows which share a key with a later row of the chunk, so
+    every target row is written once. The last row wins, as if the rows
+    were imported one by one
+    """
+    line = staging.c.line
+    superseded = select(
+        line,
+        or_(
+            *(
+                and_(key.isnot(None), line < func.max(line).over(partition_by=key))
+                for key in keys
+            )
+        ).label("superseded"),
+    ).subquery()
+    reject(
+        connection,
+        staging,
+        line.in_(select(superseded.c.line).where(superseded.c.superseded)),
+        errors,
+        message,
+    )
+
+
+def merge(connection, staging, model, columns):
+    """Update the rows named by id and insert the others.
+    Returns the ids of the inserted and of the updated rows
+    """
+    table = model.__table__
+    values = {name: staging.c[name] for name in columns}
+    if "version" in table.c:
+        values["version"] = table.c.version + 1
+    updated = (
+        connection.execute(
+            update(table)
+            .where(table.c.id == staging.c.id)
+            .values(values)
+            .returning(table.c.id)
+        )
+        .scalars()
+        .all()
+    )
+    inserted = (
+        connection.execute(
+            insert(table)
+            .from_select(
+                columns,
+                select(*(staging.c[name] for name in columns))
+                .where(staging.c.id.is_(None))
+                .order_by(staging.c.line),
+            )
+            .returning(table.c.id)
+        )
+        .scalars()
+        .all()
+    )
+
+    # Core statements are not seen by the flush listener
+    record_changes(connection, model, "update", updated)
+    record_changes(connection, model, "insert", inserted)
+    return inserted, updated
+
+
+"""
+Kinds
+How the staged rows of each table are matched with existing rows
+"""
+
+
+def merge_actors(connection, staging, errors):
+    actors = Actor.__table__
+    s = staging.c
+    by_email = select(actors.c.id).where(actors.c.email == s.email).scalar_subquery()
+    by_phone = select(actors.c.id).where(actors.c.phone == s.phone).scalar_subquery()
+
+    reject(
+        connection,
+        staging,
+        by_email != by_phone,
+        errors,
+        {"phone": "Belongs to another actor than the email."},
+    )
+    connection.execute(staging.update().values(id=func.coalesce(by_email, by_phone)))
+    reject_superseded(
+        connection,
+        staging,
+        errors,
+        {"row": "A later row has the same email or phone."},
+        s.email,
+        s.phone,
+        s.id,
+    )
+
+    inserted, updated = merge(connection, staging, Actor, ACTOR_COLUMNS)
+    if inserted:
+        refresh_stats(actor_ids=inserted, movie_ids=[], connection=connection)
+    if updated:
+        # The movies showing their names, which may have changed
+        touch(connection, Movie, accepted_partners(Actor, updated))
+    return len(inserted), len(updated)
+
+
+def reject_unknown_ids(connection, staging, errors, model, name):
+    reject(
+        connection,
+        staging,
+        and_(
+            staging.c.id.isnot(None),
+            ~exists().where(model.__table__.c.id == staging.c.id),
+        ),
+        errors,
+        {"id": f"No {name} with this id."},
+    )
+    reject_superseded(
+        connection,
+        staging,
+        errors,
+        {"id": "A later row has the same id."},
+        staging.c.id,
+    )
+
+
+def merge_movies(connection, staging, errors):
+    reject_unknown_ids(connection, staging, errors, Movie, "movie")
+    inserted, updated = merge(connection, staging, Movie, MOVIE_COLUMNS)
+    if inserted:
+        refresh_stats(actor_ids=[], movie_ids=inserted, connection=connection)
+    if updated:
+        touch(connection, Actor, accepted_partners(Movie, updated))
+    return len(inserted), len(updated)
+
+
+def merge_castings(connection, staging, errors):
+    castings = Casting.__table__
+    s = staging.c
+    for key, model, name in (
+        ("actor_id", Actor, "actor"),
+        ("movie_id", Movie, "movie"),
+    ):
+        reject(
+            connection,
+            staging,
+            ~exists().where(model.__table__.c.id == s[key]),
+            errors,
+            {key: f"No {name} with this id."},
+        )
+    reject_unknown_ids(connection, staging, errors, Casting, "casting")
+
+    # Both the old and the new actors and movies of moved castings
+    parents = connection.execute(
+        select(s.actor_id, s.movie_id).union(
+            select(castings.c.actor_id, castings.c.movie_id).where(
+                castings.c.id == s.id
+            )
+        )
+    ).all()
+    inserted, updated = merge(connection, staging, Casting, CASTING_COLUMNS)
+
+    actor_ids = {actor_id for actor_id, movie_id in parents} - {None}
+    movie_ids = {movie_id for actor_id, movie_id in parents} - {None}
+    refresh_stats(actor_ids, movie_ids, connection)
+    if movie_ids:
+        refresh_movie_rollup(movie_ids, connection)
+    touch(connection, Actor, actor_ids)
+    touch(connection, Movie, movie_ids)
+    return len(inserted), len(updated)
+
+
+ACTOR_COLUMNS = [name for name in ACTOR_SCHEMA.fields]
+MOVIE_COLUMNS = [name for name in MOVIE_IMPORT_SCHEMA.fields if name != "id"]
+CASTING_COLUMNS = [name for name in CASTING_IMPORT_SCHEMA.fields if name != "id"]
+
+
+class ImportKind:
+    def __init__(self, model, schema, columns, merge, defaults=None):
+        self.model = model
+        self.schema = schema
+        self.columns = columns
+        self.merge = merge
+        self.defaults = defaults or {}
+
+
+KINDS = {
+    # Matched by email or phone, which are unique
+    "actors": ImportKind(Actor, ACTOR_SCHEMA, ACTOR_COLUMNS, merge_actors),
+    # Matched by id when the row has one
+    "movies": ImportKind(Movie, MOVIE_IMPORT_SCHEMA, MOVIE_COLUMNS, merge_movies),
+    "castings": ImportKind(
+        Casting,
+        CASTING_IMPORT_SCHEMA,
+        CASTING_COLUMNS,
+        merge_castings,
+        defaults={"casting_duration": 60},
+    ),
+}
+
+
+def import_chunk(kind, chunk, report):
+    errors = []
+    try:
+        with UnitOfWork():
+            connection = db.session.connection()
+            staging = create_staging(connection, kind.model, kind.columns)
+            copy_rows(connection, staging, chunk)
+            inserted, updated = kind.merge(connection, staging, errors)
+    except DBAPIError as e:
+        # E.g. a concurrent write took an email of the chunk
+        message = str(e.orig).split("\n")[0]
+        for line, data in chunk:
+            report.error(line, {"row": f"Not saved: {message}"})
+        return
+
+    report.inserted += inserted
+    report.updated += updated
+    for line, message in sorted(errors, key=lambda error: error[0]):
+        report.error(line, message)
+
+
+def import_rows(kind, stream, format, chunk_size=5000, max_errors=1000):
+    """Import the rows of a text stream into the table of kind ("actors",
+    "movies" or "castings"). format is "csv" or "ndjson"
+    """
+    kind = KINDS[kind]
+    report = ImportReport(max_errors)
+    chunk = []
+    for line, data in READERS[format](stream, kind.schema):
+        report.rows += 1
+        if isinstance(data, ValidationError):
+            report.error(line, data.errors)
+            continue
+        chunk.append((line, {**kind.defaults, **data}))
+        if len(chunk) >= chunk_size:
+            import_chunk(kind, chunk, report)
+            chunk = []
+    if chunk:
+        import_chunk(kind, chunk, report)
+    return report
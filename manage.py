@@ -2,7 +2,10 @@ from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from models import db
-from app import app
+from app import create_app
+
+
+app = create_app()
 
 migrate = Migrate(app, db, render_as_batch=False)
 manager = Manager(app)
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+"""
+Metrics
+Recorded for every request by the hooks of setup_metrics. Routes are
+labelled by their rule, e.g. /actors/<int:actor_id>, so the number of
+series doesn't grow with the ids requested. Under gunicorn each worker
+writes its values to files in PROMETHEUS_MULTIPROC_DIR (see
+gunicorn.conf.py) and /metrics adds up the files of all the workers
+"""
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to the response, by route",
+    ["method", "route"],
+)
+REQUESTS = Counter(
+    "http_requests_total",
+    "Responses, by route and status",
+    ["method", "route", "status"],
+)
+AUTH_FAILURES = Counter(
+    "http_auth_failures_total", "Requests rejected by AuthError, by code", ["code"]
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests being handled, by route",
+    ["method", "route"],
+    # The sum of the live workers
+    multiprocess_mode="livesum",
+)
+
+# Requests which match no route share one label
+UNMATCHED = "<unmatched>"
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule is not None else UNMATCHED
+
+
+def record_auth_failure(code):
+    """Count a request rejected by AuthError, called by its error handler"""
+    AUTH_FAILURES.labels(code).inc()
+    g.auth_failure = code
+
+
+def metrics_text():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+"""
+Access log
+One JSON object per response on stderr, under the casting_agency.access
+logger. Each request has an id: the X-Request-ID header set by a proxy
+in front, if any, or a new one. It is sent back in X-Request-ID
+"""
+
+access_log = logging.getLogger("casting_agency.access")
+
+REQUEST_ID = re.compile(r"[\w.:-]{1,128}")
+
+
+def request_id():
+    given = request.headers.get("X-Request-ID", "")
+    return given if REQUEST_ID.fullmatch(given) else uuid.uuid4().hex
+
+
+def access_entry(response, duration):
+    entry = {
+        "time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "request_id": g.request_id,
+        "method": request.method,
+        "path": request.path,
+        "route": route_label(),
+        "status": response.status_code,
+        "duration_ms": round(duration * 1000, 2),
+        # None for streamed responses
+        "bytes": None if response.is_streamed else response.content_length,
+        "remote_addr": request.remote_addr,
+        "user_agent": request.user_agent.string,
+    }
+    if "auth_failure" in g:
+        entry["auth_failure"] = g.auth_failure
+    return entry
+
+
+def setup_metrics(app):
+    """Record the metrics of every request unless METRICS_ENABLED is off,
+    serve them at /metrics, and log each response unless ACCESS_LOG is off
+    """
+    app.config.setdefault("METRICS_ENABLED", True)
+    app.config.setdefault("ACCESS_LOG", True)
+
+    if app.config["ACCESS_LOG"] and not access_log.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        access_log.addHandler(handler)
+        access_log.setLevel(logging.INFO)
+        access_log.propagate = False
+
+    @app.before_request
+    def start_request():
+        g.request_id = request_id()
+        g.request_started = time.perf_counter()
+        if app.config["METRICS_ENABLED"]:
+            g.in_flight = IN_FLIGHT.labels(request.method, route_label())
+            g.in_flight.inc()
+
+    @app.after_request
+    def record_request(response):
+        if "request_started" not in g:
+            return response
+        duration = time.perf_counter() - g.request_started
+        response.headers["X-Request-ID"] = g.request_id
+
+        if app.config["METRICS_ENABLED"]:
+            route = route_label()
+            REQUEST_LATENCY.labels(request.method, route).observe(duration)
+            REQUESTS.labels(request.method, route, response.status_code).inc()
+        if app.config["ACCESS_LOG"]:
+            access_log.info(json.dumps(access_entry(response, duration)))
+        return response
+
+    @app.teardown_request
+    def end_request(error):
+        # Runs even when the response failed
+        in_flight = g.pop("in_flight", None)
+        if in_flight is not None:
+            in_flight.dec()
+
+    if app.config["METRICS_ENABLED"]:
+
+        @app.route("/metrics", methods=["GET"])
+        def metrics():
+            return app.response_class(metrics_text(), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,26 @@
+"""add version columns for optimistic concurrency
+
+Revision ID: 4f2a9c1e7b3d
+Revises: d8c98a4cae5e
+Create Date: 2026-10-19 10:12:41.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f2a9c1e7b3d'
+down_revision = 'd8c98a4cae5e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Actors', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('Movies', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('Movies', 'version')
+    op.drop_column('Actors', 'version')
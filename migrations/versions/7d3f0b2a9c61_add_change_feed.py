@@ -0,0 +1,36 @@
+"""add change feed outbox
+
+Revision ID: 7d3f0b2a9c61
+Revises: e52b9a4c7f10
+Create Date: 2026-10-19 18:05:12.431907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f0b2a9c61'
+down_revision = 'e52b9a4c7f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('Changes',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('xid', sa.BigInteger(), server_default=sa.text('pg_current_xact_id()::text::bigint'), nullable=False),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('operation', sa.String(length=10), nullable=False),
+    sa.Column('data', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_Changes_xid_id', 'Changes', ['xid', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Changes_xid_id', table_name='Changes')
+    op.drop_table('Changes')
@@ -0,0 +1,65 @@
+"""add precomputed casting stats of actors and movies
+
+Revision ID: 9b7e3d5a1c24
+Revises: 4f2a9c1e7b3d
+Create Date: 2026-10-19 14:03:27.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b7e3d5a1c24'
+down_revision = '4f2a9c1e7b3d'
+branch_labels = None
+depends_on = None
+
+
+BACKFILL = '''
+    INSERT INTO "{table}"
+    SELECT p.id,
+           count(c.id),
+           count(c.id) FILTER (WHERE c.casting_date > localtimestamp),
+           count(c.id) FILTER (WHERE c.status = 'reject'),
+           min(c.casting_date) FILTER (WHERE c.casting_date > localtimestamp)
+    FROM "{parent}" p LEFT OUTER JOIN "Casting" c ON c.{key} = p.id
+    GROUP BY p.id
+'''
+
+
+def upgrade():
+    op.create_index(op.f('ix_Casting_actor_id'), 'Casting', ['actor_id'], unique=False)
+    op.create_index(op.f('ix_Casting_movie_id'), 'Casting', ['movie_id'], unique=False)
+    op.create_table('ActorStats',
+    sa.Column('actor_id', sa.Integer(), nullable=False),
+    sa.Column('casting_total', sa.Integer(), nullable=False),
+    sa.Column('castings_upcoming', sa.Integer(), nullable=False),
+    sa.Column('casting_reject', sa.Integer(), nullable=False),
+    sa.Column('next_casting_date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['actor_id'], ['Actors.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('actor_id')
+    )
+    op.create_index(op.f('ix_ActorStats_next_casting_date'), 'ActorStats', ['next_casting_date'], unique=False)
+    op.create_table('MovieStats',
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('casting_total', sa.Integer(), nullable=False),
+    sa.Column('castings_upcoming', sa.Integer(), nullable=False),
+    sa.Column('casting_reject', sa.Integer(), nullable=False),
+    sa.Column('next_casting_date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['movie_id'], ['Movies.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('movie_id')
+    )
+    op.create_index(op.f('ix_MovieStats_next_casting_date'), 'MovieStats', ['next_casting_date'], unique=False)
+
+    op.execute(BACKFILL.format(table='ActorStats', parent='Actors', key='actor_id'))
+    op.execute(BACKFILL.format(table='MovieStats', parent='Movies', key='movie_id'))
+
+
+def downgrade():
+    op.drop_index(op.f('ix_MovieStats_next_casting_date'), table_name='MovieStats')
+    op.drop_table('MovieStats')
+    op.drop_index(op.f('ix_ActorStats_next_casting_date'), table_name='ActorStats')
+    op.drop_table('ActorStats')
+    op.drop_index(op.f('ix_Casting_movie_id'), table_name='Casting')
+    op.drop_index(op.f('ix_Casting_actor_id'), table_name='Casting')
@@ -0,0 +1,43 @@
+"""add updated_at columns and tombstones
+
+Revision ID: a6c2e8f41d93
+Revises: 7d3f0b2a9c61
+Create Date: 2026-10-19 19:02:47.118254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6c2e8f41d93'
+down_revision = '7d3f0b2a9c61'
+branch_labels = None
+depends_on = None
+
+
+TABLES = ('Actors', 'Movies', 'Casting')
+
+
+def upgrade():
+    for table in TABLES:
+        # Existing rows get the time of the migration
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), server_default=sa.text('clock_timestamp()'), nullable=False))
+        op.create_index(f'ix_{table}_updated_at', table, ['updated_at'], unique=False)
+
+    op.create_table('Tombstones',
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), server_default=sa.text('clock_timestamp()'), nullable=False),
+    sa.PrimaryKeyConstraint('entity', 'entity_id')
+    )
+    op.create_index('ix_Tombstones_entity_deleted_at', 'Tombstones', ['entity', 'deleted_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Tombstones_entity_deleted_at', table_name='Tombstones')
+    op.drop_table('Tombstones')
+
+    for table in TABLES:
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        op.drop_column(table, 'updated_at')
@@ -0,0 +1,31 @@
+"""add casting duration and time slot range
+
+Revision ID: c3a81f6d2e57
+Revises: 9b7e3d5a1c24
+Create Date: 2026-10-19 15:21:09.834117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a81f6d2e57'
+down_revision = '9b7e3d5a1c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('Casting', sa.Column('casting_duration', sa.Integer(), server_default='60', nullable=False))
+    op.add_column('Casting', sa.Column('slot', postgresql.TSRANGE(), sa.Computed('tsrange(casting_date, casting_date + make_interval(mins => casting_duration))', ), nullable=True))
+    op.create_check_constraint('check_valid_duration', 'Casting', 'casting_duration > 0')
+    op.create_index('ix_Casting_slot', 'Casting', ['slot'], unique=False, postgresql_using='gist')
+
+
+def downgrade():
+    op.drop_index('ix_Casting_slot', table_name='Casting', postgresql_using='gist')
+    op.drop_constraint('check_valid_duration', 'Casting', type_='check')
+    op.drop_column('Casting', 'slot')
+    op.drop_column('Casting', 'casting_duration')
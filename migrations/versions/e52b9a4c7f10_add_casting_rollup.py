@@ -0,0 +1,41 @@
+"""add monthly casting rollup for analytics
+
+Revision ID: e52b9a4c7f10
+Revises: c3a81f6d2e57
+Create Date: 2026-10-19 16:40:52.207331
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e52b9a4c7f10'
+down_revision = 'c3a81f6d2e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_Casting_casting_date'), 'Casting', ['casting_date'], unique=False)
+    op.create_table('CastingRollup',
+    sa.Column('month', sa.DateTime(), nullable=False),
+    sa.Column('movie_id', sa.Integer(), nullable=False),
+    sa.Column('status', postgresql.ENUM('accept', 'reject', 'in_process', name='statustype', create_type=False), nullable=False),
+    sa.Column('castings', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['movie_id'], ['Movies.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('month', 'movie_id', 'status')
+    )
+    op.create_table('CastingRollupState',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_up_until', sa.DateTime(), nullable=False),
+    sa.CheckConstraint('id = 1', name='check_single_row'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('CastingRollupState')
+    op.drop_table('CastingRollup')
+    op.drop_index(op.f('ix_Casting_casting_date'), table_name='Casting')
@@ -5,17 +5,33 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    BigInteger,
     Boolean,
     ForeignKey,
     DateTime,
     ARRAY,
     CheckConstraint,
+    Computed,
     Enum,
+    Index,
+    event,
+    func,
+    inspect,
+    select,
+    delete,
+    text,
+    update,
 )
-from sqlalchemy.orm import relationship, column_property, backref
+from sqlalchemy.dialects.postgresql import JSONB, TSRANGE, insert
+from sqlalchemy.orm import relationship, column_property, backref, configure_mappers
+from sqlalchemy.orm.util import identity_key
 from flask_migrate import Migrate
+from sqlalchemy.exc import DBAPIError
 import enum
 from datetime import datetime
+from functools import wraps
+
+from replicas import REPLICA_BIND_KEY, RoutingSession, setup_replica
 
 
 # Take environment variables from ".env"
@@ -23,19 +39,32 @@ from datetime import datetime
 load_dotenv()
 
 DB_PATH = os.getenv("DATABASE_URL").replace("postgres://", "postgresql://", 1)
+# Optional read replica, GET requests read from it when set
+DB_PATH_REPLICA = os.getenv("DATABASE_URL_REPLICA")
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 
 
-def setup_db(app, database_path=DB_PATH):
+def setup_db(app, database_path=DB_PATH, replica_path=DB_PATH_REPLICA):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    binds = dict(app.config.get("SQLALCHEMY_BINDS", {}))
+    if replica_path:
+        binds[REPLICA_BIND_KEY] = replica_path.replace(
+            "postgres://", "postgresql://", 1
+        )
+    else:
+        binds.pop(REPLICA_BIND_KEY, None)
+    app.config["SQLALCHEMY_BINDS"] = binds
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     # See the SQL queries being printed on the terminal
     # app.config["SQLALCHEMY_ECHO"] = True
-    app.debug = True
     db.app = app
     db.init_app(app)
+    setup_replica(app, db)
+    # Creates the backrefs, e.g. Casting.actor, which the queries of
+    # queries.py name before any model is used
+    configure_mappers()
     with app.app_context():
         db.create_all()
 
@@ -49,6 +78,11 @@ def db_drop_and_create_all():
     db.drop_all()
     db.create_all()
 
+    with UnitOfWork():
+        seed_db()
+
+
+def seed_db():
     movie1 = Movie(
         title="Big house",
         genres=["TV show"],
@@ -146,16 +180,126 @@ def db_drop_and_create_all():
     casting3.insert()
 
 
+"""
+Unit of work
+Batches the session's adds and deletes and commits them once.
+Used as a context manager:
+
+    with UnitOfWork():
+        actor.insert()
+        casting.insert()
+
+or as a decorator, which also retries the whole function when postgres
+aborts the transaction with a serialization failure or deadlock:
+
+    @UnitOfWork()
+    def add_actor(payload): ...
+
+A unit of work opened inside another one becomes a savepoint.
+"""
+
+# Serialization failure, deadlock detected
+RETRYABLE_PGCODES = ("40001", "40P01")
+
+
+def retryable(error):
+    """Whether error aborted a transaction which may succeed when run again.
+    Handlers which turn database errors into responses raise these ones
+    again, for their UnitOfWork to retry
+    """
+    return (
+        isinstance(error, DBAPIError)
+        and getattr(error.orig, "pgcode", None) in RETRYABLE_PGCODES
+    )
+
+
+class UnitOfWork:
+    def __init__(self, retries=3):
+        self.retries = retries
+        self._savepoint = None
+
+    @staticmethod
+    def active():
+        return db.session.info.get("unit_of_work_depth", 0) > 0
+
+    def __enter__(self):
+        info = db.session.info
+        depth = info.get("unit_of_work_depth", 0)
+        if depth:
+            self._savepoint = db.session.begin_nested()
+        info["unit_of_work_depth"] = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        db.session.info["unit_of_work_depth"] -= 1
+
+        if self._savepoint is not None:
+            if exc_type is None:
+                self._savepoint.commit()
+            else:
+                self._savepoint.rollback()
+            return False
+
+        if exc_type is None:
+            try:
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        else:
+            db.session.rollback()
+        return False
+
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            attempt = 0
+            while True:
+                # The outer unit of work owns the retries
+                nested = UnitOfWork.active()
+                try:
+                    with UnitOfWork(self.retries):
+                        return f(*args, **kwargs)
+                except DBAPIError as e:
+                    if nested or not retryable(e) or attempt >= self.retries:
+                        raise
+                    attempt += 1
+
+        return wrapper
+
+
 class DbTransactions:
+    """Compatibility helpers. They commit right away when called on their own,
+    and only flush when they run inside a UnitOfWork
+    """
+
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        _commit_or_flush()
 
     def update(self):
-        db.session.commit()
+        _commit_or_flush()
 
     def delete(self):
         db.session.delete(self)
+        _commit_or_flush()
+
+    def apply_changes(self, changes):
+        """Set only the attributes whose value differs, so the UPDATE
+        touches only those columns. Returns the changed attributes
+        """
+        changed = {}
+        for field, value in changes.items():
+            if getattr(self, field) != value:
+                setattr(self, field, value)
+                changed[field] = value
+        return changed
+
+
+def _commit_or_flush():
+    if UnitOfWork.active():
+        db.session.flush()
+    else:
         db.session.commit()
 
 
@@ -178,9 +322,30 @@ class Movie(db.Model, DbTransactions):
     genres = Column(ARRAY(String(120)), nullable=False)
     release_date = Column(DateTime, default=datetime.now)
     seeking_actor = Column(Boolean, nullable=False, default=True)
+    version = Column(Integer, nullable=False, server_default="1")
+    # Last write to the movie, or to the castings and names its format_json shows
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        index=True,
+        server_default=func.clock_timestamp(),
+        onupdate=func.clock_timestamp(),
+    )
     castings = relationship(
-        "Casting", backref=backref("movie", lazy="joined"), cascade="all, delete"
+        "Casting",
+        backref=backref("movie", lazy="joined"),
+        cascade="all, delete",
+        # Left to ON DELETE CASCADE, see delete_rows()
+        passive_deletes=True,
+    )
+    accepted_castings = relationship(
+        "Casting",
+        primaryjoin="and_(Movie.id == Casting.movie_id, Casting.status == 'accept')",
+        viewonly=True,
     )
+    stats = relationship("MovieStats", uselist=False, lazy="joined", viewonly=True)
+    # Optimistic concurrency: UPDATE/DELETE only match the version we loaded
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(self, title, genres, release_date, seeking_actor):
         self.title = title
@@ -188,6 +353,13 @@ class Movie(db.Model, DbTransactions):
         self.release_date = release_date
         self.seeking_actor = seeking_actor
 
+    def delete(self):
+        # One statement whatever the number of castings
+        db.session.flush()
+        delete_rows(Movie, lock_rows(Movie, [self.id]))
+        db.session.expunge(self)
+        _commit_or_flush()
+
     def format_json(self):
         ordered_keys = [
             "id",
@@ -200,41 +372,21 @@ class Movie(db.Model, DbTransactions):
             "castings_upcoming",
             "castings_past",
             "casting_reject",
+            "version",
         ]
 
         data = {
             "id": self.id,
+            "version": self.version,
             "title": self.title,
             "genres": self.genres,
             "release_date": str(self.release_date),
             "seeking_actor": self.seeking_actor,
             "accepted_actors": [
                 {"actor": casting.actor.fullname, "role": casting.role}
-                for casting in self.castings
-                if casting.status == StatusType.accept
+                for casting in self.accepted_castings
             ],
-            "casting_total": len(self.castings),
-            "castings_upcoming": len(
-                [
-                    casting
-                    for casting in self.castings
-                    if casting.casting_date > datetime.now()
-                ]
-            ),
-            "castings_past": len(
-                [
-                    casting
-                    for casting in self.castings
-                    if casting.casting_date <= datetime.now()
-                ]
-            ),
-            "casting_reject": len(
-                [
-                    casting
-                    for casting in self.castings
-                    if casting.status == StatusType.reject
-                ]
-            ),
+            **casting_counters(self.stats, Casting.movie_id == self.id),
         }
 
         ordered_data = {key: data[key] for key in ordered_keys}
@@ -261,10 +413,31 @@ class Actor(db.Model, DbTransactions):
     phone = Column(String(120), unique=True, nullable=False)
     photo_link = Column(String(500), nullable=False)
     seeking_movie = Column(Boolean, nullable=False, default=True)
+    version = Column(Integer, nullable=False, server_default="1")
+    # Last write to the actor, or to the castings and names its format_json shows
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        index=True,
+        server_default=func.clock_timestamp(),
+        onupdate=func.clock_timestamp(),
+    )
     castings = relationship(
-        "Casting", backref=backref("actor", lazy="joined"), cascade="all, delete"
+        "Casting",
+        backref=backref("actor", lazy="joined"),
+        cascade="all, delete",
+        # Left to ON DELETE CASCADE, see delete_rows()
+        passive_deletes=True,
+    )
+    accepted_castings = relationship(
+        "Casting",
+        primaryjoin="and_(Actor.id == Casting.actor_id, Casting.status == 'accept')",
+        viewonly=True,
     )
+    stats = relationship("ActorStats", uselist=False, lazy="joined", viewonly=True)
     __table_args__ = (CheckConstraint(age > 0, name="check_valid_age"), {})
+    # Optimistic concurrency: UPDATE/DELETE only match the version we loaded
+    __mapper_args__ = {"version_id_col": version}
 
     def __init__(
         self,
@@ -288,6 +461,13 @@ class Actor(db.Model, DbTransactions):
         self.photo_link = photo_link
         self.seeking_movie = seeking_movie
 
+    def delete(self):
+        # One statement whatever the number of castings
+        db.session.flush()
+        delete_rows(Actor, lock_rows(Actor, [self.id]))
+        db.session.expunge(self)
+        _commit_or_flush()
+
     def format_json(self):
 
         ordered_keys = [
@@ -306,10 +486,12 @@ class Actor(db.Model, DbTransactions):
             "castings_past",
             "casting_reject",
             "movies_success",
+            "version",
         ]
 
         data = {
             "id": self.id,
+            "version": self.version,
             "first_name": self.first_name,
             "last_name": self.last_name,
             "full_name": self.fullname,
@@ -319,32 +501,10 @@ class Actor(db.Model, DbTransactions):
             "phone": self.phone,
             "photo_link": self.photo_link,
             "seeking_movie": self.seeking_movie,
-            "casting_total": len(self.castings),
-            "castings_upcoming": len(
-                [
-                    casting
-                    for casting in self.castings
-                    if casting.casting_date > datetime.now()
-                ]
-            ),
-            "castings_past": len(
-                [
-                    casting
-                    for casting in self.castings
-                    if casting.casting_date <= datetime.now()
-                ]
-            ),
-            "casting_reject": len(
-                [
-                    casting
-                    for casting in self.castings
-                    if casting.status == StatusType.reject
-                ]
-            ),
+            **casting_counters(self.stats, Casting.actor_id == self.id),
             "movies_success": [
                 {"movie": casting.movie.title, "role": casting.role}
-                for casting in self.castings
-                if casting.status == StatusType.accept
+                for casting in self.accepted_castings
             ],
         }
 
@@ -352,6 +512,18 @@ class Actor(db.Model, DbTransactions):
 
         return ordered_data
 
+    def format_summary_json(self):
+        """Contact details only, for long lists such as available actors"""
+        return {
+            "id": self.id,
+            "full_name": self.fullname,
+            "age": self.age,
+            "gender": str(self.gender.value),
+            "email": self.email,
+            "phone": self.phone,
+            "photo_link": self.photo_link,
+        }
+
     def __repr__(self):
         return f"Actor: {self.id}, \
                     {self.first_name} {self.first_name} \
@@ -367,18 +539,53 @@ class Casting(db.Model, DbTransactions):
     __tablename__ = "Casting"
 
     id = Column(Integer, primary_key=True)
-    actor_id = Column(Integer, ForeignKey("Actors.id", ondelete="cascade"))
-    movie_id = Column(Integer, ForeignKey("Movies.id", ondelete="cascade"))
+    actor_id = Column(Integer, ForeignKey("Actors.id", ondelete="cascade"), index=True)
+    movie_id = Column(Integer, ForeignKey("Movies.id", ondelete="cascade"), index=True)
     role = Column(String(120), nullable=False)
-    casting_date = Column(DateTime, default=datetime.now)
+    casting_date = Column(DateTime, default=datetime.now, index=True)
+    # Length of the casting in minutes
+    casting_duration = Column(Integer, nullable=False, server_default="60")
     casting_address = Column(String(250), nullable=False)
     status = Column(Enum(StatusType), nullable=False)
+    updated_at = Column(
+        DateTime,
+        nullable=False,
+        index=True,
+        server_default=func.clock_timestamp(),
+        onupdate=func.clock_timestamp(),
+    )
+    # Time the actor is booked, kept up to date by postgres. A range type,
+    # so overlaps are found with && through a GiST index
+    slot = Column(
+        TSRANGE,
+        Computed(
+            "tsrange(casting_date, "
+            "casting_date + make_interval(mins => casting_duration))"
+        ),
+    )
+    # Double bookings could also be refused at the database level with
+    # EXCLUDE USING gist (actor_id WITH =, slot WITH &&), which needs the
+    # btree_gist extension
+    __table_args__ = (
+        CheckConstraint(casting_duration > 0, name="check_valid_duration"),
+        Index("ix_Casting_slot", slot, postgresql_using="gist"),
+    )
 
-    def __init__(self, actor_id, movie_id, role, casting_date, casting_address, status):
+    def __init__(
+        self,
+        actor_id,
+        movie_id,
+        role,
+        casting_date,
+        casting_address,
+        status,
+        casting_duration=60,
+    ):
         self.actor_id = actor_id
         self.movie_id = movie_id
         self.role = role
         self.casting_date = casting_date
+        self.casting_duration = casting_duration
         self.casting_address = casting_address
         self.status = status
 
@@ -398,3 +605,609 @@ class Casting(db.Model, DbTransactions):
                     movie: {self.movies.title}, \
                     actor: {self.actors.first_name} {self.actors.last_name} \
                     ({self.role}). Status: {self.status.value}"
+
+
+def available_actors(start, end, gender=None, min_age=None, max_age=None):
+    """Query of the actors seeking a movie who have no casting overlapping
+    [start, end). Rejected castings don't keep an actor busy
+    """
+    busy = Casting.query.filter(
+        Casting.actor_id == Actor.id,
+        Casting.status != StatusType.reject,
+        Casting.slot.op("&&")(func.tsrange(start, end)),
+    )
+    query = Actor.query.filter(Actor.seeking_movie.is_(True), ~busy.exists())
+    if gender is not None:
+        query = query.filter(Actor.gender == gender)
+    if min_age is not None:
+        query = query.filter(Actor.age >= min_age)
+    if max_age is not None:
+        query = query.filter(Actor.age <= max_age)
+    return query
+
+
+"""
+Casting statistics
+The counters shown for each actor and movie, precomputed so list
+endpoints read them with one join instead of loading every casting.
+A row is recomputed whenever a flush touches the entity's castings.
+
+Upcoming castings turn into past ones as time goes by, so each row also
+stores next_casting_date, the first casting still upcoming when it was
+computed. Until then its split is exact; once that date has passed the
+row is due and the split is counted live until the row is refreshed
+(flask refresh-stats, or the next write to one of its castings).
+"""
+
+
+class CastingStats:
+    casting_total = Column(Integer, nullable=False, default=0)
+    castings_upcoming = Column(Integer, nullable=False, default=0)
+    casting_reject = Column(Integer, nullable=False, default=0)
+    next_casting_date = Column(DateTime, index=True)
+
+
+class ActorStats(db.Model, CastingStats):
+    __tablename__ = "ActorStats"
+
+    actor_id = Column(
+        Integer, ForeignKey("Actors.id", ondelete="cascade"), primary_key=True
+    )
+
+
+class MovieStats(db.Model, CastingStats):
+    __tablename__ = "MovieStats"
+
+    movie_id = Column(
+        Integer, ForeignKey("Movies.id", ondelete="cascade"), primary_key=True
+    )
+
+
+def casting_counters(stats, criterion):
+    """The casting counters of format_json, from the entity's stats row"""
+    now = datetime.now()
+    if stats is None:
+        # Not computed yet, e.g. rows bulk inserted without refresh_stats()
+        total, upcoming, reject = db.session.execute(
+            select(
+                func.count(Casting.id),
+                func.count(Casting.id).filter(Casting.casting_date > now),
+                func.count(Casting.id).filter(Casting.status == StatusType.reject),
+            ).where(criterion)
+        ).one()
+    else:
+        total, upcoming, reject = (
+            stats.casting_total,
+            stats.castings_upcoming,
+            stats.casting_reject,
+        )
+        if stats.next_casting_date is not None and stats.next_casting_date <= now:
+            upcoming = db.session.execute(
+                select(func.count(Casting.id)).where(
+                    criterion, Casting.casting_date > now
+                )
+            ).scalar()
+
+    return {
+        "casting_total": total,
+        "castings_upcoming": upcoming,
+        "castings_past": total - upcoming,
+        "casting_reject": reject,
+    }
+
+
+def _refresh(connection, stats, entity, foreign_key, ids):
+    now = datetime.now()
+    upcoming = Casting.casting_date > now
+    query = (
+        select(
+            entity.id,
+            func.count(Casting.id),
+            func.count(Casting.id).filter(upcoming),
+            func.count(Casting.id).filter(Casting.status == StatusType.reject),
+            func.min(Casting.casting_date).filter(upcoming),
+        )
+        .select_from(entity)
+        .outerjoin(Casting, foreign_key == entity.id)
+        .group_by(entity.id)
+    )
+    if ids is not None:
+        query = query.where(entity.id.in_(ids))
+
+    key = stats.__table__.primary_key.columns.values()[0].name
+    columns = [
+        key,
+        "casting_total",
+        "castings_upcoming",
+        "casting_reject",
+        "next_casting_date",
+    ]
+    statement = insert(stats.__table__).from_select(columns, query)
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=[key],
+            set_={name: statement.excluded[name] for name in columns[1:]},
+        )
+    )
+
+
+def refresh_stats(actor_ids=None, movie_ids=None, connection=None):
+    """Recompute the stats of the given actors and movies, all of them
+    when no ids are given. The ids may also be a select of ids
+    """
+    connection = connection or db.session.connection()
+    _refresh(connection, ActorStats, Actor, Casting.actor_id, actor_ids)
+    _refresh(connection, MovieStats, Movie, Casting.movie_id, movie_ids)
+
+
+def refresh_due_stats():
+    """Recompute the rows whose next casting date has passed"""
+    now = datetime.now()
+    refresh_stats(
+        select(ActorStats.actor_id).where(ActorStats.next_casting_date <= now),
+        select(MovieStats.movie_id).where(MovieStats.next_casting_date <= now),
+    )
+
+
+def flushed_casting_parents(session):
+    """Ids of the actors and movies whose castings were just flushed,
+    before and after any change of actor_id or movie_id
+    """
+    actor_ids = set()
+    movie_ids = set()
+    for obj in session.new | session.dirty | session.deleted:
+        if not isinstance(obj, Casting):
+            continue
+        state = inspect(obj)
+        for ids, attr in ((actor_ids, "actor_id"), (movie_ids, "movie_id")):
+            history = state.attrs[attr].history
+            ids.update(history.added or history.unchanged or ())
+            ids.update(history.deleted or ())
+
+    actor_ids.discard(None)
+    movie_ids.discard(None)
+    return actor_ids, movie_ids
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def refresh_flushed_stats(session, flush_context):
+    actor_ids, movie_ids = flushed_casting_parents(session)
+    for obj in session.new:
+        if isinstance(obj, Actor):
+            actor_ids.add(obj.id)
+        elif isinstance(obj, Movie):
+            movie_ids.add(obj.id)
+
+    connection = session.connection()
+    if actor_ids:
+        _refresh(connection, ActorStats, Actor, Casting.actor_id, actor_ids)
+    if movie_ids:
+        _refresh(connection, MovieStats, Movie, Casting.movie_id, movie_ids)
+
+    # Loaded stats and accepted castings of these entities are now stale
+    for model, stats, ids in (
+        (Actor, ActorStats, actor_ids),
+        (Movie, MovieStats, movie_ids),
+    ):
+        for id in ids:
+            obj = session.identity_map.get(identity_key(stats, id))
+            if obj is not None:
+                session.expire(obj)
+            obj = session.identity_map.get(identity_key(model, id))
+            if obj is not None:
+                session.expire(obj, ["stats", "accepted_castings"])
+
+
+"""
+Casting rollup
+Castings counted per month, movie and status, for the analytics
+endpoints. Only months before rolled_up_until (kept in CastingRollupState)
+are stored. Later castings are always counted live, so the report is
+exact whether or not the rollup is current.
+
+flask refresh-rollup extends it to the last closed month and only
+scans castings that are newer than the old boundary. A write to an
+already rolled up casting recounts that movie's months.
+"""
+
+
+class CastingRollup(db.Model):
+    __tablename__ = "CastingRollup"
+
+    month = Column(DateTime, primary_key=True)
+    movie_id = Column(
+        Integer, ForeignKey("Movies.id", ondelete="cascade"), primary_key=True
+    )
+    status = Column(Enum(StatusType), primary_key=True)
+    castings = Column(Integer, nullable=False)
+
+
+class CastingRollupState(db.Model):
+    __tablename__ = "CastingRollupState"
+
+    id = Column(Integer, primary_key=True, default=1)
+    rolled_up_until = Column(DateTime, nullable=False)
+    __table_args__ = (CheckConstraint(id == 1, name="check_single_row"), {})
+
+
+def casting_month():
+    return func.date_trunc("month", Casting.casting_date)
+
+
+def rollup_watermark(connection=None):
+    """First month not in the rollup, None when nothing was rolled up"""
+    connection = connection or db.session.connection()
+    return connection.execute(select(CastingRollupState.rolled_up_until)).scalar()
+
+
+def _roll_up(connection, criteria):
+    month = casting_month()
+    statement = insert(CastingRollup.__table__).from_select(
+        ["month", "movie_id", "status", "castings"],
+        select(month, Casting.movie_id, Casting.status, func.count())
+        .where(Casting.movie_id.isnot(None), *criteria)
+        .group_by(month, Casting.movie_id, Casting.status),
+    )
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=["month", "movie_id", "status"],
+            set_={"castings": statement.excluded.castings},
+        )
+    )
+
+
+def refresh_rollup(until=None):
+    """Roll up the castings before until, the current month by default"""
+    until = until or datetime.now().replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    connection = db.session.connection()
+    since = rollup_watermark(connection)
+    if since is not None and since >= until:
+        return
+
+    criteria = [Casting.casting_date < until]
+    if since is not None:
+        criteria.append(Casting.casting_date >= since)
+    _roll_up(connection, criteria)
+
+    statement = insert(CastingRollupState.__table__).values(id=1, rolled_up_until=until)
+    connection.execute(
+        statement.on_conflict_do_update(
+            index_elements=["id"], set_={"rolled_up_until": until}
+        )
+    )
+
+
+def refresh_movie_rollup(movie_ids, connection=None):
+    """Recount the rolled up months of the given movies"""
+    connection = connection or db.session.connection()
+    until = rollup_watermark(connection)
+    if until is None:
+        return
+
+    connection.execute(
+        CastingRollup.__table__.delete().where(CastingRollup.movie_id.in_(movie_ids))
+    )
+    _roll_up(
+        connection,
+        [Casting.movie_id.in_(movie_ids), Casting.casting_date < until],
+    )
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def refresh_flushed_rollup(session, flush_context):
+    actor_ids, movie_ids = flushed_casting_parents(session)
+    if movie_ids:
+        refresh_movie_rollup(movie_ids, session.connection())
+
+
+"""
+Change feed
+Every write to an actor, movie or casting appends a row to Changes in
+the same transaction (a transactional outbox), so consumers can follow
+the writes instead of rescanning the tables. ORM flushes are recorded
+by a listener, writes made without the ORM call record_changes().
+
+Rows are ordered by the transaction which wrote them (xid), then by id.
+A running transaction may hold a lower xid than transactions already
+committed, so changes.py only reads up to the oldest running one
+"""
+
+
+class Change(db.Model):
+    __tablename__ = "Changes"
+
+    id = Column(BigInteger, primary_key=True)
+    xid = Column(
+        BigInteger,
+        nullable=False,
+        server_default=text("pg_current_xact_id()::text::bigint"),
+    )
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    # insert, update or delete
+    operation = Column(String(10), nullable=False)
+    # The columns after the write, null for deletes
+    data = Column(JSONB)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    __table_args__ = (Index("ix_Changes_xid_id", xid, id),)
+
+    @property
+    def cursor(self):
+        return f"{self.xid}-{self.id}"
+
+    def format_json(self):
+        return {
+            "cursor": self.cursor,
+            "entity": self.entity,
+            "entity_id": self.entity_id,
+            "operation": self.operation,
+            "data": self.data,
+            "created_at": str(self.created_at),
+        }
+
+
+CHANGE_ENTITIES = {Actor: "actor", Movie: "movie", Casting: "casting"}
+
+
+def change_data(table, values):
+    """The columns of table found in values, as format_json writes them"""
+    data = {}
+    for column in table.columns:
+        if column.computed is not None or column.key not in values:
+            continue
+        value = values[column.key]
+        if isinstance(value, enum.Enum):
+            value = value.value
+        elif isinstance(value, datetime):
+            value = str(value)
+        data[column.key] = value
+    return data
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def record_flushed_changes(session, flush_context):
+    rows = []
+    for operation, objects in (
+        ("insert", session.new),
+        ("update", session.dirty),
+        ("delete", session.deleted),
+    ):
+        for obj in objects:
+            entity = CHANGE_ENTITIES.get(type(obj))
+            if entity is None:
+                continue
+            if operation == "update" and not session.is_modified(
+                obj, include_collections=False
+            ):
+                continue
+            mark_written(session, type(obj), [obj.id])
+            data = None
+            if operation != "delete":
+                data = change_data(obj.__table__, inspect(obj).dict)
+            rows.append(
+                {
+                    "entity": entity,
+                    "entity_id": obj.id,
+                    "operation": operation,
+                    "data": data,
+                }
+            )
+
+    if rows:
+        session.connection().execute(insert(Change.__table__), rows)
+
+
+def record_changes(connection, model, operation, ids):
+    """Record the writes of rows written without the ORM"""
+    if not ids:
+        return
+    mark_written(db.session, model, ids)
+    table = model.__table__
+    if operation == "delete":
+        rows = [{"entity_id": id, "data": None} for id in ids]
+    else:
+        rows = [
+            {"entity_id": row.id, "data": change_data(table, row._mapping)}
+            for row in connection.execute(
+                select(table).where(table.c.id.in_(ids)).order_by(table.c.id)
+            )
+        ]
+    connection.execute(
+        insert(Change.__table__),
+        [
+            {"entity": CHANGE_ENTITIES[model], "operation": operation, **row}
+            for row in rows
+        ],
+    )
+    if operation == "delete":
+        record_tombstones(connection, model, ids)
+
+
+"""
+Delta sync
+Clients keep a copy of the actors and movies and ask for what changed
+since their last sync: the rows whose updated_at is later, and the ids
+of the deleted rows, which leave a tombstone behind. updated_at moves
+on every write to the row, and also when the castings or the names
+shown by its format_json change
+"""
+
+
+class Tombstone(db.Model):
+    __tablename__ = "Tombstones"
+
+    entity = Column(String(20), primary_key=True)
+    entity_id = Column(Integer, primary_key=True)
+    deleted_at = Column(DateTime, nullable=False, server_default=func.clock_timestamp())
+    __table_args__ = (Index("ix_Tombstones_entity_deleted_at", entity, deleted_at),)
+
+
+def record_tombstones(connection, model, ids):
+    if not ids:
+        return
+    entity = CHANGE_ENTITIES[model]
+    connection.execute(
+        insert(Tombstone.__table__)
+        .values([{"entity": entity, "entity_id": id} for id in ids])
+        .on_conflict_do_nothing()
+    )
+
+
+def touch(connection, model, ids):
+    """Move updated_at of the given rows to now, the ids may be a select.
+    Returns the ids of the touched rows
+    """
+    table = model.__table__
+    touched = (
+        connection.execute(
+            update(table)
+            .where(table.c.id.in_(ids))
+            .values(updated_at=func.clock_timestamp())
+            .returning(table.c.id)
+        )
+        .scalars()
+        .all()
+    )
+    mark_written(db.session, model, touched)
+    return touched
+
+
+def mark_written(session, model, ids):
+    """Remember the actors and movies written by the transaction of
+    session, whose cached responses are dropped when it commits
+    """
+    if model is Actor or model is Movie:
+        entity = CHANGE_ENTITIES[model]
+        session.info.setdefault("written", set()).update((entity, id) for id in ids)
+
+
+def accepted_partners(model, ids):
+    """Select of the movies of the accepted castings of the given actors,
+    or the actors of those of the given movies. Their format_json shows
+    the name of these actors or the title of these movies
+    """
+    if model is Actor:
+        return select(Casting.movie_id).where(
+            Casting.actor_id.in_(ids), Casting.status == StatusType.accept
+        )
+    return select(Casting.actor_id).where(
+        Casting.movie_id.in_(ids), Casting.status == StatusType.accept
+    )
+
+
+# Columns shown by the format_json of other entities
+SHOWN_COLUMNS = {Actor: ("first_name", "last_name"), Movie: ("title",)}
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def touch_flushed_parents(session, flush_context):
+    actor_ids, movie_ids = flushed_casting_parents(session)
+    renamed = {Actor: set(), Movie: set()}
+    for obj in session.dirty:
+        columns = SHOWN_COLUMNS.get(type(obj))
+        state = inspect(obj)
+        if columns and any(state.attrs[name].history.has_changes() for name in columns):
+            renamed[type(obj)].add(obj.id)
+
+    connection = session.connection()
+    touched = {Actor: [], Movie: []}
+    if actor_ids:
+        touched[Actor] += touch(connection, Actor, actor_ids)
+    if movie_ids:
+        touched[Movie] += touch(connection, Movie, movie_ids)
+    if renamed[Actor]:
+        touched[Movie] += touch(
+            connection, Movie, accepted_partners(Actor, renamed[Actor])
+        )
+    if renamed[Movie]:
+        touched[Actor] += touch(
+            connection, Actor, accepted_partners(Movie, renamed[Movie])
+        )
+
+    for model, ids in touched.items():
+        for id in ids:
+            obj = session.identity_map.get(identity_key(model, id))
+            if obj is not None:
+                session.expire(obj, ["updated_at"])
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def record_flushed_tombstones(session, flush_context):
+    deleted = {}
+    for obj in session.deleted:
+        if type(obj) in CHANGE_ENTITIES:
+            deleted.setdefault(type(obj), []).append(obj.id)
+    for model, ids in deleted.items():
+        record_tombstones(session.connection(), model, ids)
+
+
+"""
+Deletes
+Actors and movies are deleted with one statement, their castings,
+stats and rollup rows by the database's ON DELETE CASCADE. The flush
+listeners never see the castings deleted that way, so their changes,
+tombstones and the stats and rollup of the other side are kept up to
+date here
+"""
+
+# What a DELETE returns of each deleted row
+DELETED_COLUMNS = {
+    Actor: (Actor.id, Actor.fullname.label("full_name"), Actor.version),
+    Movie: (Movie.id, Movie.title, Movie.version),
+}
+
+
+def lock_rows(model, ids, connection=None):
+    """Lock the actors or movies with the given ids, which also keeps new
+    castings from being added to them. Returns their id and version
+    """
+    connection = connection or db.session.connection()
+    table = model.__table__
+    return connection.execute(
+        select(table.c.id, table.c.version)
+        .where(table.c.id.in_(ids))
+        .order_by(table.c.id)
+        .with_for_update()
+    ).all()
+
+
+def delete_rows(model, rows, connection=None):
+    """Delete the actors or movies locked by lock_rows(). Returns the
+    deleted rows as DELETED_COLUMNS and the number of castings deleted
+    with them
+    """
+    connection = connection or db.session.connection()
+    table = model.__table__
+    ids = [row.id for row in rows]
+    if model is Actor:
+        key, other_key, other = Casting.actor_id, Casting.movie_id, Movie
+    else:
+        key, other_key, other = Casting.movie_id, Casting.actor_id, Actor
+
+    castings = connection.execute(
+        select(Casting.id, other_key)
+        .where(key.in_(ids))
+        .order_by(Casting.id)
+        .with_for_update()
+    ).all()
+    deleted = [
+        dict(row._mapping)
+        for row in connection.execute(
+            delete(table).where(table.c.id.in_(ids)).returning(*DELETED_COLUMNS[model])
+        )
+    ]
+
+    record_changes(connection, Casting, "delete", [casting.id for casting in castings])
+    record_changes(connection, model, "delete", [row["id"] for row in deleted])
+
+    other_ids = {other_id for casting_id, other_id in castings} - {None}
+    if other_ids:
+        if other is Actor:
+            _refresh(connection, ActorStats, Actor, Casting.actor_id, other_ids)
+        else:
+            _refresh(connection, MovieStats, Movie, Casting.movie_id, other_ids)
+            refresh_movie_rollup(other_ids, connection)
+        touch(connection, other, other_ids)
+    return deleted, len(castings)
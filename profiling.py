@@ -0,0 +1,258 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from flask import abort, current_app, g, jsonify, request
+
+from auth.auth import (
+    AuthError,
+    check_permissions,
+    get_token_auth_header,
+    requires_auth,
+    verify_decode_jwt,
+)
+
+
+"""
+Profiling
+With PROFILING_ENABLED on, a request is profiled when it carries the
+X-Profile header with a token holding the get:profiles permission, or
+picked at random with PROFILE_SAMPLE_RATE. X-Profile: cprofile runs it
+under cProfile, for a pstats report and a .prof file; X-Profile: sample
+records the stack of its thread every PROFILE_INTERVAL seconds instead,
+as collapsed stacks for flame graph tools. Sampling costs far less, so
+randomly picked requests use PROFILE_SAMPLE_MODE, sample by default.
+Each process keeps its last PROFILE_KEEP profiles, served by GET
+/profiles
+"""
+
+MODES = ("cprofile", "sample")
+PERMISSION = "get:profiles"
+
+
+def frame_name(code):
+    path = code.co_filename
+    if path.startswith(os.getcwd() + os.sep):
+        path = os.path.relpath(path)
+    else:
+        path = path.rpartition("site-packages" + os.sep)[2]
+    # ; separates the frames of a collapsed stack
+    return f"{code.co_name} ({path}:{code.co_firstlineno})".replace(";", ":")
+
+
+class StackSampler:
+    """Records the stack of one thread every interval seconds from a
+    background thread, counting how often each stack was seen
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """One "outer;...;inner count" line per stack, as read by
+        flamegraph.pl and speedscope
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class Profile:
+    def __init__(self, mode, data, duration, status):
+        self.id = uuid.uuid4().hex
+        self.time = datetime.now(timezone.utc)
+        self.mode = mode
+        # pstats.Stats for cprofile, collapsed stacks for sample
+        self.data = data
+        self.duration = duration
+        self.status = status
+        self.method = request.method
+        self.path = request.path
+        self.request_id = g.get("request_id")
+
+    def report(self):
+        """A pstats report by cumulative time, or the collapsed stacks"""
+        if self.mode == "sample":
+            return self.data
+        stream = io.StringIO()
+        stats = pstats.Stats(stream=stream).add(self.data)
+        stats.sort_stats("cumulative").print_stats(50)
+        return stream.getvalue()
+
+    def dump(self):
+        """The profile as written by cProfile -o, for snakeviz and pstats"""
+        return marshal.dumps(self.data.stats)
+
+    def format_json(self):
+        return {
+            "id": self.id,
+            "time": self.time.isoformat(timespec="milliseconds"),
+            "mode": self.mode,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 2),
+            "request_id": self.request_id,
+        }
+
+
+class ProfileStore:
+    """The last keep profiles of this process"""
+
+    def __init__(self, keep=20):
+        self._profiles = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((p for p in self._profiles if p.id == profile_id), None)
+
+    def all(self):
+        """Newest first"""
+        with self._lock:
+            return list(reversed(self._profiles))
+
+
+def requested_mode():
+    """The mode of the X-Profile header, if the caller may profile"""
+    mode = request.headers.get("X-Profile")
+    if mode is None:
+        return None
+    try:
+        check_permissions(PERMISSION, verify_decode_jwt(get_token_auth_header()))
+    except AuthError:
+        return None
+    return mode if mode in MODES else "cprofile"
+
+
+def start_profiler(mode):
+    if mode == "sample":
+        profiler = StackSampler(
+            threading.get_ident(), current_app.config["PROFILE_INTERVAL"]
+        )
+        profiler.start()
+        return profiler
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler already runs in this process
+        return None
+    return profiler
+
+
+def stop_profiler(mode, profiler):
+    if mode == "sample":
+        profiler.stop()
+        return profiler.collapsed()
+    profiler.disable()
+    return pstats.Stats(profiler)
+
+
+def setup_profiling(app):
+    """Profile requests on demand when PROFILING_ENABLED is on, and serve
+    the profiles at /profiles
+    """
+    app.config.setdefault("PROFILING_ENABLED", False)
+    app.config.setdefault("PROFILE_SAMPLE_RATE", 0.0)
+    app.config.setdefault("PROFILE_SAMPLE_MODE", "sample")
+    app.config.setdefault("PROFILE_INTERVAL", 0.001)
+    app.config.setdefault("PROFILE_KEEP", 20)
+
+    store = app.extensions["profiles"] = ProfileStore(app.config["PROFILE_KEEP"])
+
+    @app.before_request
+    def start_profiling():
+        config = app.config
+        if not config["PROFILING_ENABLED"]:
+            return
+        mode = requested_mode()
+        g.profile_requested = mode is not None
+        if mode is None and random.random() < config["PROFILE_SAMPLE_RATE"]:
+            mode = config["PROFILE_SAMPLE_MODE"]
+        if mode is not None:
+            profiler = start_profiler(mode)
+            if profiler is not None:
+                g.profiler = (mode, profiler, time.perf_counter())
+
+    @app.after_request
+    def store_profile(response):
+        running = g.pop("profiler", None)
+        if running is None:
+            return response
+        mode, profiler, started = running
+        duration = time.perf_counter() - started
+        profile = Profile(
+            mode, stop_profiler(mode, profiler), duration, response.status_code
+        )
+        store.add(profile)
+        if g.profile_requested:
+            response.headers["X-Profile-Id"] = profile.id
+        return response
+
+    @app.teardown_request
+    def stop_profiling(error):
+        # When the response failed before store_profile
+        running = g.pop("profiler", None)
+        if running is not None:
+            stop_profiler(running[0], running[1])
+
+    @app.route("/profiles", methods=["GET"])
+    @requires_auth(PERMISSION)
+    def retrieve_profiles(payload):
+        return jsonify(
+            {
+                "success": True,
+                "profiles": [profile.format_json() for profile in store.all()],
+            }
+        )
+
+    @app.route("/profiles/<profile_id>", methods=["GET"])
+    @requires_auth(PERMISSION)
+    def retrieve_profile(payload, profile_id):
+        profile = store.get(profile_id)
+        if profile is None:
+            abort(404)
+        if request.args.get("format") == "prof":
+            if profile.mode != "cprofile":
+                abort(404)
+            return app.response_class(
+                profile.dump(),
+                mimetype="application/octet-stream",
+                headers={
+                    "Content-Disposition": f"attachment; filename={profile.id}.prof"
+                },
+            )
+        return app.response_class(profile.report(), mimetype="text/plain")
@@ -0,0 +1,131 @@
+import re
+
+from sqlalchemy import any_, event, lambda_stmt, select
+from sqlalchemy.orm import selectinload
+
+from models import db, Actor, Movie, Casting
+
+
+"""
+Hot queries
+The queries run by every request to the busiest routes, built once.
+SQLAlchemy caches the compiled SQL of any statement, but still builds
+the statement and its cache key on every call. A lambda statement is
+analysed the first time it runs: later calls only pull the new values
+of its bound parameters (actor_id below) out of the closure. Lists of
+ids are bound as one array with = ANY, so the SQL is the same whatever
+their length
+"""
+
+# Execution options of the hot queries, which may run as server-side
+# prepared statements
+HOT = {"prepare": True}
+
+
+def actor_by_id(actor_id):
+    return db.session.execute(
+        lambda_stmt(lambda: select(Actor).where(Actor.id == actor_id)),
+        execution_options=HOT,
+    ).scalar_one_or_none()
+
+
+def movie_by_id(movie_id):
+    return db.session.execute(
+        lambda_stmt(lambda: select(Movie).where(Movie.id == movie_id)),
+        execution_options=HOT,
+    ).scalar_one_or_none()
+
+
+def all_actors():
+    """Every actor by name, with their accepted castings"""
+    return lambda_stmt(
+        lambda: select(Actor)
+        .options(selectinload(Actor.accepted_castings).lazyload(Casting.actor))
+        .order_by(Actor.fullname)
+    )
+
+
+def all_movies():
+    """Every movie by release date, with their accepted castings"""
+    return lambda_stmt(
+        lambda: select(Movie)
+        .options(selectinload(Movie.accepted_castings).lazyload(Casting.movie))
+        .order_by(Movie.release_date, Movie.title)
+    )
+
+
+def actors_by_ids(ids):
+    """The actors with the given ids by id, in one query"""
+    actors = execute_all(
+        lambda_stmt(
+            lambda: select(Actor)
+            .options(selectinload(Actor.accepted_castings).lazyload(Casting.actor))
+            .where(Actor.id == any_(ids))
+        )
+    )
+    return {actor.id: actor for actor in actors}
+
+
+def movies_by_ids(ids):
+    """The movies with the given ids by id, in one query"""
+    movies = execute_all(
+        lambda_stmt(
+            lambda: select(Movie)
+            .options(selectinload(Movie.accepted_castings).lazyload(Casting.movie))
+            .where(Movie.id == any_(ids))
+        )
+    )
+    return {movie.id: movie for movie in movies}
+
+
+def execute_all(statement):
+    return db.session.execute(statement, execution_options=HOT).scalars().all()
+
+
+"""
+Server-side prepared statements
+With PREPARED_STATEMENTS on, the hot queries are prepared once per
+database connection (PREPARE) and then only executed (EXECUTE), which
+skips parsing and planning them in postgres. psycopg2 has no API for
+this, so the SQL is rewritten before it is sent. Prepared statements
+belong to a server connection: leave this off behind a pooler which
+hands out another connection for each transaction, e.g. PgBouncer in
+transaction mode
+"""
+
+PARAMETER = re.compile(r"%\((\w+)\)s")
+
+
+def prepare_statement(conn, cursor, statement, parameters, context, executemany):
+    if executemany or context is None or not context.execution_options.get("prepare"):
+        return statement, parameters
+
+    # Kept with the DBAPI connection, across pool checkouts
+    prepared = conn.connection.info.setdefault("prepared_statements", {})
+    if statement not in prepared:
+        names = list(dict.fromkeys(PARAMETER.findall(statement)))
+        # $1, $2... in the order the parameters first appear
+        sql = PARAMETER.sub(
+            lambda match: f"${names.index(match.group(1)) + 1}", statement
+        )
+        name = f"hot_{len(prepared)}"
+        # Sent without parameters, so percent signs aren't escaped
+        cursor.execute(f"PREPARE {name} AS {sql.replace('%%', '%')}")
+        execute = f"EXECUTE {name}"
+        if names:
+            execute += "(" + ", ".join(f"%({param})s" for param in names) + ")"
+        prepared[statement] = execute
+    return prepared[statement], parameters
+
+
+def setup_prepared_statements(app):
+    """Run the hot queries as prepared statements when PREPARED_STATEMENTS
+    is on
+    """
+    if not app.config.get("PREPARED_STATEMENTS", False):
+        return
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", prepare_statement, retval=True)
@@ -0,0 +1,313 @@
+import math
+import re
+import threading
+import time
+
+from flask import current_app, has_request_context, jsonify, request
+
+
+"""
+RateLimitError Exception
+Raised when a client has used up its budget, or has too many requests
+running at once. Retry-After tells it how many seconds to wait
+"""
+
+
+class RateLimitError(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status_code = 429
+
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+class Limit:
+    """A token bucket budget written as "<count>/<period>", e.g. "60/minute".
+    Up to count requests may come at once, after which tokens come back
+    at count per period
+    """
+
+    def __init__(self, spec):
+        match = re.fullmatch(r"\s*(\d+)\s*/\s*(second|minute|hour|day)\s*", spec)
+        if match is None:
+            raise ValueError(f"Invalid rate limit {spec!r}")
+        self.spec = spec
+        self.burst = int(match.group(1))
+        self.rate = self.burst / PERIODS[match.group(2)]
+
+    def take(self, state, now):
+        """Spend one token. Returns the new (tokens, updated) state and
+        0, or the seconds until a token is back when the bucket is empty
+        """
+        tokens, updated = state if state is not None else (self.burst, now)
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            return (tokens - 1, now), 0
+        return (tokens, now), (1 - tokens) / self.rate
+
+
+"""
+Backends
+MemoryBackend keeps the buckets of this process. SharedBackend keeps them
+in a store shared by all workers, any object with get(key) and
+compare_and_set(key, expected, value, ttl). FakeStore is such a store in
+memory, RedisStore wraps a redis client
+"""
+
+
+class MemoryBackend:
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, limit):
+        now = time.monotonic()
+        with self._lock:
+            state, wait = limit.take(self._buckets.get(key), now)
+            self._buckets[key] = state
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Forget buckets idle for an hour. They are full again unless the
+        # budget is per day, which this only makes more lenient
+        self._buckets = {
+            key: (tokens, updated)
+            for key, (tokens, updated) in self._buckets.items()
+            if now - updated < 3600
+        }
+
+    def acquire(self, key, limit):
+        with self._lock:
+            count = self._in_flight.get(key, 0)
+            if count >= limit:
+                return False
+            self._in_flight[key] = count + 1
+            return True
+
+    def release(self, key):
+        with self._lock:
+            count = self._in_flight.pop(key, 1) - 1
+            if count > 0:
+                self._in_flight[key] = count
+
+
+class SharedBackend:
+    # In-flight counters expire, so a crashed worker can't block a client
+    IN_FLIGHT_TTL = 60
+
+    def __init__(self, store, prefix="ratelimit:"):
+        self.store = store
+        self.prefix = prefix
+
+    def _update(self, key, change, ttl):
+        """Optimistic read-modify-write of one key. change(old) returns
+        the new value and the result to pass on
+        """
+        key = self.prefix + key
+        while True:
+            old = self.store.get(key)
+            new, result = change(old)
+            if new == old or self.store.compare_and_set(key, old, new, ttl):
+                return result
+
+    def take(self, key, limit):
+        # Wall clock time, the same for all workers
+        now = time.time()
+
+        def change(old):
+            state = tuple(map(float, old.split(":"))) if old else None
+            state, wait = limit.take(state, now)
+            return f"{state[0]}:{state[1]}", wait
+
+        ttl = math.ceil(limit.burst / limit.rate)
+        return self._update("bucket:" + key, change, ttl)
+
+    def acquire(self, key, limit):
+        def change(old):
+            count = int(old or 0)
+            if count >= limit:
+                return old, False
+            return str(count + 1), True
+
+        return self._update("in_flight:" + key, change, self.IN_FLIGHT_TTL)
+
+    def release(self, key):
+        def change(old):
+            return str(max(0, int(old or 0) - 1)), None
+
+        self._update("in_flight:" + key, change, self.IN_FLIGHT_TTL)
+
+
+class FakeStore:
+    """Shared store kept in memory, for tests and single process runs"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def compare_and_set(self, key, expected, value, ttl):
+        with self._lock:
+            current, expires = self._data.get(key, (None, None))
+            if expires is not None and expires <= time.time():
+                current = None
+            if current != expected:
+                return False
+            self._data[key] = (value, time.time() + ttl)
+            return True
+
+
+class RedisStore:
+    """Shared store on redis, given a redis.Redis client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        value = self.client.get(key)
+        return value.decode() if value is not None else None
+
+    def compare_and_set(self, key, expected, value, ttl):
+        from redis import WatchError
+
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if (current.decode() if current is not None else None) != expected:
+                    return False
+                pipe.multi()
+                pipe.set(key, value, ex=ttl)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+
+"""
+Rate limiter
+Every client has one budget for all its requests, the largest one granted
+by the permissions in its token, and a budget of its own on each route
+listed in RATELIMIT_ROUTES. It may also only have RATELIMIT_CONCURRENCY
+requests running at once
+"""
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        backend,
+        default="300/minute",
+        anonymous="60/minute",
+        permissions=None,
+        routes=None,
+        concurrency=None,
+    ):
+        self.backend = backend
+        self.default = Limit(default)
+        self.anonymous = Limit(anonymous)
+        self.permissions = {
+            permission: Limit(spec) for permission, spec in (permissions or {}).items()
+        }
+        self.routes = {route: Limit(spec) for route, spec in (routes or {}).items()}
+        self.concurrency = concurrency
+
+    def client_limit(self, payload):
+        limits = [
+            self.permissions[permission]
+            for permission in payload.get("permissions", ())
+            if permission in self.permissions
+        ]
+        return max(limits, key=lambda limit: limit.rate, default=self.default)
+
+    def hit(self, client, limit):
+        """Spend a request of the client's budget, then of its route budget"""
+        wait = self.backend.take(client, limit)
+        route_limit = self.routes.get(request.endpoint)
+        if not wait and route_limit is not None:
+            wait = self.backend.take(f"{client}:{request.endpoint}", route_limit)
+        if wait:
+            raise RateLimitError(wait)
+
+    def check_authenticated(self, payload):
+        self.hit("sub:" + payload.get("sub", ""), self.client_limit(payload))
+
+    def check_anonymous(self):
+        self.hit("ip:" + (request.remote_addr or ""), self.anonymous)
+
+    def acquire(self, payload):
+        """Count a running request of the client. Returns the key to release"""
+        if not self.concurrency:
+            return None
+        key = "sub:" + payload.get("sub", "")
+        if not self.backend.acquire(key, self.concurrency):
+            raise RateLimitError(1)
+        return key
+
+    def release(self, key):
+        if key is not None:
+            self.backend.release(key)
+
+
+def get_limiter():
+    if not has_request_context():
+        return None
+    return current_app.extensions.get("rate_limiter")
+
+
+def setup_rate_limits(app):
+    """Rate limit requests unless RATELIMIT_ENABLED is False"""
+    if app.config.get("RATELIMIT_ENABLED", True):
+        store = app.config.get("RATELIMIT_STORE")
+        app.extensions["rate_limiter"] = RateLimiter(
+            SharedBackend(store) if store is not None else MemoryBackend(),
+            default=app.config.get("RATELIMIT_DEFAULT", "300/minute"),
+            anonymous=app.config.get("RATELIMIT_ANONYMOUS", "60/minute"),
+            permissions=app.config.get("RATELIMIT_PERMISSIONS"),
+            routes=app.config.get(
+                "RATELIMIT_ROUTES",
+                # The list endpoints are the most expensive ones
+                {"retrieve_actors": "60/minute", "retrieve_movies": "60/minute"},
+            ),
+            concurrency=app.config.get("RATELIMIT_CONCURRENCY", 8),
+        )
+    else:
+        app.extensions.pop("rate_limiter", None)
+
+    @app.before_request
+    def limit_anonymous_requests():
+        limiter = get_limiter()
+        if limiter is None:
+            return
+        # Requests with a token are limited by its subject once requires_auth
+        # verifies it. Routes which verify no token are limited by address,
+        # whatever the headers say
+        view = app.view_functions.get(request.endpoint)
+        if "Authorization" not in request.headers or not getattr(
+            view, "verifies_token", False
+        ):
+            limiter.check_anonymous()
+
+    @app.errorhandler(RateLimitError)
+    def handle_rate_limit_error(error):
+        response = jsonify(
+            {
+                "success": False,
+                "error": error.status_code,
+                "message": "Too Many Requests",
+            }
+        )
+        response.headers["Retry-After"] = str(error.retry_after)
+        return response, error.status_code
@@ -0,0 +1,216 @@
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+
+REPLICA_BIND_KEY = "replica"
+
+# Requests with these methods are allowed to read from the replica
+READ_METHODS = frozenset(("GET", "HEAD"))
+
+# Carries the pin of a client to the other workers
+PIN_COOKIE = "replica_pin"
+
+
+"""
+Replica health
+Remembers whether the replica answered recently, so routing a query
+never has to ping the replica itself
+"""
+
+
+class ReplicaHealth:
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._available = True
+        self._checked_until = 0.0
+        self._lock = threading.Lock()
+
+    def is_available(self, engine):
+        if time.monotonic() < self._checked_until:
+            return self._available
+
+        with self._lock:
+            if time.monotonic() < self._checked_until:
+                return self._available
+
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                self._available = True
+            except DBAPIError:
+                self._available = False
+            self._checked_until = time.monotonic() + self.check_interval
+
+        return self._available
+
+    def mark_unavailable(self):
+        with self._lock:
+            self._available = False
+            self._checked_until = time.monotonic() + self.check_interval
+
+
+"""
+Read-your-writes stickiness
+Clients that just wrote are pinned to the primary for a short window,
+so they never read a replica which has not caught up with them yet.
+Each process remembers the clients it pinned, and the response of the
+write sets the PIN_COOKIE cookie to the end of the window, so the next
+request is pinned whichever worker serves it
+"""
+
+
+class StickyClients:
+    def __init__(self, window):
+        self.window = window
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def pin(self, client):
+        now = time.monotonic()
+        with self._lock:
+            self._pinned[client] = now + self.window
+            # Drop expired clients while we hold the lock anyway
+            if len(self._pinned) > 1024:
+                self._pinned = {
+                    key: until for key, until in self._pinned.items() if until > now
+                }
+
+    def is_pinned(self, client):
+        until = self._pinned.get(client)
+        return until is not None and until > time.monotonic()
+
+    def cookie_is_pinned(self, value):
+        """Whether a PIN_COOKIE value, a Unix time, is still in the window"""
+        try:
+            until = float(value)
+        except (TypeError, ValueError):
+            return False
+        now = time.time()
+        # Later ends were not set by a worker
+        return now < until <= now + self.window
+
+
+class ReplicaRouter:
+    def __init__(self, sticky_window=5.0, health_check_interval=5.0):
+        self.health = ReplicaHealth(health_check_interval)
+        self.sticky = StickyClients(sticky_window)
+
+    def read_engine(self, db):
+        """Return the replica engine for the current request,
+        or None when the query has to go to the primary
+        """
+        if request.method not in READ_METHODS:
+            return None
+
+        if self.sticky.is_pinned(client_key()) or self.sticky.cookie_is_pinned(
+            request.cookies.get(PIN_COOKIE)
+        ):
+            return None
+
+        engine = db.engines[REPLICA_BIND_KEY]
+        if not self.health.is_available(engine):
+            return None
+
+        return engine
+
+
+def client_key():
+    """Identify the caller by its bearer token, falling back to its address"""
+    auth = request.headers.get("Authorization")
+    if auth:
+        return hashlib.blake2b(auth.encode(), digest_size=16).hexdigest()
+    return request.remote_addr
+
+
+def get_router():
+    if not has_request_context():
+        return None
+    return current_app.extensions.get("replica_router")
+
+
+class RoutingSession(Session):
+    """Session that sends reads of GET requests to the replica
+    and everything else (flushes, DML, SELECT ... FOR UPDATE) to the primary.
+    Set info["primary"] to keep the reads of a session on the primary
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is not None:
+            # Bound to one connection, e.g. the transaction of a test
+            return self.bind
+
+        if (
+            bind is None
+            and not self._flushing
+            and not self.info.get("wrote")
+            and not self.info.get("primary")
+            and not getattr(clause, "is_dml", False)
+            and getattr(clause, "_for_update_arg", None) is None
+        ):
+            router = get_router()
+            if router is not None:
+                engine = router.read_engine(self._db)
+                if engine is not None:
+                    return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def remember_write(session, flush_context):
+    # Keep the rest of this session on the primary once it has written
+    session.info["wrote"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def pin_writer(session):
+    if not session.info.get("wrote"):
+        return
+
+    router = get_router()
+    if router is not None:
+        router.sticky.pin(client_key())
+        g.replica_pinned_until = time.time() + router.sticky.window
+
+
+def setup_replica(app, db):
+    """Route GET queries to the replica when a "replica" bind is configured"""
+    if REPLICA_BIND_KEY not in app.config.get("SQLALCHEMY_BINDS", {}):
+        app.extensions.pop("replica_router", None)
+        return
+
+    router = ReplicaRouter(
+        sticky_window=app.config.get("REPLICA_STICKY_SECONDS", 5.0),
+        health_check_interval=app.config.get("REPLICA_HEALTH_CHECK_SECONDS", 5.0),
+    )
+    app.extensions["replica_router"] = router
+
+    with app.app_context():
+        engine = db.engines[REPLICA_BIND_KEY]
+
+    @app.after_request
+    def send_pin(response):
+        until = g.get("replica_pinned_until")
+        if until is not None:
+            response.set_cookie(
+                PIN_COOKIE,
+                f"{until:.3f}",
+                max_age=math.ceil(router.sticky.window),
+                secure=request.is_secure,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    @event.listens_for(engine, "handle_error")
+    def replica_error(context):
+        # Stop routing to a replica which drops connections
+        if context.is_disconnect:
+            router.health.mark_unavailable()
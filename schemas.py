@@ -0,0 +1,307 @@
+from datetime import datetime, timezone
+
+from dateutil.parser import parse as parse_date
+
+from models import GenderType, StatusType
+
+
+"""
+ValidationError Exception
+Carries the field-level errors of a rejected payload
+"""
+
+
+class ValidationError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        self.status_code = 422
+
+
+"""
+Fields
+Each field turns a JSON value into the value stored on the model,
+or raises ValueError with the message returned to the client.
+from_text turns a text value, e.g. a CSV cell, into the JSON value
+"""
+
+
+class Field:
+    def __init__(self, required=True):
+        self.required = required
+
+    def convert(self, value):
+        return value
+
+    def from_text(self, text):
+        return text
+
+
+class String(Field):
+    def __init__(self, max_length=None, required=True):
+        super().__init__(required)
+        self.max_length = max_length
+
+    def convert(self, value):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError("Must be a non-empty string.")
+        if self.max_length is not None and len(value) > self.max_length:
+            raise ValueError(f"Must be at most {self.max_length} characters long.")
+        return value
+
+
+class Integer(Field):
+    def __init__(self, minimum=None, required=True, from_string=False, maximum=None):
+        super().__init__(required)
+        self.minimum = minimum
+        self.maximum = maximum
+        # Query string arguments are always strings
+        self.from_string = from_string
+
+    def convert(self, value):
+        if self.from_string and isinstance(value, str) and value.isdigit():
+            value = int(value)
+        # bool is a subclass of int, but true is not an age
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError("Must be an integer.")
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(f"Must be at least {self.minimum}.")
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(f"Must be at most {self.maximum}.")
+        return value
+
+    def from_text(self, text):
+        try:
+            return int(text)
+        except ValueError:
+            return text
+
+
+class Boolean(Field):
+    TEXT = {
+        **dict.fromkeys(("true", "t", "yes", "1"), True),
+        **dict.fromkeys(("false", "f", "no", "0"), False),
+    }
+
+    def convert(self, value):
+        if not isinstance(value, bool):
+            raise ValueError("Must be true or false.")
+        return value
+
+    def from_text(self, text):
+        return self.TEXT.get(text.strip().lower(), text)
+
+
+class Choice(Field):
+    def __init__(self, enum_class, required=True):
+        super().__init__(required)
+        self.members = {member.value: member for member in enum_class}
+        self.members.update({member.name: member for member in enum_class})
+        self.message = (
+            "Must be one of: "
+            + ", ".join(f"'{member.value}'" for member in enum_class)
+            + "."
+        )
+
+    def convert(self, value):
+        try:
+            return self.members[value]
+        except (KeyError, TypeError):
+            raise ValueError(self.message)
+
+
+class DateTime(Field):
+    def convert(self, value):
+        if not isinstance(value, str):
+            raise ValueError("Must be a date string.")
+        try:
+            # ISO dates are common and much cheaper to parse
+            date = datetime.fromisoformat(value)
+        except ValueError:
+            try:
+                date = parse_date(value)
+            except (ValueError, OverflowError):
+                raise ValueError("Must be a valid date.")
+        if date.tzinfo is not None:
+            # The columns are timestamps without time zone, in UTC
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+        return date
+
+
+class StringList(Field):
+    def __init__(self, max_length=None, required=True):
+        super().__init__(required)
+        self.item = String(max_length)
+
+    def convert(self, value):
+        if not isinstance(value, list) or not value:
+            raise ValueError("Must be a non-empty list of strings.")
+        return [self.item.convert(item) for item in value]
+
+    def from_text(self, text):
+        # One cell, e.g. "Drama;Comedy"
+        return [item.strip() for item in text.split(";")]
+
+
+class IdList(Field):
+    """Ids separated by commas, e.g. "1,2,3", or a JSON list of them.
+    Repeated ids are dropped
+    """
+
+    def __init__(self, max_items, required=True):
+        super().__init__(required)
+        self.max_items = max_items
+        self.item = Integer(minimum=1, from_string=True)
+
+    def convert(self, value):
+        if isinstance(value, list) and value:
+            items = value
+        elif isinstance(value, str) and value.strip():
+            items = value.split(",")
+        else:
+            raise ValueError("Must be a list of ids separated by commas.")
+        if len(items) > self.max_items:
+            raise ValueError(f"Must have at most {self.max_items} ids.")
+        return list(
+            dict.fromkeys(
+                self.item.convert(item.strip() if isinstance(item, str) else item)
+                for item in items
+            )
+        )
+
+
+class Cursor(Field):
+    """Position in the change feed, "<xid>-<id>" as GET /changes returns it"""
+
+    def convert(self, value):
+        xid, _, id = str(value).partition("-")
+        if not (xid.isdigit() and id.isdigit()):
+            raise ValueError("Must be a cursor returned by GET /changes.")
+        return int(xid), int(id)
+
+
+"""
+Schema
+Compiled once when the module is imported: the field table and the sets
+of known and required names are built up front, so validating a payload
+is one pass over its keys and never touches the database
+"""
+
+
+class Schema:
+    def __init__(self, ignore=(), **fields):
+        self.fields = fields
+        self.ignore = frozenset(ignore)
+        self.known = frozenset(fields) | self.ignore
+        self.required = tuple(name for name, field in fields.items() if field.required)
+        self.converters = {name: field.convert for name, field in fields.items()}
+
+    def load(self, body, partial=False):
+        """Validate a JSON body and return the converted values.
+        With partial=True any subset of the fields is accepted (PATCH)
+        """
+        if not isinstance(body, dict):
+            raise ValidationError({"body": "Must be a JSON object."})
+
+        errors = {}
+        data = {}
+
+        for name, value in body.items():
+            if name not in self.known:
+                errors[name] = "Unknown field."
+            elif name not in self.ignore:
+                try:
+                    data[name] = self.converters[name](value)
+                except ValueError as e:
+                    errors[name] = str(e)
+
+        if partial:
+            if not body:
+                errors["body"] = "At least one field is required."
+        else:
+            for name in self.required:
+                if name not in body:
+                    errors[name] = "Missing required field."
+
+        if errors:
+            raise ValidationError(errors)
+
+        return data
+
+    def load_text(self, row):
+        """Validate a row of text values, e.g. a CSV record. Empty values
+        are left out, so they count as missing
+        """
+        body = {}
+        for name, text in row.items():
+            if text:
+                field = self.fields.get(name)
+                body[name] = field.from_text(text) if field is not None else text
+        return self.load(body)
+
+
+ACTOR_SCHEMA = Schema(
+    # Derived from first_name and last_name, accepted for older clients
+    ignore=("fullname",),
+    first_name=String(120),
+    last_name=String(120),
+    # Clients, e.g. the Postman collection, send it as a string too
+    age=Integer(minimum=1, from_string=True),
+    gender=Choice(GenderType),
+    email=String(120),
+    phone=String(120),
+    photo_link=String(500),
+    seeking_movie=Boolean(),
+)
+
+MOVIE_SCHEMA = Schema(
+    title=String(),
+    genres=StringList(120),
+    release_date=DateTime(),
+    seeking_actor=Boolean(),
+)
+
+CASTING_SCHEMA = Schema(
+    actor_id=Integer(minimum=1),
+    movie_id=Integer(minimum=1),
+    role=String(120),
+    casting_date=DateTime(),
+    casting_duration=Integer(minimum=1, required=False),
+    casting_address=String(250),
+    status=Choice(StatusType),
+)
+
+# Rows of the bulk import, which update the row with their id if given
+MOVIE_IMPORT_SCHEMA = Schema(
+    id=Integer(minimum=1, required=False), **MOVIE_SCHEMA.fields
+)
+
+CASTING_IMPORT_SCHEMA = Schema(
+    id=Integer(minimum=1, required=False), **CASTING_SCHEMA.fields
+)
+
+# Query string of GET /actors and GET /movies
+LIST_SCHEMA = Schema(
+    updated_since=DateTime(required=False),
+    ids=IdList(max_items=100, required=False),
+)
+
+# Query string of DELETE /actors and DELETE /movies
+ID_LIST_SCHEMA = Schema(ids=IdList(max_items=1000))
+
+# Query string of the GET /stats endpoints
+STATS_SCHEMA = Schema(start=DateTime(required=False), end=DateTime(required=False))
+
+# Query string of GET /changes and GET /changes/stream
+CHANGES_SCHEMA = Schema(
+    since=Cursor(required=False),
+    limit=Integer(minimum=1, maximum=1000, required=False, from_string=True),
+)
+
+# Query string of GET /actors/available
+AVAILABILITY_SCHEMA = Schema(
+    start=DateTime(),
+    end=DateTime(),
+    gender=Choice(GenderType, required=False),
+    min_age=Integer(minimum=1, required=False, from_string=True),
+    max_age=Integer(minimum=1, required=False, from_string=True),
+)
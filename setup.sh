@@ -1,9 +1,12 @@
 #!/bin/bash
 export DATABASE_URL="postgresql://postgres@localhost:5432/casting_agency"
 export DATABASE_TEST_URI="postgresql://postgres:5432/casting_agency_test"
+# export DATABASE_URL_REPLICA="postgresql://postgres@localhost:5433/casting_agency"
 
 export FLASK_APP=app.py
 export FLASK_DEBUG=True
+# default, development, test or production, see config.py
+export APP_ENV=development
 
 export AUTH0_DOMAIN="fs2022nd.us.auth0.com"
 export API_AUDIENCE="Casting_Agency_FSND"
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from sqlalchemy import select, text
+
+from models import db, CHANGE_ENTITIES, Tombstone
+from queries import execute_all
+
+
+"""
+Delta sync
+A sync returns the rows updated since the client's last sync, the ids
+deleted since then and a watermark, which the client passes as
+updated_since next time. A row stamped before the watermark may only
+commit after it was handed out while its transaction is still running,
+so the watermark is never later than the start of the oldest writer
+"""
+
+# Writes read the clock a moment before postgres gives their transaction
+# an id, which is how running writers are found
+WATERMARK_MARGIN = timedelta(seconds=1)
+
+# Sessions of other roles only show in pg_stat_activity to roles granted
+# pg_read_all_stats
+OLDEST_WRITER = text(
+    "SELECT least(clock_timestamp(), "
+    "(SELECT min(xact_start) FROM pg_stat_activity "
+    "WHERE backend_xid IS NOT NULL AND datname = current_database()))::timestamp"
+)
+
+
+def sync_watermark():
+    return db.session.execute(OLDEST_WRITER).scalar() - WATERMARK_MARGIN
+
+
+def read_delta(query, model, since):
+    """The rows of query, a lambda statement, updated since, the ids of the model deleted since,
+    and the watermark of the next sync
+    """
+    # A replica doesn't see the transactions running on the primary
+    db.session.info["primary"] = True
+    # Taken first: what commits while the rows are read is sent next time
+    watermark = sync_watermark()
+    updated_at = model.updated_at
+    rows = execute_all(query + (lambda statement: statement.where(updated_at >= since)))
+    deleted = (
+        db.session.execute(
+            select(Tombstone.entity_id)
+            .where(
+                Tombstone.entity == CHANGE_ENTITIES[model],
+                Tombstone.deleted_at >= since,
+            )
+            .order_by(Tombstone.entity_id)
+        )
+        .scalars()
+        .all()
+    )
+    return rows, deleted, watermark
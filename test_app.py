@@ -1,12 +1,46 @@
+import gzip
 import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
 from dotenv import load_dotenv
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
-from app import create_app
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import Flask
+from werkzeug.http import parse_cookie
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from fixtures import TransactionalTestCase, get_test_app
+from schemas import ValidationError, ACTOR_SCHEMA, CASTING_SCHEMA, MOVIE_SCHEMA
+import compression
+from compression import CompressedCache
+from cors import setup_cors
+from config import Config, ConfigError, ProductionConfig, load_config, validate_config
+from entity_cache import EntityCache
+from metrics import REGISTRY
+from profiling import ProfileStore, StackSampler
+from queries import prepare_statement
+from replicas import PIN_COOKIE
+from sync import WATERMARK_MARGIN
+from ratelimit import FakeStore, Limit, MemoryBackend, RateLimiter, SharedBackend
+from auth.auth import AuthError, key_store, verify_decode_jwt
+from auth.testing import LocalAuthProvider
 from models import (
+    db,
     setup_db,
-    db_drop_and_create_all,
+    refresh_due_stats,
+    refresh_rollup,
+    UnitOfWork,
+    GenderType,
+    StatusType,
+    ActorStats,
+    CastingRollup,
     Movie,
     Actor,
     Casting,
@@ -16,34 +50,32 @@ from models import (
 load_dotenv()
 
 DB_PATH_TEST = os.getenv("DATABASE_URL_TEST")
-
-
-CASTING_ASSISTANT_TOKEN = os.getenv("CASTING_ASSISTANT_TOKEN")
-CASTING_DIRECTOR_TOKEN = os.getenv("CASTING_DIRECTOR_TOKEN")
-EXECUTIVE_PRODUCER_TOKEN = os.getenv("EXECUTIVE_PRODUCER_TOKEN")
-INVALID_TOKEN = os.getenv("INVALID_TOKEN")
-EXPIRED_TOKEN = os.getenv("EXPIRED_TOKEN")
-
-
-class CastingAgencyTestCase(unittest.TestCase):
+DB_PATH_REPLICA_TEST = os.getenv("DATABASE_URL_REPLICA_TEST")
+
+
+# Tokens are signed locally unless TEST_AUTH=auth0, which uses real
+# Auth0 tokens from the environment instead
+if os.getenv("TEST_AUTH", "local") == "auth0":
+    CASTING_ASSISTANT_TOKEN = os.getenv("CASTING_ASSISTANT_TOKEN")
+    CASTING_DIRECTOR_TOKEN = os.getenv("CASTING_DIRECTOR_TOKEN")
+    EXECUTIVE_PRODUCER_TOKEN = os.getenv("EXECUTIVE_PRODUCER_TOKEN")
+    INVALID_TOKEN = os.getenv("INVALID_TOKEN")
+    EXPIRED_TOKEN = os.getenv("EXPIRED_TOKEN")
+else:
+    auth_provider = LocalAuthProvider()
+    auth_provider.install()
+    CASTING_ASSISTANT_TOKEN = auth_provider.role_token("casting_assistant")
+    CASTING_DIRECTOR_TOKEN = auth_provider.role_token("casting_director")
+    EXECUTIVE_PRODUCER_TOKEN = auth_provider.role_token("executive_producer")
+    INVALID_TOKEN = auth_provider.forged_token()
+    EXPIRED_TOKEN = auth_provider.expired_token()
+
+
+class CastingAgencyTestCase(TransactionalTestCase):
     """
     This class represents the casting agency test case
     """
 
-    def setUp(self):
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.DB_PATH = DB_PATH_TEST
-        setup_db(self.app, self.DB_PATH)
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            db_drop_and_create_all()
-
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
-
     # ---------------------------------------#
     # Test actors endpoints
     # ---------------------------------------#
@@ -122,6 +154,74 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Resource Not Found")
 
+    def available_actors(self, query):
+        res = self.client().get(
+            "/actors/available?" + query,
+            headers={"Authorization": f"Bearer {CASTING_ASSISTANT_TOKEN}"},
+        )
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        return [actor["full_name"] for actor in data["actors"]]
+
+    def test_retrieve_available_actors(self):
+        # Sandy Proom has a casting from 10:00 to 11:00,
+        # Luna Grey isn't seeking a movie
+        self.assertEqual(
+            self.available_actors("start=2023-01-10T10:30&end=2023-01-10T11:30"),
+            ["John Holms"],
+        )
+        self.assertEqual(
+            self.available_actors("start=2023-01-10T11:00&end=2023-01-10T12:00"),
+            ["John Holms", "Sandy Proom"],
+        )
+        self.assertEqual(
+            self.available_actors(
+                "start=2023-01-10T11:00&end=2023-01-10T12:00&gender=male&min_age=30"
+            ),
+            ["John Holms"],
+        )
+
+    def test_rejected_castings_do_not_keep_actors_busy(self):
+        with self.app.app_context():
+            Casting.query.filter(Casting.actor_id == 1).update(
+                {"status": StatusType.reject}
+            )
+            db.session.commit()
+        self.assertEqual(
+            self.available_actors("start=2023-01-10T10:30&end=2023-01-10T11:30"),
+            ["John Holms", "Sandy Proom"],
+        )
+
+    def test_retrieve_available_actors_with_time_zones(self):
+        # 10:30 to 11:30 UTC, given with offsets or with only one of them
+        for query in (
+            "start=2023-01-10T12:30%2B02:00&end=2023-01-10T06:30-05:00",
+            "start=2023-01-10T12:30%2B02:00&end=2023-01-10T11:30",
+            "start=2023-01-10T10:30&end=2023-01-10T11:30Z",
+        ):
+            self.assertEqual(self.available_actors(query), ["John Holms"])
+
+    def test_422_retrieve_available_actors_with_invalid_window(self):
+        res = self.client().get(
+            "/actors/available?start=2023-01-10T12:00&end=2023-01-10T11:00&min_age=x",
+            headers={"Authorization": f"Bearer {CASTING_ASSISTANT_TOKEN}"},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertIn("min_age", data["errors"])
+
+        res = self.client().get(
+            "/actors/available?start=2023-01-10T12:00&end=2023-01-10T11:00",
+            headers={"Authorization": f"Bearer {CASTING_ASSISTANT_TOKEN}"},
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["errors"], {"end": "Must be after start."})
+
     def test_add_actor(self):
         actor = {
             "first_name": "test_actor",
@@ -196,6 +296,31 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["message"], "Unprocessable resource")
 
+    def test_422_add_actor_reports_invalid_fields(self):
+        actor = {
+            "first_name": "test_actor",
+            "last_name": "test_actor",
+            "age": -5,
+            "gender": "unknown",
+            "email": "testuser@gmail.com",
+            "phone": "0000000000",
+            "photo_link": "https://images.unsplash.com/photo-1631084655463-e671365ec05f?ixlib=rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=774&q=80",
+            "seeking_movie": True,
+        }
+        res = self.client().post(
+            "/actors/create",
+            data=json.dumps(actor),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(set(data["errors"]), {"age", "gender"})
+
     def test_401_add_actor_unauthorized(self):
         actor = {
             "first_name": "test_actor",
@@ -305,6 +430,61 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertEqual(data["message"], "Permission not found.")
 
+    def test_modify_actor_partially(self):
+        res = self.client().patch(
+            "/actors/1?changes_only=true",
+            data=json.dumps({"age": 21, "seeking_movie": True}),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["modified_actor"], {"id": 1, "version": 2, "age": 21})
+
+    def test_422_modify_actor_with_unknown_field(self):
+        res = self.client().patch(
+            "/actors/1",
+            data=json.dumps({"nickname": "Sandy"}),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+    def test_412_modify_actor_with_stale_version(self):
+        modified_actor = {
+            "first_name": "Sandy",
+            "last_name": "Proom",
+            "fullname": "Sandy Proom",
+            "age": 21,
+            "gender": "female",
+            "email": "sandyproom@gmail.com",
+            "phone": "1234567890",
+            "photo_link": "https://images.unsplash.com/photo-1631084655463-e671365ec05f?ixlib=rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=774&q=80",
+            "seeking_movie": True,
+        }
+        res = self.client().patch(
+            "/actors/1",
+            data=json.dumps(modified_actor),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                "If-Match": '"2"',
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 412)
+        self.assertEqual(data["success"], False)
+
     def test_delete_actor(self):
         res = self.client().delete(
             "/actors/1", headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"}
@@ -503,6 +683,21 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertTrue(data["modified_movie"])
         self.assertEqual(data["modified_movie"]["id"], movie.id)
 
+    def test_modify_movie_partially(self):
+        res = self.client().patch(
+            "/movies/1",
+            data=json.dumps({"title": "Bigger house"}),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["modified_movie"]["title"], "Bigger house")
+        self.assertEqual(data["modified_movie"]["genres"], ["TV show"])
+
     def test_404_modify_movie_which_does_not_exist(self):
         modified_movie = {
             "title": "Smiles",
@@ -580,5 +775,1961 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["message"], "Permission not found.")
 
 
+@unittest.skipIf(os.getenv("TEST_AUTH") == "auth0", "uses the local auth provider")
+class ConcurrentWritesTestCase(TransactionalTestCase):
+    """
+    This class represents the concurrent writes test case.
+    Requests run in several threads with their own connections,
+    so they commit for real instead of inside the test transaction
+    """
+
+    transactional = False
+
+    def test_parallel_actor_writers_do_not_lose_updates(self):
+        def modify(age):
+            modified_actor = {
+                "first_name": "Sandy",
+                "last_name": "Proom",
+                "fullname": "Sandy Proom",
+                "age": age,
+                "gender": "female",
+                "email": "sandyproom@gmail.com",
+                "phone": "1234567890",
+                "photo_link": "https://images.unsplash.com/photo-1631084655463-e671365ec05f?ixlib=rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=format&fit=crop&w=774&q=80",
+                "seeking_movie": True,
+            }
+            res = self.client().patch(
+                "/actors/1",
+                data=json.dumps(modified_actor),
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                    "If-Match": '"1"',
+                },
+            )
+            return age, res.status_code
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(modify, range(30, 38)))
+
+        winners = [age for age, status in results if status == 200]
+        self.assertEqual(len(winners), 1)
+        self.assertTrue(all(status in (200, 412) for age, status in results))
+
+        res = self.client().get(
+            "/actors/1", headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"}
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(data["actor"]["age"], winners[0])
+        self.assertEqual(data["actor"]["version"], 2)
+        self.assertEqual(res.headers["ETag"], '"2"')
+
+
+class TransactionalTestCaseTestCase(TransactionalTestCase):
+    """
+    This class represents the test fixtures test case
+    """
+
+    def test_commits_are_rolled_back_after_each_test(self):
+        with self.app.app_context():
+            Movie(
+                title="Rolled back",
+                genres=["Drama"],
+                release_date="2030.01.01",
+                seeking_actor=True,
+            ).insert()
+            self.assertEqual(Movie.query.count(), 4)
+
+        self.tearDown()
+        self.setUp()
+
+        with self.app.app_context():
+            self.assertEqual(Movie.query.count(), 3)
+
+
+class CastingStatsTestCase(TransactionalTestCase):
+    """
+    This class represents the casting stats test case
+    """
+
+    def add_casting(self, actor_id, movie_id, casting_date, status):
+        Casting(
+            actor_id=actor_id,
+            movie_id=movie_id,
+            role="extra",
+            casting_date=casting_date,
+            casting_address="123 DHfghjkd street, New York, NY, 12345",
+            status=status,
+        ).insert()
+
+    def test_stats_follow_casting_writes(self):
+        next_week = datetime.now() + timedelta(days=7)
+        with self.app.app_context():
+            self.add_casting(2, 1, next_week, StatusType.reject)
+            actor = Actor.query.get(2).format_json()
+            movie = Movie.query.get(1).format_json()
+
+            self.assertEqual(actor["casting_total"], 1)
+            self.assertEqual(actor["castings_upcoming"], 1)
+            self.assertEqual(actor["castings_past"], 0)
+            self.assertEqual(actor["casting_reject"], 1)
+            self.assertEqual(movie["casting_total"], 3)
+            self.assertEqual(movie["castings_upcoming"], 1)
+            self.assertEqual(movie["casting_reject"], 1)
+            self.assertEqual(ActorStats.query.get(2).next_casting_date, next_week)
+
+            casting = Casting.query.filter(Casting.actor_id == 2).one()
+            casting.movie_id = 2
+            casting.update()
+            self.assertEqual(Movie.query.get(1).format_json()["casting_total"], 2)
+            self.assertEqual(Movie.query.get(2).format_json()["casting_total"], 2)
+
+            casting.delete()
+            actor = Actor.query.get(2).format_json()
+            self.assertEqual(actor["casting_total"], 0)
+            self.assertIsNone(ActorStats.query.get(2).next_casting_date)
+
+    def test_due_stats_count_upcoming_castings_live(self):
+        with self.app.app_context():
+            self.add_casting(
+                2, 1, datetime.now() + timedelta(days=7), StatusType.reject
+            )
+            # As if the casting date had passed since the row was computed
+            yesterday = datetime.now() - timedelta(days=1)
+            Casting.query.filter(Casting.actor_id == 2).update(
+                {"casting_date": yesterday}
+            )
+            ActorStats.query.filter(ActorStats.actor_id == 2).update(
+                {"next_casting_date": yesterday}
+            )
+
+            actor = Actor.query.get(2).format_json()
+            self.assertEqual(actor["castings_upcoming"], 0)
+            self.assertEqual(actor["castings_past"], 1)
+
+            refresh_due_stats()
+            stats = ActorStats.query.get(2)
+            db.session.refresh(stats)
+            self.assertEqual(stats.castings_upcoming, 0)
+            self.assertIsNone(stats.next_casting_date)
+
+    def test_list_queries_do_not_grow_with_rows(self):
+        queries = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", count)
+        try:
+            self.client().get(
+                "/actors",
+                headers={"Authorization": f"Bearer {CASTING_ASSISTANT_TOKEN}"},
+            )
+            before = len(queries)
+            with self.app.app_context():
+                for i in range(5):
+                    Actor(
+                        first_name="Extra",
+                        last_name=str(i),
+                        fullname=f"Extra {i}",
+                        age=30,
+                        gender=GenderType.male,
+                        email=f"extra{i}@gnmail.com",
+                        phone=f"555000{i}",
+                        photo_link="https://example.com/photo.jpg",
+                        seeking_movie=True,
+                    ).insert()
+                    self.add_casting(4 + i, 1, datetime.now(), StatusType.accept)
+            del queries[:]
+            res = self.client().get(
+                "/actors",
+                headers={"Authorization": f"Bearer {CASTING_ASSISTANT_TOKEN}"},
+            )
+        finally:
+            event.remove(self.connection, "before_cursor_execute", count)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data)["actors"]), 8)
+        self.assertEqual(len(queries), before)
+
+
+class AnalyticsTestCase(TransactionalTestCase):
+    """
+    This class represents the analytics test case
+    """
+
+    def get_stats(self, path, token=EXECUTIVE_PRODUCER_TOKEN):
+        res = self.client().get(path, headers={"Authorization": f"Bearer {token}"})
+        return res.status_code, json.loads(res.data)
+
+    def test_retrieve_stats(self):
+        status, data = self.get_stats("/stats/movies")
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            data["movies"][0],
+            {
+                "movie_id": 1,
+                "title": "Big house",
+                "casting_total": 2,
+                "accepted": 1,
+                "rejected": 0,
+                "in_process": 1,
+                "acceptance_rate": 0.5,
+            },
+        )
+        self.assertIsNone(data["movies"][2]["acceptance_rate"])
+
+        status, data = self.get_stats("/stats/genres")
+        self.assertEqual(
+            [(genre["genre"], genre["casting_total"]) for genre in data["genres"]],
+            [("Comedy", 1), ("TV show", 2)],
+        )
+
+        status, data = self.get_stats("/stats/months?start=2023-01-01&end=2023-12-01")
+        self.assertEqual(
+            [month["month"] for month in data["months"]], ["2023-01", "2023-10"]
+        )
+
+        status, data = self.get_stats("/stats/actors")
+        self.assertEqual(data["by_gender"], [{"gender": "male", "actors": 1}])
+        self.assertEqual(data["by_age_group"], [{"age_group": "30-39", "actors": 1}])
+
+    def test_401_retrieve_stats_without_permission(self):
+        status, data = self.get_stats("/stats/movies", CASTING_ASSISTANT_TOKEN)
+
+        self.assertEqual(status, 401)
+        self.assertEqual(data["message"], "Permission not found.")
+
+    def test_rollup_matches_live_counts_and_follows_writes(self):
+        status, live = self.get_stats("/stats/months")
+
+        with self.app.app_context():
+            refresh_rollup(until=datetime(2023, 6, 1))
+            db.session.commit()
+            self.assertEqual(CastingRollup.query.count(), 2)
+
+        status, data = self.get_stats("/stats/months")
+        self.assertEqual(data, live)
+
+        with self.app.app_context():
+            # A rolled up casting from December 2022
+            casting = Casting.query.filter(Casting.actor_id == 3).first()
+            casting.status = StatusType.reject
+            casting.update()
+
+        status, data = self.get_stats("/stats/months")
+        self.assertEqual(data["months"][0]["month"], "2022-12")
+        self.assertEqual(data["months"][0]["rejected"], 1)
+        self.assertEqual(data["months"][0]["accepted"], 0)
+
+
+class RateLimitTestCase(TransactionalTestCase):
+    """
+    This class represents the rate limiting test case
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.app.extensions["rate_limiter"] = RateLimiter(
+            MemoryBackend(),
+            default="3/minute",
+            anonymous="2/minute",
+            permissions={"delete:movies": "5/minute"},
+            routes={"retrieve_movies": "1/minute"},
+        )
+
+    def tearDown(self):
+        del self.app.extensions["rate_limiter"]
+        super().tearDown()
+
+    def get(self, path, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return self.client().get(path, headers=headers)
+
+    def test_429_when_client_budget_is_used_up(self):
+        for i in range(3):
+            self.assertEqual(
+                self.get("/actors", CASTING_ASSISTANT_TOKEN).status_code, 200
+            )
+
+        res = self.get("/actors", CASTING_ASSISTANT_TOKEN)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Too Many Requests")
+        # 3 per minute, so the next request is allowed in 20 seconds
+        self.assertEqual(res.headers["Retry-After"], "20")
+
+        # Other clients have budgets of their own
+        self.assertEqual(self.get("/actors", CASTING_DIRECTOR_TOKEN).status_code, 200)
+
+    def test_route_and_permission_budgets(self):
+        self.assertEqual(self.get("/movies", CASTING_ASSISTANT_TOKEN).status_code, 200)
+        self.assertEqual(self.get("/movies", CASTING_ASSISTANT_TOKEN).status_code, 429)
+        self.assertEqual(self.get("/actors", CASTING_ASSISTANT_TOKEN).status_code, 200)
+
+        statuses = [
+            self.get("/actors", EXECUTIVE_PRODUCER_TOKEN).status_code for i in range(6)
+        ]
+        self.assertEqual(statuses, [200] * 5 + [429])
+
+    def test_requests_without_valid_token_are_limited_by_address(self):
+        self.assertEqual(self.get("/").status_code, 200)
+        self.assertEqual(self.get("/actors", INVALID_TOKEN).status_code, 400)
+        self.assertEqual(self.get("/").status_code, 429)
+
+    def test_any_header_is_limited_by_address_on_public_routes(self):
+        statuses = [self.get("/", "garbage").status_code for i in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_token_bucket_refills_over_time(self):
+        limit = Limit("2/minute")
+        state, wait = limit.take(None, 0)
+        state, wait = limit.take(state, 0)
+        self.assertEqual(wait, 0)
+        state, wait = limit.take(state, 0)
+        self.assertEqual(wait, 30)
+        state, wait = limit.take(state, 30)
+        self.assertEqual(wait, 0)
+
+    def test_shared_backend_is_shared_between_workers(self):
+        store = FakeStore()
+        workers = [SharedBackend(store), SharedBackend(store)]
+        limit = Limit("3/minute")
+
+        waits = [workers[i % 2].take("sub:someone", limit) for i in range(4)]
+        self.assertEqual(waits[:3], [0, 0, 0])
+        self.assertGreater(waits[3], 0)
+
+    def test_concurrency_caps(self):
+        for backend in (MemoryBackend(), SharedBackend(FakeStore())):
+            self.assertTrue(backend.acquire("sub:someone", 2))
+            self.assertTrue(backend.acquire("sub:someone", 2))
+            self.assertFalse(backend.acquire("sub:someone", 2))
+            backend.release("sub:someone")
+            self.assertTrue(backend.acquire("sub:someone", 2))
+
+    def test_streams_hold_their_slot_until_closed(self):
+        self.app.extensions["rate_limiter"].concurrency = 1
+        stream = self.client().get(
+            "/changes/stream",
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+            buffered=False,
+        )
+
+        self.assertEqual(stream.status_code, 200)
+        self.assertEqual(self.get("/actors", EXECUTIVE_PRODUCER_TOKEN).status_code, 429)
+        stream.close()
+        self.assertEqual(self.get("/actors", EXECUTIVE_PRODUCER_TOKEN).status_code, 200)
+
+
+class CompressionTestCase(TransactionalTestCase):
+    """
+    This class represents the response compression test case
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.cache = CompressedCache()
+        self.app.extensions["compressed_cache"] = self.cache
+
+    def get(self, path, accept_encoding=None):
+        headers = {"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"}
+        if accept_encoding is not None:
+            headers["Accept-Encoding"] = accept_encoding
+        return self.client().get(path, headers=headers)
+
+    def test_gzip_when_accepted(self):
+        plain = self.get("/actors")
+        res = self.get("/actors", "gzip, deflate")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", res.headers["Vary"])
+        self.assertEqual(int(res.headers["Content-Length"]), len(res.data))
+        self.assertLess(len(res.data), len(plain.data))
+        self.assertEqual(gzip.decompress(res.data), plain.data)
+
+    def test_no_compression_unless_accepted(self):
+        for accept_encoding in (None, "identity", "gzip;q=0"):
+            res = self.get("/actors", accept_encoding)
+
+            self.assertNotIn("Content-Encoding", res.headers)
+            self.assertIn("Accept-Encoding", res.headers["Vary"])
+            self.assertTrue(json.loads(res.data)["success"])
+
+    def test_no_compression_below_min_size(self):
+        res = self.get("/", "gzip")
+
+        self.assertLess(len(res.data), self.app.config["COMPRESS_MIN_SIZE"])
+        self.assertNotIn("Content-Encoding", res.headers)
+
+    def test_repeated_body_is_compressed_once(self):
+        first = self.get("/actors", "gzip")
+        second = self.get("/actors", "gzip")
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual((self.cache.misses, self.cache.hits), (1, 1))
+
+    def test_cache_evicts_least_recently_used(self):
+        cache = CompressedCache(max_bytes=100)
+        bodies = [os.urandom(40) for i in range(3)]
+        for body in bodies:
+            cache.compress("gzip", 6, body)
+
+        self.assertLessEqual(cache.size, 100)
+        cache.compress("gzip", 6, bodies[-1])
+        self.assertEqual(cache.hits, 1)
+        cache.compress("gzip", 6, bodies[0])
+        self.assertEqual(cache.hits, 1)
+
+    @unittest.skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli_preferred_when_accepted(self):
+        plain = self.get("/actors")
+        res = self.get("/actors", "gzip, br")
+
+        self.assertEqual(res.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(res.data), plain.data)
+
+
+class CorsTestCase(TransactionalTestCase):
+    """
+    This class represents the CORS test case
+    """
+
+    def preflight(self, path, method="PATCH"):
+        return self.client().options(
+            path,
+            headers={
+                "Origin": "https://frontend.example.com",
+                "Access-Control-Request-Method": method,
+                "Access-Control-Request-Headers": "Authorization, If-Match",
+            },
+        )
+
+    def test_preflight_is_answered_without_auth_or_queries(self):
+        queries = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", count)
+        try:
+            res = self.preflight("/actors/1")
+        finally:
+            event.remove(self.connection, "before_cursor_execute", count)
+
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.headers["Access-Control-Allow-Origin"], "*")
+        self.assertIn("PATCH", res.headers["Access-Control-Allow-Methods"])
+        self.assertIn("If-Match", res.headers["Access-Control-Allow-Headers"])
+        self.assertEqual(res.headers["Access-Control-Max-Age"], "86400")
+        self.assertEqual(queries, [])
+
+    def test_preflight_is_not_rate_limited(self):
+        self.app.extensions["rate_limiter"] = RateLimiter(
+            MemoryBackend(), anonymous="1/minute"
+        )
+        try:
+            for i in range(3):
+                self.assertEqual(self.preflight("/movies").status_code, 204)
+        finally:
+            del self.app.extensions["rate_limiter"]
+
+    def test_cors_headers_on_responses(self):
+        res = self.client().get(
+            "/actors/1",
+            headers={
+                "Origin": "https://frontend.example.com",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Access-Control-Allow-Origin"], "*")
+        self.assertIn("ETag", res.headers["Access-Control-Expose-Headers"])
+        self.assertNotIn("Access-Control-Max-Age", res.headers)
+
+        # Errors too, so browsers can read them
+        res = self.client().get(
+            "/actors", headers={"Origin": "https://frontend.example.com"}
+        )
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res.headers["Access-Control-Allow-Origin"], "*")
+
+    def test_only_listed_origins_are_allowed(self):
+        app = Flask(__name__)
+        app.config["CORS_ORIGINS"] = ["https://frontend.example.com"]
+        setup_cors(app)
+        app.add_url_rule("/", "index", lambda: "")
+        client = app.test_client()
+
+        res = client.get("/", headers={"Origin": "https://frontend.example.com"})
+        self.assertEqual(
+            res.headers["Access-Control-Allow-Origin"], "https://frontend.example.com"
+        )
+        self.assertIn("Origin", res.headers["Vary"])
+
+        res = client.options(
+            "/",
+            headers={
+                "Origin": "https://evil.example.com",
+                "Access-Control-Request-Method": "GET",
+            },
+        )
+        self.assertEqual(res.status_code, 204)
+        self.assertNotIn("Access-Control-Allow-Origin", res.headers)
+
+
+class ImportTestCase(TransactionalTestCase):
+    """
+    This class represents the bulk import test case
+    """
+
+    ACTORS_CSV = (
+        "first_name,last_name,age,gender,email,phone,photo_link,seeking_movie\n"
+        "Ann,Lee,30,female,ann@example.com,5550001,https://example.com/a,true\n"
+        "Bob,Ray,-1,male,bob@example.com,5550002,https://example.com/b,yes\n"
+        "Cy,Doe,40,male,cy@example.com,5550003,https://example.com/c,no\n"
+    )
+
+    def post(self, kind, data, content_type="text/csv", token=None):
+        return self.client().post(
+            f"/{kind}/import",
+            data=data,
+            headers={
+                "Authorization": f"Bearer {token or EXECUTIVE_PRODUCER_TOKEN}",
+                "Content-Type": content_type,
+            },
+        )
+
+    def test_import_actors_from_csv(self):
+        res = self.post("actors", self.ACTORS_CSV)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["rows"], 3)
+        self.assertEqual((data["inserted"], data["updated"], data["failed"]), (2, 0, 1))
+        self.assertEqual(
+            data["errors"], [{"line": 3, "errors": {"age": "Must be at least 1."}}]
+        )
+        self.assertIn("rows_per_second", data)
+
+        with self.app.app_context():
+            actor = Actor.query.filter_by(email="cy@example.com").one()
+            self.assertEqual(actor.fullname, "Cy Doe")
+            self.assertIs(actor.seeking_movie, False)
+            # Stats rows are created as for actors added one by one
+            self.assertEqual(actor.stats.casting_total, 0)
+
+    def test_import_actors_upserts_on_email_or_phone(self):
+        self.post("actors", self.ACTORS_CSV)
+        res = self.post(
+            "actors",
+            "first_name,last_name,age,gender,email,phone,photo_link,seeking_movie\n"
+            # Same email, new phone
+            "Ann,Lee,31,female,ann@example.com,5559999,https://example.com/a,true\n"
+            # Same phone, new email
+            "Cy,Doe,41,male,cyrus@example.com,5550003,https://example.com/c,no\n"
+            # Email of Ann, phone of Cy
+            "Al,Bo,50,male,ann@example.com,5550003,https://example.com/x,no\n",
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual((data["inserted"], data["updated"], data["failed"]), (0, 2, 1))
+        self.assertEqual(data["errors"][0]["line"], 4)
+
+        with self.app.app_context():
+            ann = Actor.query.filter_by(email="ann@example.com").one()
+            self.assertEqual((ann.age, ann.phone, ann.version), (31, "5559999", 2))
+            cy = Actor.query.filter_by(phone="5550003").one()
+            self.assertEqual((cy.age, cy.email), (41, "cyrus@example.com"))
+
+    def test_later_duplicate_row_wins(self):
+        res = self.post(
+            "actors",
+            self.ACTORS_CSV
+            + "Ann,Lee,32,female,ann@example.com,5550001,https://example.com/a,true\n",
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual((data["inserted"], data["failed"]), (2, 2))
+        self.assertEqual([error["line"] for error in data["errors"]], [2, 3])
+        with self.app.app_context():
+            self.assertEqual(
+                Actor.query.filter_by(email="ann@example.com").one().age, 32
+            )
+
+    def test_import_movies_from_ndjson(self):
+        rows = [
+            {
+                "title": "New movie",
+                "genres": ["Drama", 'With "quotes"'],
+                "release_date": "2024-01-01",
+                "seeking_actor": True,
+            },
+            {
+                "id": 1,
+                "title": "Renamed",
+                "genres": ["Comedy"],
+                "release_date": "2024-02-01",
+                "seeking_actor": False,
+            },
+            {"id": 9999, "title": "Missing"},
+        ]
+        body = "\n".join(json.dumps(row) for row in rows) + "\nnot json\n"
+        res = self.post("movies", body, "application/x-ndjson")
+        data = json.loads(res.data)
+
+        self.assertEqual((data["inserted"], data["updated"], data["failed"]), (1, 1, 2))
+        self.assertEqual([error["line"] for error in data["errors"]], [3, 4])
+        self.assertEqual(data["errors"][1]["errors"], {"row": "Invalid JSON."})
+
+        with self.app.app_context():
+            movie = Movie.query.get(1)
+            self.assertEqual((movie.title, movie.version), ("Renamed", 2))
+            new = Movie.query.filter_by(title="New movie").one()
+            self.assertEqual(new.genres, ["Drama", 'With "quotes"'])
+
+    def test_import_castings_refreshes_stats(self):
+        with self.app.app_context():
+            total = Actor.query.get(1).stats.casting_total
+
+        res = self.post(
+            "castings",
+            "actor_id,movie_id,role,casting_date,casting_address,status\n"
+            "1,1,Lead,2030-01-01 10:00,Studio 1,in process\n"
+            "1,9999,Lead,2030-01-02 10:00,Studio 1,accept\n",
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual((data["inserted"], data["failed"]), (1, 1))
+        self.assertEqual(
+            data["errors"][0]["errors"], {"movie_id": "No movie with this id."}
+        )
+        with self.app.app_context():
+            actor = Actor.query.get(1)
+            self.assertEqual(actor.stats.casting_total, total + 1)
+            casting = Casting.query.filter_by(casting_address="Studio 1").one()
+            self.assertEqual(casting.casting_duration, 60)
+
+    def test_import_in_chunks(self):
+        self.app.config["IMPORT_CHUNK_SIZE"] = 1
+        try:
+            res = self.post("actors", self.ACTORS_CSV)
+        finally:
+            del self.app.config["IMPORT_CHUNK_SIZE"]
+        data = json.loads(res.data)
+
+        self.assertEqual((data["inserted"], data["failed"]), (2, 1))
+
+    def test_415_import_unknown_content_type(self):
+        res = self.post("actors", self.ACTORS_CSV, "application/json")
+
+        self.assertEqual(res.status_code, 415)
+        self.assertEqual(json.loads(res.data)["message"], "Unsupported Media Type")
+
+    def test_401_import_without_permission(self):
+        res = self.post("actors", self.ACTORS_CSV, token=CASTING_DIRECTOR_TOKEN)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(json.loads(res.data)["message"], "Permission not found.")
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+            f.write(self.ACTORS_CSV)
+        try:
+            result = self.app.test_cli_runner().invoke(
+                args=["import", "actors", f.name]
+            )
+        finally:
+            os.remove(f.name)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("line 3:", result.output)
+        self.assertIn("2 inserted, 0 updated, 1 failed", result.output)
+
+
+class ChangeFeedTestCase(TransactionalTestCase):
+    """
+    This class represents the change feed test case
+    """
+
+    MOVIE = {
+        "title": "Feed",
+        "genres": ["Drama"],
+        "release_date": "2030-01-01",
+        "seeking_actor": True,
+    }
+
+    def request(self, method, path, body=None):
+        return getattr(self.client(), method)(
+            path,
+            data=json.dumps(body) if body is not None else None,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+
+    def changes(self, since=None, **args):
+        if since is not None:
+            args["since"] = since
+        res = self.client().get(
+            "/changes",
+            query_string=args,
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+        )
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    def test_writes_are_recorded_in_order(self):
+        cursor = self.changes(limit=1000)["cursor"]
+
+        movie_id = json.loads(self.request("post", "/movies/create", self.MOVIE).data)[
+            "added_movie_id"
+        ]
+        self.request("patch", f"/movies/{movie_id}", {"title": "Feed 2"})
+        self.request("delete", f"/movies/{movie_id}")
+        data = self.changes(cursor)
+
+        self.assertEqual(
+            [(c["entity"], c["entity_id"], c["operation"]) for c in data["changes"]],
+            [
+                ("movie", movie_id, "insert"),
+                ("movie", movie_id, "update"),
+                ("movie", movie_id, "delete"),
+            ],
+        )
+        inserted, updated, deleted = data["changes"]
+        self.assertEqual(inserted["data"]["genres"], ["Drama"])
+        self.assertEqual(
+            (updated["data"]["title"], updated["data"]["version"]), ("Feed 2", 2)
+        )
+        self.assertIsNone(deleted["data"])
+        self.assertEqual(data["cursor"], deleted["cursor"])
+
+        # Nothing new after the last cursor
+        self.assertEqual(self.changes(data["cursor"])["changes"], [])
+        self.assertEqual(self.changes(data["cursor"])["cursor"], data["cursor"])
+
+    def test_deleting_an_actor_records_its_castings(self):
+        cursor = self.changes(limit=1000)["cursor"]
+        with self.app.app_context():
+            casting_ids = {casting.id for casting in Actor.query.get(1).castings}
+
+        self.request("delete", "/actors/1")
+        changes = self.changes(cursor)["changes"]
+
+        self.assertIn(("actor", 1), {(c["entity"], c["entity_id"]) for c in changes})
+        self.assertEqual(
+            {c["entity_id"] for c in changes if c["entity"] == "casting"}, casting_ids
+        )
+        self.assertTrue(all(c["operation"] == "delete" for c in changes))
+
+    def test_pages_follow_the_cursor(self):
+        all_changes = self.changes(limit=1000)["changes"]
+        self.assertGreater(len(all_changes), 2)
+
+        first = self.changes(limit=2)
+        second = self.changes(first["cursor"], limit=2)
+
+        self.assertEqual(first["changes"] + second["changes"], all_changes[:4])
+
+    def test_422_invalid_cursor(self):
+        res = self.client().get(
+            "/changes?since=abc",
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+        )
+
+        self.assertEqual(res.status_code, 422)
+        self.assertIn("since", json.loads(res.data)["errors"])
+
+    def test_401_changes_without_permission(self):
+        res = self.client().get(
+            "/changes", headers={"Authorization": f"Bearer {CASTING_DIRECTOR_TOKEN}"}
+        )
+
+        self.assertEqual(res.status_code, 401)
+
+    def test_import_records_changes(self):
+        cursor = self.changes(limit=1000)["cursor"]
+        self.client().post(
+            "/movies/import",
+            data=json.dumps(dict(self.MOVIE, id=1)) + "\n" + json.dumps(self.MOVIE),
+            headers={
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                "Content-Type": "application/x-ndjson",
+            },
+        )
+        changes = self.changes(cursor)["changes"]
+
+        self.assertEqual(sorted(c["operation"] for c in changes), ["insert", "update"])
+        self.assertTrue(all(c["data"]["title"] == "Feed" for c in changes))
+
+    def test_stream_sends_changes_as_events(self):
+        changes = self.changes(limit=3)["changes"]
+        self.app.config.update(CHANGES_STREAM_SECONDS=0, CHANGES_POLL_SECONDS=0)
+        try:
+            res = self.client().get(
+                "/changes/stream",
+                headers={
+                    "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                    "Last-Event-ID": changes[0]["cursor"],
+                },
+            )
+            body = res.get_data(as_text=True)
+        finally:
+            del self.app.config["CHANGES_STREAM_SECONDS"]
+            del self.app.config["CHANGES_POLL_SECONDS"]
+
+        self.assertEqual(res.mimetype, "text/event-stream")
+        events = [
+            event.split("\n") for event in body.split("\n\n") if event.startswith("id:")
+        ]
+        self.assertEqual(
+            [
+                (id, name, json.loads(data[len("data: ") :]))
+                for id, name, data in events[:2]
+            ],
+            [
+                (f"id: {change['cursor']}", "event: change", change)
+                for change in changes[1:]
+            ],
+        )
+
+
+class ChangeFeedHorizonTestCase(TransactionalTestCase):
+    """
+    This class represents the change feed test case with real commits
+    """
+
+    transactional = False
+
+    def test_changes_wait_for_older_running_transactions(self):
+        with self.app.app_context():
+            blocker = db.engine.connect()
+        transaction = blocker.begin()
+        # Takes a transaction id lower than the write below
+        blocker.execute(text("SELECT pg_current_xact_id()"))
+        try:
+            self.client().post(
+                "/movies/create",
+                data=json.dumps(ChangeFeedTestCase.MOVIE),
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                },
+            )
+            titles = self.movie_titles()
+        finally:
+            transaction.rollback()
+            blocker.close()
+
+        self.assertNotIn("Feed", titles)
+        # Tests of other pytest-xdist workers may hold the horizon back for
+        # a moment too, it is cluster wide
+        deadline = time.monotonic() + 5
+        while "Feed" not in self.movie_titles() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIn("Feed", self.movie_titles())
+
+    def movie_titles(self):
+        res = self.client().get(
+            "/changes?limit=1000",
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+        )
+        return [
+            change["data"]["title"]
+            for change in json.loads(res.data)["changes"]
+            if change["entity"] == "movie" and change["data"]
+        ]
+
+
+class DeltaSyncTestCase(TransactionalTestCase):
+    """
+    This class represents the delta sync test case
+    """
+
+    def request(self, method, path, body=None):
+        return getattr(self.client(), method)(
+            path,
+            data=json.dumps(body) if body is not None else None,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+            },
+        )
+
+    def now(self):
+        return self.connection.execute(
+            text("SELECT clock_timestamp()::timestamp")
+        ).scalar()
+
+    def sync(self, kind, since):
+        res = self.client().get(
+            f"/{kind}",
+            query_string={"updated_since": str(since)},
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+        )
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    def test_sync_returns_changed_and_deleted_rows(self):
+        since = self.now()
+        self.request("patch", "/actors/2", {"age": 26})
+        # Also deletes its castings with movies 1 and 2
+        self.request("delete", "/actors/3")
+
+        actors = self.sync("actors", since)
+        self.assertEqual([actor["id"] for actor in actors["actors"]], [2])
+        self.assertEqual(actors["actors"][0]["age"], 26)
+        self.assertEqual(actors["deleted"], [3])
+
+        movies = self.sync("movies", since)
+        self.assertEqual(sorted(movie["id"] for movie in movies["movies"]), [1, 2])
+        self.assertEqual(movies["deleted"], [])
+
+    def test_nothing_changed(self):
+        data = self.sync("actors", self.now())
+
+        self.assertEqual((data["actors"], data["deleted"]), ([], []))
+
+    def test_renaming_an_actor_touches_the_movies_showing_it(self):
+        since = self.now()
+        self.request("patch", "/actors/3", {"first_name": "Jon"})
+
+        movies = self.sync("movies", since)["movies"]
+
+        # Actor 3 is only accepted for movie 1
+        self.assertEqual([movie["id"] for movie in movies], [1])
+        self.assertIn(
+            {"actor": "Jon Holms", "role": "second"}, movies[0]["accepted_actors"]
+        )
+
+    def test_importing_castings_touches_their_parents(self):
+        since = self.now()
+        self.client().post(
+            "/castings/import",
+            data=json.dumps(
+                {
+                    "actor_id": 2,
+                    "movie_id": 3,
+                    "role": "lead",
+                    "casting_date": "2030-01-01 10:00:00",
+                    "casting_address": "1 Main street",
+                    "status": "accept",
+                }
+            ),
+            headers={
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                "Content-Type": "application/x-ndjson",
+            },
+        )
+
+        self.assertEqual([a["id"] for a in self.sync("actors", since)["actors"]], [2])
+        self.assertEqual([m["id"] for m in self.sync("movies", since)["movies"]], [3])
+
+    def test_watermark_waits_for_running_writers(self):
+        self.request("patch", "/actors/2", {"age": 26})
+        # The test's transaction is still running
+        started = self.connection.execute(text("SELECT now()::timestamp")).scalar()
+
+        watermark = self.sync("actors", self.now())["watermark"]
+
+        self.assertLessEqual(
+            datetime.fromisoformat(watermark), started - WATERMARK_MARGIN
+        )
+
+    def test_422_invalid_updated_since(self):
+        res = self.client().get(
+            "/movies?updated_since=yesterday",
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+        )
+
+        self.assertEqual(res.status_code, 422)
+        self.assertIn("updated_since", json.loads(res.data)["errors"])
+
+
+class DeleteTestCase(TransactionalTestCase):
+    """
+    This class represents the delete test case
+    """
+
+    def delete(self, path, **headers):
+        return self.client().delete(
+            path,
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}", **headers},
+        )
+
+    def count_statements(self, path):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", count)
+        try:
+            res = self.delete(path)
+        finally:
+            event.remove(self.connection, "before_cursor_execute", count)
+        self.assertEqual(res.status_code, 200)
+        return len(statements)
+
+    def test_delete_returns_compact_rows(self):
+        res = self.delete("/actors/3")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data["deleted_actor"], {"id": 3, "full_name": "John Holms", "version": 1}
+        )
+        self.assertEqual(data["deleted_castings"], 2)
+
+    def test_statements_dont_grow_with_castings(self):
+        self.connection.execute(
+            Casting.__table__.insert(),
+            [
+                {
+                    "actor_id": 2,
+                    "movie_id": 3,
+                    "role": "extra",
+                    "casting_date": datetime(2030, 1, 1) + timedelta(days=i),
+                    "casting_duration": 60,
+                    "casting_address": "1 Main street",
+                    "status": StatusType.in_process,
+                }
+                for i in range(50)
+            ],
+        )
+
+        # Actor 1 has one casting
+        self.assertEqual(
+            self.count_statements("/actors/2"), self.count_statements("/actors/1")
+        )
+
+    def test_stats_and_rollup_follow_cascaded_castings(self):
+        with self.app.app_context():
+            refresh_rollup()
+            self.assertEqual(Movie.query.get(1).format_json()["casting_total"], 2)
+
+        self.delete("/actors/3")
+
+        with self.app.app_context():
+            self.assertEqual(Movie.query.get(1).format_json()["casting_total"], 1)
+            self.assertEqual(
+                CastingRollup.query.filter_by(status=StatusType.accept).count(), 0
+            )
+
+    def test_orm_delete_cascades_in_the_database(self):
+        with self.app.app_context():
+            Movie.query.get(1).delete()
+
+            self.assertEqual(Casting.query.filter(Casting.movie_id == 1).count(), 0)
+            self.assertEqual(ActorStats.query.get(1).casting_total, 0)
+
+    def test_412_delete_stale_version(self):
+        res = self.delete("/movies/1", **{"If-Match": '"2"'})
+
+        self.assertEqual(res.status_code, 412)
+        with self.app.app_context():
+            self.assertIsNotNone(Movie.query.get(1))
+
+    def test_bulk_delete(self):
+        res = self.delete("/actors?ids=3,1,999")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor["id"] for actor in data["deleted_actors"]], [1, 3])
+        self.assertEqual(data["deleted_castings"], 3)
+        self.assertEqual(data["missing"], [999])
+        with self.app.app_context():
+            self.assertEqual([actor.id for actor in Actor.query.all()], [2])
+
+    def test_404_bulk_delete_unknown_ids(self):
+        res = self.delete("/movies?ids=998,999")
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_422_bulk_delete_invalid_ids(self):
+        for ids in ("", "1,a", ",".join(str(i) for i in range(1, 1002))):
+            res = self.delete(f"/movies?ids={ids}")
+
+            self.assertEqual(res.status_code, 422)
+            self.assertIn("ids", json.loads(res.data)["errors"])
+
+
+class HotQueryTestCase(TransactionalTestCase):
+    """
+    This class represents the hot query test case
+    """
+
+    def get(self, path):
+        res = self.client().get(
+            path, headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"}
+        )
+        self.assertEqual(res.status_code, 200)
+        return json.loads(res.data)
+
+    def test_lambda_statements_bind_new_values(self):
+        self.assertEqual(self.get("/actors/1")["actor"]["id"], 1)
+        self.assertEqual(self.get("/actors/2")["actor"]["id"], 2)
+        self.assertEqual(self.get("/movies/3")["movie"]["id"], 3)
+
+    def test_prepared_statements(self):
+        expected = [self.get(path) for path in ("/actors/1", "/actors/2", "/movies")]
+
+        event.listen(
+            self.connection, "before_cursor_execute", prepare_statement, retval=True
+        )
+        try:
+            data = [self.get(path) for path in ("/actors/1", "/actors/2", "/movies")]
+        finally:
+            event.remove(self.connection, "before_cursor_execute", prepare_statement)
+
+        self.assertEqual(data, expected)
+        statements = (
+            self.connection.execute(
+                text("SELECT statement FROM pg_prepared_statements")
+            )
+            .scalars()
+            .all()
+        )
+        self.assertTrue(any('FROM "Actors"' in sql for sql in statements))
+        self.assertTrue(any('FROM "Movies"' in sql for sql in statements))
+
+
+class BatchGetTestCase(TransactionalTestCase):
+    """
+    This class represents the GET by id list test case
+    """
+
+    def get(self, path):
+        return self.client().get(
+            path, headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"}
+        )
+
+    def test_ids_in_request_order(self):
+        res = self.get("/actors?ids=3,999,1,3")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor["id"] for actor in data["actors"]], [3, 1])
+        self.assertEqual(data["missing"], [999])
+        self.assertEqual(
+            data["actors"][0], json.loads(self.get("/actors/3").data)["actor"]
+        )
+
+    def count_statements(self, path):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", count)
+        try:
+            self.assertEqual(self.get(path).status_code, 200)
+        finally:
+            event.remove(self.connection, "before_cursor_execute", count)
+        return len(statements)
+
+    def test_statements_dont_grow_with_ids(self):
+        self.assertEqual(
+            self.count_statements("/movies?ids=2,1,3"),
+            self.count_statements("/movies?ids=1"),
+        )
+
+    def test_404_no_id_found(self):
+        self.assertEqual(self.get("/movies?ids=998,999").status_code, 404)
+
+    def test_422_invalid_ids(self):
+        for query in (
+            "ids=1,x",
+            "ids=" + ",".join(str(i) for i in range(1, 102)),
+            "ids=1&updated_since=2020-01-01",
+        ):
+            res = self.get(f"/actors?{query}")
+
+            self.assertEqual(res.status_code, 422)
+            self.assertIn("ids", json.loads(res.data)["errors"])
+
+
+class GraphQueryTestCase(TransactionalTestCase):
+    """
+    This class represents the POST /query test case
+    """
+
+    def query(self, body, token=EXECUTIVE_PRODUCER_TOKEN):
+        return self.client().post(
+            "/query", json=body, headers={"Authorization": f"Bearer {token}"}
+        )
+
+    def movies_with_actors(self, ids):
+        return {
+            "movies": {
+                "ids": ids,
+                "fields": [
+                    "title",
+                    {
+                        "castings": {
+                            "fields": [
+                                "role",
+                                {"actor": {"fields": ["full_name", "photo_link"]}},
+                            ]
+                        }
+                    },
+                ],
+            }
+        }
+
+    def test_nested_fields(self):
+        body = self.movies_with_actors([2, 1])
+        body["movies"]["fields"][1]["castings"]["status"] = "accept"
+        res = self.query(body)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        movies = data["data"]["movies"]
+        self.assertEqual([movie["title"] for movie in movies], ["Smile", "Big house"])
+        self.assertEqual(movies[0]["castings"], [])
+        [casting] = movies[1]["castings"]
+        self.assertEqual(set(casting), {"role", "actor"})
+        self.assertEqual(casting["actor"]["full_name"], "John Holms")
+        self.assertEqual(set(casting["actor"]), {"full_name", "photo_link"})
+
+    def count_statements(self, body):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            # Not the savepoints of the test transaction
+            if statement.startswith("SELECT"):
+                statements.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", count)
+        try:
+            self.assertEqual(self.query(body).status_code, 200)
+        finally:
+            event.remove(self.connection, "before_cursor_execute", count)
+        return len(statements)
+
+    def test_one_statement_per_relation(self):
+        self.assertEqual(self.count_statements(self.movies_with_actors([1, 2, 3])), 3)
+        self.assertEqual(
+            self.count_statements(self.movies_with_actors([1, 2, 3])),
+            self.count_statements(self.movies_with_actors([2])),
+        )
+
+    def test_castings_limit_per_parent(self):
+        res = self.query(
+            {
+                "actors": {
+                    "ids": [3],
+                    "fields": ["id", {"castings": {"limit": 1, "fields": ["id"]}}],
+                }
+            }
+        )
+        [actor] = json.loads(res.data)["data"]["actors"]
+
+        self.assertEqual(actor["castings"], [{"id": 2}])
+
+    def test_422_too_costly(self):
+        body = {
+            "movies": {
+                "limit": 100,
+                "fields": [{"castings": {"limit": 100, "fields": ["id"]}}],
+            }
+        }
+        res = self.query(body)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertIn("body", json.loads(res.data)["errors"])
+
+    def test_422_too_deep(self):
+        fields = ["id"]
+        for relation in ("movie", "castings", "actor", "castings"):
+            fields = [{relation: {"fields": fields}}]
+        res = self.query({"actors": {"ids": [1], "fields": fields}})
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_422_unknown_field(self):
+        for fields, error in (
+            (["title", "budget"], "movies.fields"),
+            ([{"directors": {"fields": ["id"]}}], "movies.directors"),
+            ([{"castings": {"fields": ["id"], "first": 2}}], "movies.castings.first"),
+        ):
+            res = self.query({"movies": {"fields": fields}})
+
+            self.assertEqual(res.status_code, 422)
+            self.assertIn(error, json.loads(res.data)["errors"])
+
+    def test_401_no_authorization_header(self):
+        res = self.client().post("/query", json=self.movies_with_actors([1]))
+
+        self.assertEqual(res.status_code, 401)
+
+
+class MetricsTestCase(TransactionalTestCase):
+    """
+    This class represents the request metrics and access log test case
+    """
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def get(self, path, **headers):
+        headers.setdefault("Authorization", f"Bearer {EXECUTIVE_PRODUCER_TOKEN}")
+        return self.client().get(path, headers=headers)
+
+    def test_requests_by_route_and_status(self):
+        labels = {"method": "GET", "route": "/actors/<int:actor_id>"}
+        requests = self.sample("http_requests_total", status="200", **labels)
+        not_found = self.sample("http_requests_total", status="404", **labels)
+        latencies = self.sample("http_request_duration_seconds_count", **labels)
+
+        self.get("/actors/1")
+        self.get("/actors/2")
+        self.get("/actors/999")
+
+        self.assertEqual(
+            self.sample("http_requests_total", status="200", **labels), requests + 2
+        )
+        self.assertEqual(
+            self.sample("http_requests_total", status="404", **labels), not_found + 1
+        )
+        self.assertEqual(
+            self.sample("http_request_duration_seconds_count", **labels),
+            latencies + 3,
+        )
+        self.assertEqual(self.sample("http_requests_in_flight", **labels), 0)
+
+    def test_unmatched_paths_share_a_label(self):
+        before = self.sample(
+            "http_requests_total", method="GET", route="<unmatched>", status="404"
+        )
+        self.get("/no/such/path")
+
+        self.assertEqual(
+            self.sample(
+                "http_requests_total", method="GET", route="<unmatched>", status="404"
+            ),
+            before + 1,
+        )
+
+    def test_auth_failures_by_code(self):
+        code = "authorization_header_missing"
+        before = self.sample("http_auth_failures_total", code=code)
+        self.client().get("/actors")
+
+        self.assertEqual(self.sample("http_auth_failures_total", code=code), before + 1)
+
+    def test_metrics_endpoint(self):
+        self.get("/actors/1")
+        res = self.client().get("/metrics")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain"))
+        self.assertIn(b"http_request_duration_seconds_bucket{", res.data)
+
+    def test_json_access_log_with_request_id(self):
+        self.app.config["ACCESS_LOG"] = True
+        try:
+            with self.assertLogs("casting_agency.access") as logs:
+                res = self.get("/actors/1", **{"X-Request-ID": "abc-123"})
+                generated = self.client().get("/actors")
+        finally:
+            self.app.config["ACCESS_LOG"] = False
+
+        self.assertEqual(res.headers["X-Request-ID"], "abc-123")
+        first, second = (json.loads(record.getMessage()) for record in logs.records)
+        self.assertEqual(first["request_id"], "abc-123")
+        self.assertEqual(first["route"], "/actors/<int:actor_id>")
+        self.assertEqual((first["status"], first["path"]), (200, "/actors/1"))
+        self.assertEqual(first["bytes"], len(res.data))
+        self.assertEqual(second["request_id"], generated.headers["X-Request-ID"])
+        self.assertEqual(second["auth_failure"], "authorization_header_missing")
+
+
+class ProfilingTestCase(TransactionalTestCase):
+    """
+    This class represents the request profiling test case
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.app.config.update(PROFILING_ENABLED=True, PROFILE_SAMPLE_RATE=0.0)
+
+    def tearDown(self):
+        self.app.config.update(PROFILING_ENABLED=False, PROFILE_SAMPLE_RATE=0.0)
+        super().tearDown()
+
+    def get(self, path, token=EXECUTIVE_PRODUCER_TOKEN, **headers):
+        headers["Authorization"] = f"Bearer {token}"
+        return self.client().get(path, headers=headers)
+
+    def test_cprofile_on_demand(self):
+        res = self.get("/movies", **{"X-Profile": "cprofile"})
+        profile_id = res.headers["X-Profile-Id"]
+
+        self.assertEqual(res.status_code, 200)
+        profiles = json.loads(self.get("/profiles").data)["profiles"]
+        self.assertEqual(profiles[0]["id"], profile_id)
+        self.assertEqual(
+            (profiles[0]["mode"], profiles[0]["path"]), ("cprofile", "/movies")
+        )
+
+        report = self.get(f"/profiles/{profile_id}")
+        self.assertEqual(report.content_type, "text/plain; charset=utf-8")
+        self.assertIn(b"function calls", report.data)
+        # The report only lists the top functions, so look in the whole dump
+        with tempfile.NamedTemporaryFile(suffix=".prof") as dump:
+            dump.write(self.get(f"/profiles/{profile_id}?format=prof").data)
+            dump.flush()
+            stats = pstats.Stats(dump.name).stats
+        self.assertTrue(any(name == "format_json" for _, _, name in stats))
+
+    def test_header_needs_permission(self):
+        res = self.get("/movies", CASTING_ASSISTANT_TOKEN, **{"X-Profile": "cprofile"})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("X-Profile-Id", res.headers)
+        self.assertEqual(self.get("/profiles", CASTING_DIRECTOR_TOKEN).status_code, 401)
+
+    def test_sampled_requests(self):
+        self.app.config["PROFILE_SAMPLE_RATE"] = 1.0
+        res = self.get("/actors/1", CASTING_ASSISTANT_TOKEN)
+
+        # Only callers who asked for a profile learn its id
+        self.assertNotIn("X-Profile-Id", res.headers)
+        profile = json.loads(self.get("/profiles").data)["profiles"][0]
+        self.assertEqual((profile["mode"], profile["path"]), ("sample", "/actors/1"))
+        self.assertEqual(
+            self.get(f"/profiles/{profile['id']}?format=prof").status_code, 404
+        )
+
+    def test_404_unknown_profile(self):
+        self.assertEqual(self.get("/profiles/unknown").status_code, 404)
+
+
+class ProfilerTestCase(unittest.TestCase):
+    """
+    This class represents the stack sampler and profile store test case
+    """
+
+    def test_collapsed_stacks(self):
+        def busy_loop():
+            deadline = time.monotonic() + 0.1
+            while time.monotonic() < deadline:
+                pass
+
+        sampler = StackSampler(threading.get_ident(), 0.001)
+        sampler.start()
+        busy_loop()
+        sampler.stop()
+
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(any("busy_loop (test_app.py:" in line for line in lines))
+
+    def test_keeps_the_last_profiles(self):
+        store = ProfileStore(keep=2)
+        for profile_id in ("a", "b", "c"):
+            store.add(type("Profile", (), {"id": profile_id})())
+
+        self.assertEqual([profile.id for profile in store.all()], ["c", "b"])
+        self.assertIsNone(store.get("a"))
+
+
+class ConfigTestCase(unittest.TestCase):
+    """
+    This class represents the configuration test case
+    """
+
+    def production(self, **settings):
+        config = {
+            key: getattr(ProductionConfig, key)
+            for key in dir(ProductionConfig)
+            if key.isupper()
+        }
+        config.update(DATABASE_URL="postgresql://localhost/casting_agency")
+        config.update(settings)
+        return config
+
+    def test_production_config_is_valid(self):
+        self.assertIs(load_config("production"), ProductionConfig)
+        validate_config(self.production(), "production")
+
+    def test_production_rejects_debug_and_seeding(self):
+        with self.assertRaises(ConfigError) as raised:
+            validate_config(self.production(DEBUG=True, SEED_DB=True), "production")
+
+        self.assertEqual(set(raised.exception.errors), {"DEBUG", "SEED_DB"})
+
+    def test_invalid_settings(self):
+        for settings, key in (
+            ({"DATABASE_URL": None}, "DATABASE_URL"),
+            ({"DATABASE_URL": "sqlite://"}, "DATABASE_URL"),
+            ({"ENTITY_CACHE_SIZE": -1}, "ENTITY_CACHE_SIZE"),
+            (
+                {"SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 0}},
+                "SQLALCHEMY_ENGINE_OPTIONS",
+            ),
+        ):
+            with self.assertRaises(ConfigError) as raised:
+                validate_config(self.production(**settings), "production")
+
+            self.assertIn(key, raised.exception.errors)
+
+    def test_default_config_neither_debugs_nor_seeds(self):
+        app_env = os.environ.pop("APP_ENV", None)
+        try:
+            config = load_config()
+        finally:
+            if app_env is not None:
+                os.environ["APP_ENV"] = app_env
+
+        self.assertIs(config, Config)
+        self.assertFalse(config.DEBUG)
+        self.assertFalse(config.SEED_DB)
+        self.assertTrue(load_config("development").SEED_DB)
+
+    @unittest.skipIf(os.getenv("TEST_AUTH") == "auth0", "uses the local auth provider")
+    def test_lists_are_served_first_without_seeding(self):
+        get_test_app()
+        # A new process, as the mappers are configured once per process
+        script = textwrap.dedent(
+            """
+            from app import create_app
+            from auth.testing import LocalAuthProvider
+            from fixtures import DB_PATH_TEST, worker_database_url
+
+            provider = LocalAuthProvider()
+            provider.install()
+            headers = {
+                "Authorization": "Bearer " + provider.role_token("casting_assistant")
+            }
+            app = create_app(
+                {
+                    "DATABASE_URL": worker_database_url(DB_PATH_TEST),
+                    "SEED_DB": False,
+                },
+                env="test",
+            )
+            client = app.test_client()
+            for path in ("/actors", "/movies", "/actors?ids=1,2", "/movies?ids=1"):
+                print(client.get(path, headers=headers).status_code)
+            """
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+
+        self.assertEqual(result.stdout.split(), ["200"] * 4, result.stderr)
+
+    def test_unknown_env(self):
+        with self.assertRaises(ConfigError) as raised:
+            load_config("staging")
+
+        self.assertIn("APP_ENV", raised.exception.errors)
+
+    def test_test_app_runs_without_debug(self):
+        app = get_test_app()
+
+        self.assertFalse(app.debug)
+        self.assertTrue(app.json.compact)
+
+
+class EntityCacheTestCase(unittest.TestCase):
+    """
+    This class represents the entity cache test case
+    """
+
+    def test_hit_and_lru_eviction(self):
+        cache = EntityCache(max_bytes=10)
+        for key in ("a", "b"):
+            cache.get(key, lambda: (1, b"12345"))
+        cache.get("a", lambda: self.fail("cached"))
+        cache.get("c", lambda: (1, b"12345"))
+
+        self.assertEqual((cache.hits, cache.misses, cache.size), (1, 3, 10))
+        self.assertEqual(cache.get("b", lambda: (2, b"x")), (2, b"x"))
+
+    def test_expired_values_are_loaded_again(self):
+        cache = EntityCache(ttl=0)
+        cache.get("a", lambda: (1, b"old"))
+
+        self.assertEqual(cache.get("a", lambda: (2, b"new")), (2, b"new"))
+
+    def test_none_is_not_kept(self):
+        cache = EntityCache()
+        self.assertIsNone(cache.get("a", lambda: None))
+        self.assertEqual(cache.get("a", lambda: (1, b"x")), (1, b"x"))
+
+    def test_concurrent_misses_load_once(self):
+        cache = EntityCache()
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.1)
+            return 1, b"x"
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            values = list(executor.map(lambda i: cache.get("a", load), range(8)))
+
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(values, [(1, b"x")] * 8)
+
+    def test_load_racing_an_invalidation_is_not_kept(self):
+        cache = EntityCache()
+
+        def load():
+            # A write commits while the old row is being read
+            cache.invalidate([("actor", 1)])
+            return 1, b"old"
+
+        self.assertEqual(cache.get(("actor", 1), load), (1, b"old"))
+        self.assertEqual(cache.get(("actor", 1), lambda: (2, b"new")), (2, b"new"))
+
+
+class EntityCacheRouteTestCase(TransactionalTestCase):
+    """
+    This class represents the cached GET /actors/<id> test case
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.cache = EntityCache()
+        self.app.extensions["entity_cache"] = self.cache
+
+    def tearDown(self):
+        del self.app.extensions["entity_cache"]
+        super().tearDown()
+
+    def request(self, method, path, **kwargs):
+        return getattr(self.client(), method)(
+            path,
+            headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+            **kwargs,
+        )
+
+    def test_second_get_runs_no_query(self):
+        first = self.request("get", "/actors/1")
+
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", count)
+        try:
+            second = self.request("get", "/actors/1")
+        finally:
+            event.remove(self.connection, "before_cursor_execute", count)
+
+        self.assertEqual(statements, [])
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+
+    def test_404_not_cached(self):
+        self.assertEqual(self.request("get", "/movies/10000").status_code, 404)
+        self.assertEqual(self.cache.size, 0)
+
+    def test_write_drops_the_entity(self):
+        self.request("get", "/actors/2")
+        self.request("patch", "/actors/2", json={"age": 26})
+
+        res = self.request("get", "/actors/2")
+
+        self.assertEqual(json.loads(res.data)["actor"]["age"], 26)
+        self.assertEqual(res.headers["ETag"], '"2"')
+
+    def test_casting_write_drops_its_actor_and_movie(self):
+        actor = json.loads(self.request("get", "/actors/2").data)["actor"]
+        movie = json.loads(self.request("get", "/movies/3").data)["movie"]
+        self.client().post(
+            "/castings/import",
+            data=json.dumps(
+                {
+                    "actor_id": 2,
+                    "movie_id": 3,
+                    "role": "lead",
+                    "casting_date": "2030-01-01 10:00:00",
+                    "casting_address": "1 Main street",
+                    "status": "accept",
+                }
+            ),
+            headers={
+                "Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}",
+                "Content-Type": "application/x-ndjson",
+            },
+        )
+
+        self.assertEqual(
+            json.loads(self.request("get", "/actors/2").data)["actor"]["casting_total"],
+            actor["casting_total"] + 1,
+        )
+        self.assertEqual(
+            json.loads(self.request("get", "/movies/3").data)["movie"]["casting_total"],
+            movie["casting_total"] + 1,
+        )
+
+    def test_renaming_a_movie_drops_its_accepted_actors(self):
+        self.request("get", "/actors/3")
+        self.request("patch", "/movies/1", json={"title": "Bigger house"})
+
+        movies = json.loads(self.request("get", "/actors/3").data)["actor"][
+            "movies_success"
+        ]
+
+        self.assertIn({"movie": "Bigger house", "role": "second"}, movies)
+
+
+class LocalAuthProviderTestCase(unittest.TestCase):
+    """
+    This class represents the offline auth provider test case
+    """
+
+    def tearDown(self):
+        auth_provider.install()
+
+    def test_keys_are_fetched_from_served_jwks(self):
+        provider = LocalAuthProvider()
+        provider.serve()
+        try:
+            payload = verify_decode_jwt(provider.role_token("casting_director"))
+        finally:
+            provider.shutdown()
+
+        self.assertEqual(payload["sub"], "local|casting_director")
+        self.assertIn("patch:movies", payload["permissions"])
+        self.assertEqual(key_store.jwks, provider.jwks)
+
+    def test_token_with_arbitrary_permissions(self):
+        token = auth_provider.token(["get:actors"], sub="local|someone")
+        payload = verify_decode_jwt(token)
+
+        self.assertEqual(payload["permissions"], ["get:actors"])
+
+    def test_forged_and_garbage_tokens_are_rejected(self):
+        for token in (auth_provider.forged_token(), "not-a-token"):
+            with self.assertRaises(AuthError) as context:
+                verify_decode_jwt(token)
+            self.assertEqual(context.exception.status_code, 400)
+
+
+class SchemaTestCase(unittest.TestCase):
+    """
+    This class represents the request schema test case
+    """
+
+    def test_load_converts_values(self):
+        movie = MOVIE_SCHEMA.load(
+            {
+                "title": "Smile",
+                "genres": ["Comedy"],
+                "release_date": "2023.12.12",
+                "seeking_actor": True,
+            }
+        )
+
+        self.assertEqual(movie["release_date"].year, 2023)
+        self.assertEqual(
+            ACTOR_SCHEMA.load({"gender": "male"}, True), {"gender": GenderType.male}
+        )
+        self.assertEqual(ACTOR_SCHEMA.load({"age": "29"}, True), {"age": 29})
+        # Offsets are converted to UTC, as the columns have no time zone
+        casting_date = CASTING_SCHEMA.load(
+            {"casting_date": "2023-01-10T12:30+02:00"}, True
+        )["casting_date"]
+        self.assertEqual(casting_date, datetime(2023, 1, 10, 10, 30))
+
+    def test_load_reports_every_invalid_field(self):
+        with self.assertRaises(ValidationError) as context:
+            ACTOR_SCHEMA.load({"age": True, "seeking_movie": "yes", "nickname": "x"})
+
+        errors = context.exception.errors
+        self.assertIn("age", errors)
+        self.assertIn("seeking_movie", errors)
+        self.assertEqual(errors["nickname"], "Unknown field.")
+        self.assertEqual(errors["email"], "Missing required field.")
+
+    def test_partial_load_accepts_subset(self):
+        self.assertEqual(
+            MOVIE_SCHEMA.load({"title": "Smile"}, True), {"title": "Smile"}
+        )
+        with self.assertRaises(ValidationError):
+            MOVIE_SCHEMA.load({}, True)
+
+
+class UnitOfWorkTestCase(TransactionalTestCase):
+    """
+    This class represents the unit of work test case
+    """
+
+    def new_movie(self, title):
+        return Movie(
+            title=title, genres=["Drama"], release_date="2030.01.01", seeking_actor=True
+        )
+
+    def test_failed_unit_of_work_leaves_nothing_behind(self):
+        with self.app.app_context():
+            with self.assertRaises(ValueError):
+                with UnitOfWork():
+                    self.new_movie("first").insert()
+                    self.new_movie("second").insert()
+                    raise ValueError()
+
+            self.assertEqual(Movie.query.count(), 3)
+
+    def test_nested_unit_of_work_rolls_back_to_savepoint(self):
+        with self.app.app_context():
+            with UnitOfWork():
+                self.new_movie("kept").insert()
+                try:
+                    with UnitOfWork():
+                        self.new_movie("dropped").insert()
+                        raise ValueError()
+                except ValueError:
+                    pass
+
+            titles = [movie.title for movie in Movie.query.all()]
+            self.assertIn("kept", titles)
+            self.assertNotIn("dropped", titles)
+
+    def test_decorator_retries_serialization_failures(self):
+        class SerializationFailure(Exception):
+            pgcode = "40001"
+
+        attempts = []
+
+        @UnitOfWork(retries=2)
+        def add_movie():
+            attempts.append(1)
+            self.new_movie("retried").insert()
+            if len(attempts) < 2:
+                raise OperationalError("COMMIT", {}, SerializationFailure())
+
+        with self.app.app_context():
+            add_movie()
+
+            self.assertEqual(len(attempts), 2)
+            self.assertEqual(Movie.query.filter(Movie.title == "retried").count(), 1)
+
+    def test_routes_retry_serialization_failures(self):
+        class SerializationFailure(Exception):
+            pgcode = "40001"
+
+        attempts = []
+
+        def fail_first_insert(conn, cursor, statement, *args):
+            if statement.startswith('INSERT INTO "Movies"'):
+                attempts.append(statement)
+                if len(attempts) == 1:
+                    raise OperationalError(statement, {}, SerializationFailure())
+
+        event.listen(self.connection, "before_cursor_execute", fail_first_insert)
+        try:
+            res = self.client().post(
+                "/movies/create",
+                json={
+                    "title": "retried",
+                    "genres": ["Drama"],
+                    "release_date": "2024-01-01",
+                    "seeking_actor": True,
+                },
+                headers={"Authorization": f"Bearer {EXECUTIVE_PRODUCER_TOKEN}"},
+            )
+        finally:
+            event.remove(self.connection, "before_cursor_execute", fail_first_insert)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(attempts), 2)
+        with self.app.app_context():
+            self.assertEqual(Movie.query.filter(Movie.title == "retried").count(), 1)
+
+
+@unittest.skipUnless(DB_PATH_REPLICA_TEST, "DATABASE_URL_REPLICA_TEST is not set")
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """
+    This class represents the read replica routing test case
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        setup_db(self.app, DB_PATH_TEST, DB_PATH_REPLICA_TEST)
+        self.router = self.app.extensions["replica_router"]
+
+    def test_get_reads_from_replica(self):
+        with self.app.test_request_context("/actors", method="GET"):
+            self.assertIs(db.session.get_bind(mapper=Actor), db.engines["replica"])
+
+    def test_write_requests_use_primary(self):
+        with self.app.test_request_context("/actors/create", method="POST"):
+            self.assertIs(db.session.get_bind(mapper=Actor), db.engines[None])
+
+    def test_client_reads_from_primary_after_write(self):
+        headers = {"Authorization": "Bearer writer"}
+        with self.app.test_request_context(
+            "/actors/1", method="PATCH", headers=headers
+        ):
+            db.session.info["wrote"] = True
+            db.session.commit()
+
+        with self.app.test_request_context("/actors", method="GET", headers=headers):
+            self.assertIs(db.session.get_bind(mapper=Actor), db.engines[None])
+
+        headers = {"Authorization": "Bearer reader"}
+        with self.app.test_request_context("/actors", method="GET", headers=headers):
+            self.assertIs(db.session.get_bind(mapper=Actor), db.engines["replica"])
+
+    def test_pin_reaches_other_workers(self):
+        with self.app.test_request_context(
+            "/actors/1", method="PATCH", headers={"Authorization": "Bearer writer"}
+        ):
+            db.session.info["wrote"] = True
+            db.session.commit()
+            response = self.app.process_response(self.app.response_class())
+        pin = parse_cookie(response.headers["Set-Cookie"])[PIN_COOKIE]
+
+        # Another worker, which never saw the write
+        worker = Flask(__name__)
+        setup_db(worker, DB_PATH_TEST, DB_PATH_REPLICA_TEST)
+        for cookie, engine in (
+            (pin, None),
+            # Expired, or beyond any window a worker sets
+            (f"{time.time() - 1}", "replica"),
+            (f"{time.time() + 3600}", "replica"),
+            ("x", "replica"),
+        ):
+            with worker.test_request_context(
+                "/actors",
+                method="GET",
+                headers={
+                    "Authorization": "Bearer writer",
+                    "Cookie": f"{PIN_COOKIE}={cookie}",
+                },
+            ):
+                self.assertIs(db.session.get_bind(mapper=Actor), db.engines[engine])
+
+    def test_session_kept_on_primary(self):
+        with self.app.test_request_context("/actors", method="GET"):
+            db.session.info["primary"] = True
+            self.assertIs(db.session.get_bind(mapper=Actor), db.engines[None])
+
+    def test_falls_back_to_primary_when_replica_unavailable(self):
+        self.router.health.mark_unavailable()
+        with self.app.test_request_context("/actors", method="GET"):
+            self.assertIs(db.session.get_bind(mapper=Actor), db.engines[None])
+
+
 if __name__ == "__main__":
     unittest.main()